@@ -0,0 +1,67 @@
+# bench/bench_catalog.py
+"""
+Mesaj kataloğu mikrobenchmark'ı: dil sayısı arttıkça mesaj alma + şablon doldurma
+maliyetinin sabit kaldığını gösterir. Eski iç içe sözlük araması (MESSAGES[key][lang] +
+str.format) ile derlenmiş katalog (text_for) karşılaştırılır.
+
+    python bench/bench_catalog.py --languages 1,3,10,50,200
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOKEN", "0:bench")
+
+import bot  # noqa: E402
+
+PLAIN_KEY = "list_header"
+TEMPLATE_KEY = "match_new_order"
+
+
+def synthetic_messages(count):
+    """Mevcut çevirileri çoğaltarak `count` dilli bir MESSAGES kopyası üretir (bir kısmı eksik çeviriyle)"""
+    base = list(bot.LANGUAGES)
+    messages = {}
+    for key, texts in bot.MESSAGES.items():
+        messages[key] = {}
+        for i in range(count):
+            source = texts.get(base[i % len(base)])
+            # Her üç dilden biri yedek zincirine düşsün
+            if source is not None and (i < len(base) or i % 3):
+                messages[key][f"l{i}" if i >= len(base) else base[i]] = source
+    return messages
+
+
+def legacy_lookup(messages, key, lang, **values):
+    text = messages.get(key, {}).get(lang, messages.get(key, {}).get("en", ""))
+    return text.format(**values) if values else text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--languages", default="1,3,10,50,200")
+    parser.add_argument("--number", type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'langs':>6} {'legacy plain':>13} {'legacy tmpl':>12} {'catalog plain':>14} {'catalog tmpl':>13}  (ns/call)")
+    for count in (int(x) for x in args.languages.split(",")):
+        messages = synthetic_messages(count)
+        ids, tables = bot.compile_catalog(messages)
+        bot._CATALOG = tables
+        lang = list(tables)[-1]
+        plain_id, template_id = ids[PLAIN_KEY], ids[TEMPLATE_KEY]
+        cases = [
+            lambda: legacy_lookup(messages, PLAIN_KEY, lang),
+            lambda: legacy_lookup(messages, TEMPLATE_KEY, lang, id=42),
+            lambda: bot.text_for(lang, plain_id),
+            lambda: bot.text_for(lang, template_id, id=42),
+        ]
+        assert cases[1]() == cases[3](), (cases[1](), cases[3]())
+        results = [min(timeit.repeat(case, number=args.number, repeat=3)) / args.number * 1e9 for case in cases]
+        print(f"{count:>6} {results[0]:>13.0f} {results[1]:>12.0f} {results[2]:>14.0f} {results[3]:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
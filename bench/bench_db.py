@@ -0,0 +1,120 @@
+# bench/bench_db.py
+"""
+/post_order akışının yaptığı DB çağrılarını eski (her çağrıda connect) ve yeni
+(thread başına kalıcı bağlantı + WAL) db_execute ile karşılaştırır.
+
+    python bench/bench_db.py --flows 2000 --threads 2
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOKEN", "0:bench")
+os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bench_db_"), "pooled.db")
+
+import bot  # noqa: E402
+
+
+def legacy_db_execute(db_file):
+    """Eski db_execute: her çağrıda bağlantı aç/kapat"""
+    def execute(query, params=(), fetch=False, many=False):
+        conn = sqlite3.connect(db_file)
+        c = conn.cursor()
+        if many:
+            c.executemany(query, params)
+            conn.commit()
+            conn.close()
+            return
+        c.execute(query, params)
+        if fetch:
+            rows = c.fetchall()
+            conn.close()
+            return rows
+        conn.commit()
+        conn.close()
+    return execute
+
+
+def post_order_flow(execute, user_id):
+    """Bir /post_order akışındaki DB çağrı dizisi (register_user, state, get_lang ...)"""
+    def get_lang():
+        execute("SELECT lang FROM users WHERE tg_id = ?", (user_id,), fetch=True)
+
+    def set_state(state, data=None):
+        execute(
+            "INSERT OR REPLACE INTO user_states (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)",
+            (user_id, state, data, "2024-01-01T00:00:00")
+        )
+
+    def clear_state():
+        execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+
+    exists = execute("SELECT 1 FROM users WHERE tg_id = ?", (user_id,), fetch=True)
+    if not exists:
+        execute(
+            "INSERT INTO users (tg_id, username, first_name, last_name, registered_at, lang) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, "u", "f", "l", "2024-01-01T00:00:00", "en")
+        )
+    else:
+        execute("UPDATE users SET username = ?, first_name = ?, last_name = ? WHERE tg_id = ?", ("u", "f", "l", user_id))
+    clear_state()
+    set_state("waiting_product")
+    get_lang()
+    for step in ("waiting_weight", "waiting_from_city", "waiting_to_city", "waiting_price", "waiting_order_expiry"):
+        set_state(step, "x")
+        get_lang()
+    get_lang()
+    execute(
+        "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, created_at, expires_at, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, "cable", 0.3, "Istanbul", "Lefkoşa", "10€", "2024-01-01T00:00:00", "2024-01-08T00:00:00", 1)
+    )
+    clear_state()
+    get_lang()
+
+
+def run(execute, flows, threads):
+    per_thread = flows // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            post_order_flow(execute, offset * per_thread + i)
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=2)
+    args = parser.parse_args()
+
+    pooled_file = bot.DB_FILE
+    legacy_file = os.path.join(os.path.dirname(pooled_file), "legacy.db")
+    for db_file in (pooled_file, legacy_file):
+        bot.DB_FILE = db_file
+        bot.init_db()
+        bot.close_db_connections()
+    bot.DB_FILE = pooled_file
+    # Eski davranış: rollback journal, varsayılan pragmalar
+    sqlite3.connect(legacy_file).execute("PRAGMA journal_mode=DELETE").close()
+
+    before = run(legacy_db_execute(legacy_file), args.flows, args.threads)
+    after = run(bot.db_execute, args.flows, args.threads)
+    print(f"legacy  (connect per call): {before:10.1f} flows/s")
+    print(f"pooled  (thread-local+WAL): {after:10.1f} flows/s")
+    print(f"speedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
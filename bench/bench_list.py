@@ -0,0 +1,101 @@
+# bench/bench_list.py
+"""
+/list ve /my_listings sorgularının tablo büyüdükçe gecikmesini ölçer.
+Sentetik veritabanı adım adım büyütülür, her boyutta sorgular indeksli ve
+indekssiz olarak zamanlanır.
+
+    python bench/bench_list.py --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOKEN", "0:bench")
+os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bench_list_"), "list.db")
+
+import bot  # noqa: E402
+
+LIST_ORDERS = "SELECT * FROM orders WHERE +expires_ts > ? AND is_active = 1 ORDER BY created_ts DESC LIMIT 10"
+LIST_TRIPS = "SELECT * FROM trips WHERE +expires_ts > ? AND is_active = 1 ORDER BY created_ts DESC LIMIT 10"
+MY_ORDERS = "SELECT * FROM orders WHERE tg_id = ? AND expires_ts > ? AND is_active = 1 ORDER BY created_ts DESC"
+MY_TRIPS = "SELECT * FROM trips WHERE tg_id = ? AND expires_ts > ? AND is_active = 1 ORDER BY created_ts DESC"
+CITIES = ["Istanbul", "Ankara", "Izmir", "Antalya", "Lefkoşa", "Girne", "Gazimağusa", "Moscow", "London", "Berlin"]
+USERS = 50000
+
+
+def populate(conn, start, count, now):
+    """Son 90 güne yayılmış ilanlar ekler; süresi dolmamışların %90'ı aktif"""
+    orders, trips = [], []
+    for i in range(start, start + count):
+        created = now - timedelta(seconds=(start + count - i) * 7776000 // (start + count))
+        expires = created + timedelta(days=random.choice((3, 7, 14, 30)))
+        active = 1 if expires > now and random.random() < 0.9 else 0
+        a, b = random.sample(CITIES, 2)
+        tg_id = random.randrange(USERS)
+        times = (created.isoformat(), expires.isoformat(), bot.to_ts(created), bot.to_ts(expires))
+        orders.append((tg_id, "item", 0.5, a, b, "10€") + times + (active,))
+        trips.append((tg_id, a, b, expires.date().isoformat(), 5.0, "2€/kg") + times + (bot.to_ts(expires.date()), active))
+    conn.executemany(
+        "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, created_at, expires_at, created_ts, expires_ts, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        orders
+    )
+    conn.executemany(
+        "INSERT INTO trips (tg_id, from_city, to_city, date, capacity_kg, price_per_kg, created_at, expires_at, created_ts, expires_ts, date_ts, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        trips
+    )
+
+
+def timed(query, params, repeat):
+    conn = bot.get_db()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(query, params).fetchall()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def measure(now, repeat):
+    ts = bot.to_ts(now)
+    list_ms = timed(LIST_ORDERS, (ts,), repeat) + timed(LIST_TRIPS, (ts,), repeat)
+    uid = random.randrange(USERS)
+    my_ms = timed(MY_ORDERS, (uid, ts), repeat) + timed(MY_TRIPS, (uid, ts), repeat)
+    return list_ms, my_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",")]
+
+    random.seed(1)
+    bot.init_db()
+    conn = bot.get_db()
+    now = datetime.utcnow()
+    index_sql = [r[0] for r in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")]
+
+    print(f"{'rows/table':>12} {'/list idx':>10} {'/list noidx':>12} {'/my idx':>9} {'/my noidx':>10}  (ms)")
+    total = 0
+    for size in sizes:
+        with bot.db_transaction() as tx:
+            populate(tx, total, size - total, now)
+        total = size
+        conn.execute("ANALYZE")
+        with_idx = measure(now, args.repeat)
+        with bot.db_transaction() as tx:
+            for name, in tx.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+                tx.execute(f"DROP INDEX {name}")
+        without_idx = measure(now, max(1, args.repeat // 10))
+        with bot.db_transaction() as tx:
+            for sql in index_sql:
+                tx.execute(sql)
+        print(f"{size:>12} {with_idx[0]:>10.2f} {without_idx[0]:>12.2f} {with_idx[1]:>9.2f} {without_idx[1]:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+# bench/bench_queries.py
+"""
+bot.py'nin DB'ye dokunan yollarını (handler'lar, zamanlayıcı, dışa aktarım) büyük bir
+veritabanında zamanlar ve sürümler arasında diff'lenebilir bir JSON raporu yazar.
+Her senaryonun çalıştırdığı SQL deyimleri trace callback ile toplanır; SELECT'ler ayrıca
+tek başına zamanlanır ve sorgu planları (tam tablo taraması var mı) rapora eklenir.
+
+    python bench/gen_dataset.py --db /tmp/big.db --users 1000000 --orders 2000000 --trips 1000000
+    python bench/bench_queries.py --db /tmp/big.db --json before.json
+    python bench/bench_queries.py --db /tmp/big.db --json after.json --compare before.json
+
+--db verilmezse gen_dataset parametreleriyle geçici bir veritabanı üretilir. Tüm senaryolar
+tek bir transaction içinde çalışıp sonunda geri alınır; veritabanı değişmez (commit/fsync
+maliyeti bu yüzden ölçüme dahil değildir).
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import gen_dataset  # noqa: E402
+
+# bot ortam değişkenlerini import anında okur; import main() içinde yapılır
+bot = None
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+class Rollback(Exception):
+    pass
+
+
+class NullAPI:
+    """Giden Telegram çağrılarını yutar; yalnızca DB tarafı ölçülür"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def normalize(sql):
+    """Değerleri ? ile değiştirir, boşlukları tekler: aynı deyimin farklı parametreli çağrıları birleşir"""
+    return _IN_LIST.sub("(?)", _LITERALS.sub("?", " ".join(sql.split())))
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._ids = 0
+
+    def _next(self):
+        self._ids += 1
+        return self._ids
+
+    def message(self, user_id, text):
+        message_id = self._next()
+        message = {"message_id": message_id, "date": 0, "chat": {"id": user_id, "type": "private"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"user{user_id}"},
+                   "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return bot.types.Update.de_json({"update_id": message_id, "message": message})
+
+    def callback(self, user_id, data):
+        update_id = self._next()
+        return bot.types.Update.de_json({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "."}}})
+
+
+def build_cases(rng, iterations, export_iterations):
+    """[(isim, tekrar, fonksiyon)]; fonksiyonlar bot.py'deki gerçek yolları çağırır"""
+    factory = UpdateFactory()
+    feed = bot.bot.process_new_updates
+    now = bot.now_ts()
+
+    def active(table, limit):
+        return bot.db_execute(f"SELECT id, tg_id FROM {table} WHERE is_active = 1 AND expires_ts > ? LIMIT ?",
+                              (now, limit), fetch=True) or []
+
+    pool = max(iterations, 200) * 3
+    orders, trips = active("orders", pool), active("trips", pool)
+    if not orders or not trips:
+        raise SystemExit("dataset has no active orders/trips")
+    middle = orders[len(orders) // 2][0]
+    heavy_user = bot.db_execute("SELECT tg_id FROM orders GROUP BY tg_id ORDER BY COUNT(*) DESC LIMIT 1", fetch=True)[0][0]
+    users = bot.db_execute("SELECT MAX(tg_id) FROM users", fetch=True)[0][0] or 1
+    popular, rare = gen_dataset.CITIES[:2], gen_dataset.CITIES[-2:]
+    deactivate_pool = list(orders)
+    expiry_pool = [item_id for item_id, _ in trips]
+    contact_requester = users + 1
+    price_view = bot.ListView(("order",), "EUR", None)
+    # Aynı güzergahta, tarihleri uyan (sipariş, sahibi, yolculuk) çiftleri; her sipariş bir kez yer ayırır
+    reserve_pool = bot.db_execute(
+        "SELECT o.id, o.tg_id, t.id FROM orders o JOIN trips t ON t.from_city_id = o.from_city_id AND t.to_city_id = o.to_city_id "
+        "AND t.is_active = 1 AND t.expires_ts > ? AND t.date_ts <= o.expires_ts AND t.tg_id != o.tg_id "
+        "WHERE o.is_active = 1 AND o.expires_ts > ? GROUP BY o.id LIMIT ?",
+        (now, now, pool), fetch=True
+    ) or []
+
+    def random_user():
+        return rng.randint(1, users)
+
+    def contact_new():
+        nonlocal contact_requester
+        contact_requester += 1
+        item_id, _ = rng.choice(orders)
+        feed([factory.callback(contact_requester, f"contact_order_{item_id}")])
+
+    def contact_repeat():
+        feed([factory.callback(users + 1, f"contact_trip_{trips[0][0]}")])
+
+    def reserve():
+        order_id, owner_id, trip_id = reserve_pool.pop()
+        feed([factory.callback(owner_id, f"reserve_{trip_id}_{order_id}")])
+
+    def deactivate():
+        item_id, owner_id = deactivate_pool.pop()
+        feed([factory.callback(owner_id, f"deactivate_order_{item_id}")])
+
+    def expiry_batch():
+        batch = [expiry_pool.pop() for _ in range(min(bot.EXPIRY_BATCH_SIZE, len(expiry_pool)))]
+        bot.ExpiryScheduler()._deactivate("trip", batch)
+
+    def export(**filters):
+        def run():
+            document, _ = bot.export_listings("order", **filters)
+            document.close()
+        return run
+
+    def cold_user_lookup():
+        bot.user_cache.clear()
+        bot.get_user(random_user())
+
+    def restore():
+        bot._conversations.clear()
+        bot.restore_conversations()
+
+    return [
+        ("list_first_page", iterations, lambda: bot.render_listing_page(random_user())),
+        ("list_deep_page", iterations, lambda: bot.render_listing_page(random_user(), ("order", middle), "next")),
+        ("cmd_list", iterations, lambda: feed([factory.message(random_user(), "/list")])),
+        ("list_page_callback", iterations, lambda: feed([factory.callback(random_user(), f"list_next_order_{middle}")])),
+        ("cmd_my_listings_heavy_user", iterations, lambda: feed([factory.message(heavy_user, "/my_listings")])),
+        ("cmd_my_listings", iterations, lambda: feed([factory.message(random_user(), "/my_listings")])),
+        ("cmd_search_popular_route", iterations, lambda: feed([factory.message(random_user(), "/search {} {}".format(*popular))])),
+        ("list_price_first_page", iterations, lambda: bot.render_listing_page(random_user(), view=price_view)),
+        ("list_price_callback", iterations,
+         lambda: feed([factory.callback(random_user(), f"list_next_order_{middle}_{bot.encode_view(price_view)}")])),
+        ("cmd_list_trips_max_price", iterations, lambda: feed([factory.message(random_user(), "/list trips max=5€")])),
+        ("cmd_search_price", iterations, lambda: feed([factory.message(random_user(), "/search {} {} orders max=20€".format(*popular))])),
+        ("cmd_search_rare_route", iterations, lambda: feed([factory.message(random_user(), "/search {} {}".format(*rare))])),
+        ("contact_callback", iterations, contact_new),
+        ("contact_callback_duplicate", iterations, contact_repeat),
+        ("reserve_callback", min(iterations, len(reserve_pool) - 1), reserve),
+        ("deactivate_callback", min(iterations, len(deactivate_pool) // 2), deactivate),
+        ("match_collect_trip", iterations, lambda: bot.collect_match_notifications("trip", rng.choice(trips)[0])),
+        ("expiry_sync", max(1, iterations // 10), lambda: bot.ExpiryScheduler().sync()),
+        ("expiry_deactivate_batch", max(1, min(iterations // 10, len(expiry_pool) // (2 * bot.EXPIRY_BATCH_SIZE))), expiry_batch),
+        ("restore_conversations", max(1, iterations // 10), restore),
+        ("user_lookup_cold", iterations, cold_user_lookup),
+        ("admin_export_all_orders", export_iterations, export()),
+        ("admin_export_active_last_week", export_iterations,
+         export(fmt="jsonl", active_only=True, since=bot.today_ts() - 7 * bot.DAY_SECONDS, until=bot.today_ts())),
+    ]
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def query_plan(conn, sql):
+    try:
+        return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+    except sqlite3.Error as e:
+        return [f"error: {e}"]
+
+
+def time_statement(conn, sql, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return percentile(times, 0.5) * 1000
+
+
+def run_cases(cases, statement_repeats):
+    conn = bot.get_db()
+    captured = []
+    conn.set_trace_callback(captured.append)
+    report_cases, statements = {}, {}
+    for name, iterations, fn in cases:
+        if iterations <= 0:
+            continue
+        # Bir ısınma/yakalama turu: bu senaryonun çalıştırdığı deyimler
+        captured.clear()
+        fn()
+        seen = defaultdict(int)
+        examples = {}
+        for sql in captured:
+            if sql.lstrip().upper().startswith(("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA")):
+                continue
+            key = normalize(sql)
+            seen[key] += 1
+            examples.setdefault(key, sql)
+        times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        times.sort()
+        report_cases[name] = {
+            "iterations": iterations,
+            "mean_ms": sum(times) / len(times) * 1000,
+            "min_ms": times[0] * 1000,
+            "p50_ms": percentile(times, 0.5) * 1000,
+            "p99_ms": percentile(times, 0.99) * 1000,
+            "statements": dict(sorted(seen.items())),
+        }
+        for key, sql in examples.items():
+            entry = statements.get(key)
+            if entry is None:
+                plan = query_plan(conn, sql)
+                is_select = key.upper().startswith(("SELECT", "WITH"))
+                entry = statements[key] = {
+                    "plan": plan,
+                    "full_scan": any(step.startswith("SCAN") and "USING" not in step for step in plan),
+                    "p50_ms": time_statement(conn, sql, statement_repeats) if is_select else None,
+                    "cases": [],
+                }
+            entry["cases"].append(name)
+        print(f"  {name:<32} p50 {report_cases[name]['p50_ms']:>9.3f} ms  p99 {report_cases[name]['p99_ms']:>9.3f} ms")
+    conn.set_trace_callback(None)
+    return report_cases, statements
+
+
+def dataset_meta():
+    counts = {table: bot.db_execute(f"SELECT COUNT(*) FROM {table}", fetch=True)[0][0]
+              for table in ("users", "orders", "trips", "user_states")}
+    counts["active_orders"] = bot.db_execute("SELECT COUNT(*) FROM orders WHERE is_active = 1", fetch=True)[0][0]
+    counts["active_trips"] = bot.db_execute("SELECT COUNT(*) FROM trips WHERE is_active = 1", fetch=True)[0][0]
+    return counts
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(BENCH_DIR),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    """Senaryo başına p50 değişimini yazdırır; yeni tam taramaları işaretler"""
+    print(f"{'case':<32} {'before':>10} {'after':>10} {'change':>8}")
+    for name, case in report["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if before is None:
+            print(f"{name:<32} {'-':>10} {case['p50_ms']:>10.3f}      new")
+            continue
+        change = (case["p50_ms"] / before["p50_ms"] - 1) * 100 if before["p50_ms"] else 0.0
+        print(f"{name:<32} {before['p50_ms']:>10.3f} {case['p50_ms']:>10.3f} {change:>+7.1f}%")
+    for sql, entry in report["statements"].items():
+        old = baseline.get("statements", {}).get(sql)
+        if entry["full_scan"] and not (old and old["full_scan"]):
+            print(f"⚠️ new full scan: {sql}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", help="gen_dataset.py ile üretilmiş veritabanı (verilmezse geçici olarak üretilir)")
+    gen_dataset.add_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--export-iterations", type=int, default=3)
+    parser.add_argument("--statement-repeats", type=int, default=20, help="SELECT deyimlerinin tek başına tekrar sayısı")
+    parser.add_argument("--json", help="raporun yazılacağı dosya")
+    parser.add_argument("--compare", help="önceki rapor; senaryo başına değişim yazdırılır")
+    args = parser.parse_args()
+
+    global bot
+    os.environ.setdefault("TOKEN", "0:bench")
+    generated = None
+    if args.db:
+        if not os.path.exists(args.db):
+            parser.error(f"{args.db} does not exist (create it with bench/gen_dataset.py)")
+        os.environ["DB_FILE"] = args.db
+    else:
+        os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bench_queries_"), "queries.db")
+    import bot
+
+    if args.db:
+        bot.init_db()  # bekleyen migration'lar
+    else:
+        generated = gen_dataset.generate(**gen_dataset.dataset_params(args))
+    bot.outbox = bot.SendDispatcher(NullAPI())
+    bot.bot.answer_callback_query = NullAPI().answer_callback_query
+    bot.bot.threaded = False
+
+    rng = random.Random(args.seed)
+    print(f"Dataset: {dataset_meta()}")
+    try:
+        with bot.db_transaction():
+            cases = build_cases(rng, args.iterations, args.export_iterations)
+            report_cases, statements = run_cases(cases, args.statement_repeats)
+            raise Rollback()
+    except Rollback:
+        pass
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "generated_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "dataset": dataset_meta(),
+            "generated": generated,
+        },
+        "cases": report_cases,
+        "statements": statements,
+    }
+    scans = [sql for sql, entry in statements.items() if entry["full_scan"]]
+    print(f"{len(statements)} distinct statements, {len(scans)} with full table scans")
+    for sql in scans:
+        print(f"  SCAN: {sql[:140]}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
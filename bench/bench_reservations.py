@@ -0,0 +1,193 @@
+# bench/bench_reservations.py
+"""
+Yolculuk rezervasyonları için eşzamanlılık stres testi: az sayıda yolculuğa çok sayıda sipariş,
+birden fazla süreç ve her süreçte birden fazla thread ile aynı anda bot.reserve_trip çağırır
+(bir kısmı hemen cancel_reservation ile geri alınır). Sonunda veritabanında şu değişmezler
+denetlenir; biri bozulursa çıkış kodu 1 olur:
+
+  - hiçbir yolculukta reserved_kg > capacity_kg değil (aşırı rezervasyon yok)
+  - reserved_kg, yolculuğun aktif rezervasyonlarının ağırlık toplamına eşit
+  - dolan (boş kapasitesi kalmayan) yolculuk kapalı (closed_full)
+  - boş yeri olan yolculuk açık: dolup kapanan yolculuk bir iptalle yer açılınca yeniden açılmış
+  - her siparişin en fazla bir aktif rezervasyonu var
+
+Ardından dolup kapanan her yolculukta bir rezervasyon iptal edilir ve yolculuğun yeniden açıldığı denetlenir.
+
+    python bench/bench_reservations.py --trips 5 --orders 2000 --processes 4 --threads 8
+    python bench/bench_reservations.py --trips 1 --capacity 10 --orders 500 --cancel-rate 0.3
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# spawn ile başlayan worker'lar bu dosyayı __mp_main__ olarak tekrar import eder;
+# ortam ayarları ve `bot` importu bu yüzden yalnızca main() / worker içinde yapılır
+bot = None
+
+FROM_CITY, TO_CITY = "Istanbul", "Ankara"
+TRIP_OWNER_BASE = 1000000
+
+
+def setup(trips, capacity, orders, seed):
+    """Yolculukları ve siparişleri ekler; [(order_id, owner_id)] ve yolculuk id'lerini döner"""
+    rng = random.Random(seed)
+    bot.init_db()
+    from_id, to_id = bot.resolve_city_id(FROM_CITY), bot.resolve_city_id(TO_CITY)
+    now = bot.now_ts()
+    date_ts = bot.today_ts() + 7 * bot.DAY_SECONDS
+    with bot.db_transaction() as conn:
+        conn.executemany(
+            "INSERT INTO trips (tg_id, from_city, to_city, date, capacity_kg, price_per_kg, created_ts, expires_ts, date_ts, is_active, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, '5€/kg', ?, ?, ?, 1, ?, ?)",
+            [(TRIP_OWNER_BASE + i, FROM_CITY, TO_CITY, bot.ts_to_day(date_ts), capacity, now, date_ts + bot.DAY_SECONDS, date_ts, from_id, to_id)
+             for i in range(trips)]
+        )
+        conn.executemany(
+            "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, created_ts, expires_ts, is_active, from_city_id, to_city_id) VALUES (?, 'item', ?, ?, ?, '10€', ?, ?, 1, ?, ?)",
+            [(i + 1, round(rng.uniform(0.1, 3.0), 1), FROM_CITY, TO_CITY, now, date_ts + 30 * bot.DAY_SECONDS, from_id, to_id)
+             for i in range(orders)]
+        )
+    order_rows = bot.db_execute("SELECT id, tg_id FROM orders ORDER BY id", fetch=True)
+    trip_ids = [row[0] for row in bot.db_execute("SELECT id FROM trips ORDER BY id", fetch=True)]
+    return order_rows, trip_ids
+
+
+def run_worker(assignments, trip_ids, threads, cancel_rate, seed, start_at):
+    """Bir sürecin işi: siparişleri thread'lere bölüp aynı anda rezervasyon dener; sonuç sayaçlarını döner"""
+    import threading
+
+    global bot
+    import bot as bot_module
+    bot = bot_module
+    counts = Counter()
+    lock = threading.Lock()
+
+    def attempt(chunk, thread_seed):
+        rng = random.Random(thread_seed)
+        local = Counter()
+        for order_id, owner_id in chunk:
+            # Aynı siparişi aynı anda iki yolculuğa ayırmaya çalışan çift tıklamalar da olsun
+            for trip_id in rng.sample(trip_ids, min(len(trip_ids), 2 if rng.random() < 0.2 else 1)):
+                try:
+                    result, reservation = bot.reserve_trip(trip_id, order_id, owner_id)
+                except Exception as e:
+                    local[f"error:{type(e).__name__}"] += 1
+                    continue
+                local[result] += 1
+                if reservation is not None and rng.random() < cancel_rate:
+                    local["cancelled" if bot.cancel_reservation(reservation.id, owner_id) else "cancel_failed"] += 1
+        with lock:
+            counts.update(local)
+
+    chunks = [assignments[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=attempt, args=(chunk, seed * 1000 + i)) for i, chunk in enumerate(chunks)]
+    # Tüm süreçler aynı anda başlasın ki yazarlar gerçekten çakışsın
+    time.sleep(max(0.0, start_at - time.time()))
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    bot.close_db_connections()
+    return dict(counts)
+
+
+def check_invariants():
+    """Bozulan değişmezlerin listesi"""
+    problems = []
+    trips = bot.db_execute("SELECT id, capacity_kg, reserved_kg, is_active, closed_full FROM trips", fetch=True)
+    ledger = dict(bot.db_execute(
+        "SELECT trip_id, round(SUM(weight_kg), 3) FROM reservations WHERE status = 'active' GROUP BY trip_id", fetch=True
+    ) or [])
+    for trip_id, capacity_kg, reserved_kg, is_active, closed_full in trips:
+        if reserved_kg > capacity_kg + 1e-9:
+            problems.append(f"trip #{trip_id} overbooked: {reserved_kg} > {capacity_kg} kg")
+        if abs(reserved_kg - ledger.get(trip_id, 0.0)) > 1e-6:
+            problems.append(f"trip #{trip_id} reserved_kg {reserved_kg} != ledger sum {ledger.get(trip_id, 0.0)}")
+        full = bot.remaining_capacity(capacity_kg, reserved_kg) <= 0
+        if full and (is_active or not closed_full):
+            problems.append(f"trip #{trip_id} is full but not closed as full (is_active={is_active}, closed_full={closed_full})")
+        if not full and not is_active:
+            problems.append(f"trip #{trip_id} has {bot.remaining_capacity(capacity_kg, reserved_kg)} kg free but was not reopened")
+    doubled = bot.db_execute(
+        "SELECT order_id, COUNT(*) FROM reservations WHERE status = 'active' GROUP BY order_id HAVING COUNT(*) > 1", fetch=True
+    ) or []
+    problems.extend(f"order #{order_id} has {count} active reservations" for order_id, count in doubled)
+    return problems
+
+
+def check_reopen():
+    """Dolu her yolculukta bir rezervasyonu iptal eder; yeniden açılmayan yolculukların listesini döner"""
+    problems = []
+    full_trips = bot.db_execute("SELECT id FROM trips WHERE closed_full = 1", fetch=True) or []
+    for (trip_id,) in full_trips:
+        reservation_id, requester_id = bot.db_execute(
+            "SELECT id, requester_id FROM reservations WHERE trip_id = ? AND status = 'active' ORDER BY id LIMIT 1",
+            (trip_id,), fetch=True
+        )[0]
+        if bot.cancel_reservation(reservation_id, requester_id) is None:
+            problems.append(f"reservation #{reservation_id} on full trip #{trip_id} could not be cancelled")
+            continue
+        is_active, closed_full = bot.db_execute("SELECT is_active, closed_full FROM trips WHERE id = ?", (trip_id,), fetch=True)[0]
+        if not is_active or closed_full:
+            problems.append(f"trip #{trip_id} was not reopened after a cancellation")
+    return len(full_trips), problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trips", type=int, default=5)
+    parser.add_argument("--capacity", type=float, default=20.0, help="yolculuk başına kapasite (kg)")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="süreç başına thread")
+    parser.add_argument("--cancel-rate", type=float, default=0.1, help="başarılı rezervasyonlardan hemen iptal edilenlerin oranı")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    global bot
+    os.environ.setdefault("TOKEN", "0:bench")
+    os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bench_reservations_"), "reservations.db")
+    import bot
+
+    order_rows, trip_ids = setup(args.trips, args.capacity, args.orders, args.seed)
+    bot.close_db_connections()
+    print(f"{len(trip_ids)} trips x {args.capacity} kg, {len(order_rows)} orders, "
+          f"{args.processes} processes x {args.threads} threads")
+
+    start_at = time.time() + 1.0
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(args.processes) as pool:
+        jobs = [pool.apply_async(run_worker, (order_rows[i::args.processes], trip_ids, args.threads, args.cancel_rate,
+                                              args.seed + i, start_at))
+                for i in range(args.processes)]
+        results = [job.get() for job in jobs]
+    elapsed = time.time() - start_at
+    counts = Counter()
+    for result in results:
+        counts.update(result)
+
+    attempts = sum(v for k, v in counts.items() if not k.startswith("cancel"))
+    full = bot.db_execute("SELECT COUNT(*) FROM trips WHERE is_active = 0", fetch=True)[0][0]
+    reserved = bot.db_execute("SELECT round(SUM(reserved_kg), 3), round(SUM(capacity_kg), 3) FROM trips", fetch=True)[0]
+    print(f"attempts: {attempts} in {elapsed:.2f}s ({attempts / elapsed if elapsed > 0 else 0:.0f}/s)  results: {dict(counts)}")
+    print(f"reserved: {reserved[0]} / {reserved[1]} kg  closed trips: {full} / {len(trip_ids)}")
+    problems = check_invariants()
+    if not problems:
+        reopened, problems = check_reopen()
+        print(f"cancelled one reservation on each of {reopened} full trips")
+        problems += check_invariants()
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems or any(k.startswith("error") for k in counts):
+        sys.exit(1)
+    print("✅ no overbooking; ledger and trip totals agree; freed trips reopened")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# bench/bench_search.py
+"""
+/search gecikmesini ölçer: çok sayıda aktif ilan varken güzergah araması
+(bellekteki route index + PK okuma) ne kadar sürüyor.
+
+    python bench/bench_search.py --listings 300000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("TOKEN", "0:bench")
+os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bench_search_"), "search.db")
+
+import bot  # noqa: E402
+
+CITIES = ["Istanbul", "Ankara", "Izmir", "Antalya", "Lefkoşa", "Girne", "Gazimağusa", "Moscow", "London", "Berlin",
+          "Paris", "Baku", "Tbilisi", "Dubai", "Bursa", "Konya", "Larnaca", "Limassol", "Sochi", "Kyiv"]
+
+
+def populate(count):
+    now = datetime.utcnow()
+    orders, trips = [], []
+    for i in range(count):
+        a, b = random.sample(CITIES, 2)
+        created = now - timedelta(minutes=count - i)
+        expires = now + timedelta(days=random.randint(1, 30))
+        trip_date = (now + timedelta(days=random.randint(0, 60))).date()
+        times = (created.isoformat(), expires.isoformat(), bot.to_ts(created), bot.to_ts(expires))
+        ka, kb = bot.normalize_city_key(a), bot.normalize_city_key(b)
+        ia, ib = bot.resolve_city_id(a), bot.resolve_city_id(b)
+        orders.append((i, "item", 0.5, a, b, "10€") + times + (1, ka, kb, ia, ib))
+        trips.append((i, a, b, trip_date.isoformat(), 5.0, "2€/kg") + times + (bot.to_ts(trip_date), 1, ka, kb, ia, ib))
+    with bot.db_transaction() as conn:
+        conn.executemany(
+            "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, created_at, expires_at, created_ts, expires_ts, is_active, from_key, to_key, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            orders
+        )
+        conn.executemany(
+            "INSERT INTO trips (tg_id, from_city, to_city, date, capacity_kg, price_per_kg, created_at, expires_at, created_ts, expires_ts, date_ts, is_active, from_key, to_key, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            trips
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--listings", type=int, default=300000, help="orders ve trips için ayrı ayrı")
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    random.seed(1)
+    bot.init_db()
+    populate(args.listings)
+    start = time.perf_counter()
+    bot.route_index.sync()
+    print(f"route index load: {len(bot.route_index)} listings in {time.perf_counter() - start:.2f}s")
+
+    samples = []
+    for _ in range(args.queries):
+        a, b = random.sample(CITIES, 2)
+        ia, ib = bot.lookup_city_id(a), bot.lookup_city_id(b)
+        day = bot.today_ts() + random.randint(0, 50) * bot.DAY_SECONDS
+        start = time.perf_counter()
+        bot.search_listings("order", ia, ib)
+        bot.search_listings("trip", ia, ib, date_from=day, date_to=day)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(f"search (orders+trips): p50 {statistics.median(samples):.2f} ms, "
+          f"p99 {samples[int(len(samples) * 0.99) - 1]:.2f} ms, max {samples[-1]:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
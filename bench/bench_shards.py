@@ -0,0 +1,99 @@
+# bench/bench_shards.py
+"""
+Sharded modun (BOT_MODE=sharded) ölçeklenmesini ölçer: aynı güncelleme akışını
+1, 2, 4 ... worker süreciyle işler ve saniyedeki güncelleme sayısını karşılaştırır.
+Giden çağrılar bench/fake_api.py ile yerel sahte API'ye gider.
+
+    python bench/bench_shards.py --users 1000 --shards 1,2,4
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_api import FakeTelegramAPI  # noqa: E402
+
+# spawn ile başlayan worker'lar bu dosyayı __mp_main__ olarak tekrar import eder;
+# ortam ayarları ve `bot` importu bu yüzden yalnızca main() içinde yapılır
+bot = None
+api = None
+
+CITIES = ["Istanbul", "Ankara", "Izmir", "Lefkoşa", "Girne", "Moscow", "London", "Berlin"]
+_update_ids = itertools.count(1)
+
+
+def update(user_id, text):
+    message = {"message_id": next(_update_ids), "date": int(time.time()),
+               "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"},
+               "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": message["message_id"], "message": message}
+
+
+def user_session(user_id):
+    a, b = CITIES[user_id % len(CITIES)], CITIES[(user_id + 3) % len(CITIES)]
+    return ["/start", "/list", f"/search {a} {b}", "/post_order", "item", "0.5", a, b, "10€", "7", "/my_listings"]
+
+
+def workload(users, first_user_id):
+    """Kullanıcıların oturumlarını iç içe geçirir (her kullanıcının kendi sırası korunur)"""
+    sessions = [[update(first_user_id + i, text) for text in user_session(first_user_id + i)] for i in range(users)]
+    return [u for step in itertools.zip_longest(*sessions) for u in step if u is not None]
+
+
+def run(shards, updates):
+    router = bot.ShardRouter(shards, queue_size=len(updates) + 1)
+    router.start()
+    calls_before = sum(api.calls.values())
+    start = time.perf_counter()
+    for payload in updates:
+        router.dispatch(payload)
+    router.stop(timeout=600)
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(api.calls.values()) - calls_before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--shards", default="1,2,4")
+    args = parser.parse_args()
+
+    global api, bot
+    api = FakeTelegramAPI().start()
+    os.environ.setdefault("TOKEN", "0:bench")
+    os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="bench_shards_"), "shards.db")
+    os.environ["TELEGRAM_API_URL"] = api.url
+    # Hız limitleri ölçümü bozmasın
+    for name in ("SEND_GLOBAL_RATE", "SEND_CHAT_RATE", "SEND_CHAT_BURST"):
+        os.environ[name] = "1000000"
+    import bot
+
+    bot.init_db()
+    shard_counts = [int(x) for x in args.shards.split(",")]
+    print(f"CPU cores: {os.cpu_count()}")
+    if max(shard_counts) > (os.cpu_count() or 1):
+        print("⚠️ More shards than cores: speedup is capped by the core count (the fake API also needs CPU)")
+    print(f"{'shards':>6} {'updates':>8} {'seconds':>8} {'upd/s':>8} {'speedup':>8} {'api calls':>10}")
+    baseline = None
+    for i, shards in enumerate(shard_counts):
+        updates = workload(args.users, 1_000_000 * (i + 1))
+        elapsed, calls = run(shards, updates)
+        rate = len(updates) / elapsed
+        baseline = baseline or rate
+        print(f"{shards:>6} {len(updates):>8} {elapsed:>8.2f} {rate:>8.0f} {rate / baseline:>7.2f}x {calls:>10}")
+    orders = bot.db_execute("SELECT COUNT(*) FROM orders", fetch=True)[0][0]
+    print(f"orders created: {orders} (expected {args.users * (i + 1)})")
+    api.stop()
+
+
+if __name__ == "__main__":
+    main()
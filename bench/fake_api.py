@@ -0,0 +1,139 @@
+# bench/fake_api.py
+"""
+Yerel sahte Telegram Bot API sunucusu. TELEGRAM_API_URL ile bot'un giden
+çağrıları buraya yönlendirilir; ağ erişimi olmadan yük testi yapılabilir.
+
+    python bench/fake_api.py --port 8081 --latency 0.05 --jitter 0.02 --error-rate 0.01
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python bot.py
+
+--error-rate verilirse çağrıların o oranı 429 (Too Many Requests, retry_after) ile reddedilir.
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class FakeTelegramAPI:
+    """Bot API metodlarına geçerli görünen cevaplar dönen ve çağrıları sayan HTTP sunucusu"""
+
+    # Bu metodlar hız sınırına takılmaz (polling / kurulum çağrıları)
+    UNLIMITED = ("getMe", "getUpdates", "setWebhook", "deleteWebhook")
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self.server = _Server((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                api.handle(self)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def result_for(self, method, params):
+        """Metoda göre Telegram'ın döneceği 'result' alanı"""
+        if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0) or 0)
+            return {"message_id": next(self._message_ids), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        if method == "getUpdates":
+            return []
+        return True
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        method = url.path.rsplit("/", 1)[-1]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(request.headers.get("Content-Length", 0) or 0)
+        if length:
+            body = request.rfile.read(length)
+            if request.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+        with self._lock:
+            self.calls[method] += 1
+            delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            throttle = self.error_rate and method not in self.UNLIMITED and self._random.random() < self.error_rate
+            if throttle:
+                self.throttled[method] += 1
+        if delay > 0:
+            time.sleep(delay)
+        if throttle:
+            status = 429
+            data = json.dumps({"ok": False, "error_code": 429,
+                               "description": f"Too Many Requests: retry after {self.retry_after}",
+                               "parameters": {"retry_after": self.retry_after}}).encode()
+        else:
+            status = 200
+            data = json.dumps({"ok": True, "result": self.result_for(method, params)}).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="her çağrıya eklenen gecikme (saniye)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="gecikmeye eklenen ± rastgele sapma (saniye)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429 ile reddedilen çağrı oranı (0-1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 cevaplarındaki retry_after (saniye)")
+    args = parser.parse_args()
+    api = FakeTelegramAPI(args.host, args.port, args.latency, args.jitter, args.error_rate, args.retry_after)
+    print(f"Fake Telegram API on {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(dict(api.calls))
+    if api.throttled:
+        print("429:", dict(api.throttled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# bench/gen_dataset.py
+"""
+Ölçek testleri için sentetik veritabanı üretir: users, orders, trips ve user_states
+tablolarını gerçekçi dağılımlarla doldurur (popüler şehir çiftleri Zipf ağırlıklı,
+az sayıda çok ilan veren kullanıcı, oluşturma zamanları --days boyunca, ilan süreleri
+dağınık, aktif oranı ayarlanabilir). Şema bot.init_db ile oluşturulur.
+
+    python bench/gen_dataset.py --db /tmp/big.db --users 1000000 --orders 2000000 --trips 1000000 --states 50000
+    python bench/bench_queries.py --db /tmp/big.db --json report.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CITIES = ["Istanbul", "Ankara", "Izmir", "Antalya", "Lefkoşa", "Girne", "Gazimağusa", "Moscow", "London", "Berlin",
+          "Paris", "Baku", "Tbilisi", "Dubai", "Bursa", "Konya", "Larnaca", "Limassol", "Sochi", "Kyiv"]
+PRODUCTS = ["documents", "phone", "laptop", "medicine", "books", "clothes", "coffee", "cosmetics", "toys", "spices"]
+LANGS = (("tr", 0.6), ("en", 0.25), ("ru", 0.15))
+ORDER_STEPS = ("product", "weight", "from_city", "to_city", "price", "expires_at")
+TRIP_STEPS = ("from_city", "to_city", "date", "capacity_kg", "price_per_kg")
+BATCH = 20000
+
+
+def city_pair(rng, weights):
+    """Zipf ağırlıklı, farklı iki şehir"""
+    a, b = rng.choices(CITIES, weights, k=2)
+    while b == a:
+        b = rng.choices(CITIES, weights)[0]
+    return a, b
+
+
+def owner(rng, users, skew):
+    """Küçük id'li kullanıcılara yığılan sahip dağılımı (skew büyüdükçe birkaç kullanıcı çok ilan verir)"""
+    return 1 + int(users * rng.random() ** skew)
+
+
+def listing_status(rng, now, expires_ts, active_ratio):
+    # Süresi geçenler zamanlayıcı tarafından kapatılmıştır; kalanların bir kısmını sahipleri kapatmıştır
+    return 1 if expires_ts > now and rng.random() < active_ratio else 0
+
+
+def order_price(rng):
+    """Çoğunlukla '25€' gibi; bir kısmı TL, kg başı ya da ayrıştırılamayan serbest metin"""
+    roll = rng.random()
+    if roll < 0.75:
+        return f"{rng.randint(5, 80)}€"
+    if roll < 0.85:
+        return f"{rng.randint(100, 2500)} TL"
+    if roll < 0.95:
+        return f"{rng.randint(2, 12)}€/kg"
+    return "pazarlık"
+
+
+def generate(users=10000, orders=20000, trips=10000, states=1000, active_ratio=0.7, days=90, skew=3.0, seed=0):
+    """DB_FILE'daki veritabanını doldurur; `bot` bu fonksiyondan önce DB_FILE ayarlanarak import edilebilir olmalı"""
+    import bot
+
+    rng = random.Random(seed)
+    bot.init_db()
+    weights = [1 / (rank + 1) for rank in range(len(CITIES))]
+    city_ids = {city: bot.resolve_city_id(city) for city in CITIES}
+    city_keys = {city: bot.normalize_city_key(city) for city in CITIES}
+    now = datetime.utcnow()
+    now_ts = bot.to_ts(now)
+    start = now - timedelta(days=days)
+    span = (now - start).total_seconds()
+    conn = bot.get_db()
+    conn.execute("PRAGMA synchronous = OFF")
+    timings = {}
+
+    def insert(table, sql, rows_iter, count):
+        began = time.perf_counter()
+        batch = []
+        for row in rows_iter:
+            batch.append(row)
+            if len(batch) >= BATCH:
+                with bot.db_transaction() as tx:
+                    tx.executemany(sql, batch)
+                batch = []
+        if batch:
+            with bot.db_transaction() as tx:
+                tx.executemany(sql, batch)
+        timings[table] = time.perf_counter() - began
+        print(f"  {table}: {count} rows in {timings[table]:.1f}s")
+
+    def created(i, total):
+        # id sırası zaman sırasıyla aynı; saniyeye yuvarlandığı için yoğun veride aynı created_ts'li ilanlar da olur
+        return start + timedelta(seconds=int(span * (i + rng.random()) / max(total, 1)))
+
+    def times(created_at, expires_at):
+        return created_at.isoformat(), expires_at.isoformat(), bot.to_ts(created_at), bot.to_ts(expires_at)
+
+    def user_rows():
+        langs, lang_weights = zip(*LANGS)
+        for tg_id in range(1, users + 1):
+            registered = (start + timedelta(seconds=rng.uniform(0, span))).isoformat()
+            lang = rng.choices(langs, lang_weights)[0] if rng.random() < 0.95 else None
+            yield (tg_id, f"user{tg_id}" if rng.random() < 0.8 else None, f"U{tg_id}", "", registered, lang)
+
+    def order_rows():
+        for i in range(orders):
+            a, b = city_pair(rng, weights)
+            created_at = created(i, orders)
+            stamps = times(created_at, created_at + timedelta(days=rng.choice((1, 3, 7, 7, 7, 14, 30))))
+            weight, price = round(rng.lognormvariate(0, 0.8), 1), order_price(rng)
+            yield (owner(rng, users, skew), rng.choice(PRODUCTS), weight, a, b,
+                   price) + bot.price_fields("order", price, weight) + stamps + (listing_status(rng, now_ts, stamps[3], active_ratio),
+                   city_keys[a], city_keys[b], city_ids[a], city_ids[b])
+
+    def trip_rows():
+        for i in range(trips):
+            a, b = city_pair(rng, weights)
+            created_at = created(i, trips)
+            trip_date = (created_at + timedelta(days=rng.randint(0, 45))).date()
+            stamps = times(created_at, datetime.combine(trip_date + timedelta(days=1), datetime.min.time()))
+            price = f"{rng.randint(2, 15)}€/kg"
+            yield (owner(rng, users, skew), a, b, trip_date.isoformat(), float(rng.randint(1, 30)),
+                   price) + bot.price_fields("trip", price) + stamps + (bot.to_ts(trip_date),
+                   listing_status(rng, now_ts, stamps[3], active_ratio),
+                   city_keys[a], city_keys[b], city_ids[a], city_ids[b])
+
+    def state_rows():
+        for user_id in rng.sample(range(1, users + 1), min(states, users)):
+            flow, steps = rng.choice((("order", ORDER_STEPS), ("trip", TRIP_STEPS)))
+            step = rng.randrange(len(steps))
+            data = {name: "x" for name in steps[:step]}
+            # Bir kısmı CONVERSATION_TTL_HOURS'tan eski (terk edilmiş akış)
+            updated_at = (now - timedelta(hours=rng.expovariate(1 / 12))).isoformat()
+            yield (user_id, f"{flow}:{steps[step]}", json.dumps(data), updated_at)
+
+    print(f"Generating into {bot.DB_FILE} ...")
+    insert("users", "INSERT OR IGNORE INTO users (tg_id, username, first_name, last_name, registered_at, lang) VALUES (?, ?, ?, ?, ?, ?)",
+           user_rows(), users)
+    insert("orders", "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, price_cents, price_currency, price_unit, created_at, expires_at, created_ts, expires_ts, is_active, from_key, to_key, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+           order_rows(), orders)
+    insert("trips", "INSERT INTO trips (tg_id, from_city, to_city, date, capacity_kg, price_per_kg, price_cents, price_currency, price_unit, created_at, expires_at, created_ts, expires_ts, date_ts, is_active, from_key, to_key, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+           trip_rows(), trips)
+    insert("user_states", "INSERT OR REPLACE INTO user_states (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)",
+           state_rows(), min(states, users))
+    conn.execute("PRAGMA optimize")  # bot.init_db ile aynı; ayrıca ANALYZE yapılmaz
+    conn.execute(f"PRAGMA synchronous = {bot.DB_SYNCHRONOUS}")
+    return {
+        "users": users, "orders": orders, "trips": trips, "states": min(states, users),
+        "active_ratio": active_ratio, "days": days, "skew": skew, "seed": seed,
+        "insert_seconds": {table: round(seconds, 3) for table, seconds in timings.items()},
+    }
+
+
+def add_arguments(parser):
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--trips", type=int, default=10000)
+    parser.add_argument("--states", type=int, default=1000, help="yarım kalmış sihirbaz (user_states) sayısı")
+    parser.add_argument("--active-ratio", type=float, default=0.7, help="süresi dolmamış ilanlardan aktif olanların oranı")
+    parser.add_argument("--days", type=int, default=90, help="oluşturma zamanlarının yayıldığı gün sayısı")
+    parser.add_argument("--skew", type=float, default=3.0, help="ilan sahibi yoğunlaşması (1 = düzgün)")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def dataset_params(args):
+    return dict(users=args.users, orders=args.orders, trips=args.trips, states=args.states,
+                active_ratio=args.active_ratio, days=args.days, skew=args.skew, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="oluşturulacak veritabanı dosyası (var olmamalı)")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+    os.environ.setdefault("TOKEN", "0:bench")
+    os.environ["DB_FILE"] = args.db
+    summary = generate(**dataset_params(args))
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
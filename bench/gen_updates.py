@@ -0,0 +1,132 @@
+# bench/gen_updates.py
+"""
+Sentetik Telegram update akışı üretir: çok sayıda kullanıcı aynı anda /post_order ve
+/post_trip sihirbazlarını doldurur, /list ile sayfalar arasında gezer, /search yapar ve
+ilanlardaki "iletişime geç" butonlarına basar. Her kullanıcının adımları kendi sırasında
+kalır, kullanıcılar arası sıra rastgele iç içe geçer.
+
+    python bench/gen_updates.py --users 500 --seed 1 -o updates.jsonl
+    python bench/load_test.py --updates updates.jsonl
+
+Çıktı satır başına bir update'tir (bench/replay_updates.py ile webhook'a da gönderilebilir).
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+from datetime import date, timedelta
+
+CITIES = ["Istanbul", "Ankara", "Izmir", "Lefkoşa", "Girne", "Moscow", "London", "Berlin"]
+PRODUCTS = ["documents", "phone", "laptop", "medicine", "books", "clothes", "coffee"]
+# Oturum türü -> ağırlık
+DEFAULT_MIX = {"order": 3, "trip": 2, "browse": 4, "contact": 2}
+FIRST_USER_ID = 100000
+
+
+class UpdateFactory:
+    """Telegram'ın göndereceği biçimde message / callback_query update'leri"""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"}
+
+    def message(self, user_id, text):
+        message_id = next(self._ids)
+        message = {"message_id": message_id, "date": 0, "chat": {"id": user_id, "type": "private"},
+                   "from": self._user(user_id), "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": message_id, "message": message}
+
+    def callback(self, user_id, data):
+        update_id = next(self._ids)
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "chat_instance": str(user_id), "data": data, "from": self._user(user_id),
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "text": "..."}}}
+
+
+def session(rng, factory, user_id, kind, listings):
+    """Bir kullanıcı oturumunun update listesi; listings: şimdiye kadar oluşturulan ilan sayıları"""
+    a, b = rng.sample(CITIES, 2)
+    if kind == "order":
+        listings["order"] += 1
+        steps = ["/post_order", rng.choice(PRODUCTS), f"{rng.uniform(0.1, 5):.1f}", a, b, f"{rng.randint(5, 50)}€",
+                 str(rng.randint(1, 14))]
+        return [factory.message(user_id, text) for text in steps]
+    if kind == "trip":
+        listings["trip"] += 1
+        trip_date = date.today() + timedelta(days=rng.randint(1, 30))
+        steps = ["/post_trip", a, b, trip_date.isoformat(), str(rng.randint(1, 20)), f"{rng.randint(2, 10)}€/kg"]
+        return [factory.message(user_id, text) for text in steps]
+    if kind == "browse":
+        updates = [factory.message(user_id, "/list")]
+        anchor = max(1, listings["order"])
+        for _ in range(rng.randint(1, 3)):
+            anchor = max(1, anchor - rng.randint(1, 5))
+            updates.append(factory.callback(user_id, f"list_next_order_{anchor}"))
+        updates.append(factory.message(user_id, f"/search {a} {b}"))
+        return updates
+    # contact: var olan (ya da kısa süre içinde oluşacak) ilanlara dokunma; bazıları tekrar (dedup yolu)
+    updates = []
+    for _ in range(rng.randint(1, 3)):
+        listing_kind = rng.choice(("order", "trip"))
+        item_id = rng.randint(1, max(1, listings[listing_kind]))
+        data = f"contact_{listing_kind}_{item_id}"
+        updates.append(factory.callback(user_id, data))
+        if rng.random() < 0.3:
+            updates.append(factory.callback(user_id, data))
+    return updates
+
+
+def generate(users, seed=0, mix=None, duration=60.0, think_time=1.0, first_user_id=FIRST_USER_ID):
+    """users kullanıcının oturumlarını sanal bir zaman çizgisine yerleştirip sıralı update listesi döner"""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    factory = UpdateFactory()
+    listings = {"order": 0, "trip": 0}
+    timeline = []
+    for i in range(users):
+        user_id = first_user_id + i
+        t = rng.uniform(0, duration)
+        for seq, update in enumerate(session(rng, factory, user_id, rng.choices(kinds, weights)[0], listings)):
+            timeline.append((t, user_id, seq, update))
+            t += rng.expovariate(1 / think_time)
+    timeline.sort(key=lambda entry: entry[:3])
+    return [update for _, _, _, update in timeline]
+
+
+def parse_mix(text):
+    """'order=3,trip=2,browse=4,contact=2' -> sözlük"""
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, text.split(",")):
+        name, _, weight = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown session kind: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="oturum ağırlıkları, örn: order=3,browse=5")
+    parser.add_argument("-o", "--output", help="JSONL dosyası (varsayılan: stdout)")
+    args = parser.parse_args()
+    updates = generate(args.users, args.seed, args.mix)
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for update in updates:
+            out.write(json.dumps(update, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{len(updates)} updates for {args.users} users", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# bench/load_test.py
+"""
+Çevrimdışı yük testi: sentetik (ya da kaydedilmiş) update akışını bot.py handler'larından
+geçirir, giden çağrıları bench/fake_api.py'deki sahte API'ye yollar ve handler gecikmesi
+(p50/p99), saniyedeki update sayısı ve update başına DB sorgusu raporlar.
+
+    python bench/load_test.py --users 500 --workers 8
+    python bench/load_test.py --updates updates.jsonl --latency 0.05 --error-rate 0.02
+    python bench/load_test.py --users 500 --json base.json
+    python bench/load_test.py --users 500 --compare base.json --tolerance 0.15
+
+--compare verilirse updates/sn düşüşü ya da p99 artışı toleransı aşınca çıkış kodu 1 olur.
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_api import FakeTelegramAPI  # noqa: E402
+from gen_updates import generate, parse_mix, DEFAULT_MIX  # noqa: E402
+
+# bot ortam değişkenlerini import anında okur; import main() içinde yapılır
+bot = None
+
+_db_statements = 0
+_db_statements_lock = threading.Lock()
+_SKIPPED_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA")
+
+
+def count_db_statements():
+    """sqlite3.connect'i sarar: açılan her bağlantıda çalışan SQL deyimleri sayılır (transaction kontrolü hariç)"""
+    connect = sqlite3.connect
+
+    def trace(statement):
+        global _db_statements
+        if not statement.lstrip().upper().startswith(_SKIPPED_STATEMENTS):
+            with _db_statements_lock:
+                _db_statements += 1
+
+    def counting_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(trace)
+        return conn
+    sqlite3.connect = counting_connect
+
+
+def route_of(payload):
+    """Raporlama etiketi: komut, callback öneki ya da sihirbaz adımı (düz metin)"""
+    if "callback_query" in payload:
+        return "cb:" + payload["callback_query"]["data"].split("_", 1)[0]
+    text = payload["message"].get("text", "")
+    return text.split()[0] if text.startswith("/") else "text"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def replay(updates, workers):
+    """Update'leri kullanıcıya göre sabit worker'lara dağıtıp işler; (süre, gecikmeler, hatalar) döner"""
+    queues = [queue.Queue() for _ in range(workers)]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+
+    def worker(inbox):
+        while True:
+            payload = inbox.get()
+            if payload is None:
+                return
+            route = route_of(payload)
+            start = time.perf_counter()
+            try:
+                bot.bot.process_new_updates([bot.types.Update.de_json(payload)])
+            except Exception:
+                errors[route] += 1
+            latencies[route].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(q,), daemon=True) for q in queues]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for payload in updates:
+        user_id = bot.update_user_id(payload) or 0
+        queues[user_id % workers].put(payload)
+    for q in queues:
+        q.put(None)
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, latencies, errors
+
+
+def summarize(elapsed, latencies, errors, db_statements, api, outbox_stats):
+    all_latencies = sorted(v for values in latencies.values() for v in values)
+    total = len(all_latencies)
+    routes = {}
+    for route, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        values.sort()
+        routes[route] = {"count": len(values), "p50_ms": percentile(values, 0.5) * 1000,
+                         "p99_ms": percentile(values, 0.99) * 1000, "errors": errors.get(route, 0)}
+    return {
+        "updates": total,
+        "seconds": elapsed,
+        "updates_per_sec": total / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(all_latencies, 0.5) * 1000,
+        "p99_ms": percentile(all_latencies, 0.99) * 1000,
+        "max_ms": (all_latencies[-1] if all_latencies else 0.0) * 1000,
+        "errors": sum(errors.values()),
+        "db_ops_per_update": db_statements / total if total else 0.0,
+        "api_calls": dict(api.calls),
+        "api_429": sum(api.throttled.values()),
+        "send_queue": {key: outbox_stats[key] for key in ("sent", "failed", "retried", "rate_limited", "coalesced")},
+        "send_latency_avg_ms": outbox_stats["latency_avg"] * 1000,
+        "routes": routes,
+    }
+
+
+def print_report(report):
+    print(f"updates: {report['updates']}  time: {report['seconds']:.2f}s  "
+          f"throughput: {report['updates_per_sec']:.0f} upd/s  errors: {report['errors']}")
+    print(f"handler latency: p50 {report['p50_ms']:.2f} ms  p99 {report['p99_ms']:.2f} ms  max {report['max_ms']:.2f} ms")
+    print(f"db ops/update: {report['db_ops_per_update']:.2f}")
+    print(f"api calls: {sum(report['api_calls'].values())} {report['api_calls']}  429s: {report['api_429']}")
+    print(f"send queue: {report['send_queue']}  avg send latency: {report['send_latency_avg_ms']:.1f} ms")
+    print(f"{'route':<16} {'count':>7} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for route, row in report["routes"].items():
+        print(f"{route:<16} {row['count']:>7} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>7}")
+
+
+def compare(report, baseline, tolerance):
+    """Temel rapora göre gerilemeleri listeler"""
+    problems = []
+    if report["updates_per_sec"] < baseline["updates_per_sec"] * (1 - tolerance):
+        problems.append(f"throughput {report['updates_per_sec']:.0f} < baseline {baseline['updates_per_sec']:.0f} upd/s")
+    if report["p99_ms"] > baseline["p99_ms"] * (1 + tolerance):
+        problems.append(f"p99 {report['p99_ms']:.2f} ms > baseline {baseline['p99_ms']:.2f} ms")
+    if report["db_ops_per_update"] > baseline["db_ops_per_update"] * (1 + tolerance):
+        problems.append(f"db ops/update {report['db_ops_per_update']:.2f} > baseline {baseline['db_ops_per_update']:.2f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", help="JSONL update dosyası (verilmezse --users ile üretilir)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="oturum ağırlıkları, örn: order=3,browse=5")
+    parser.add_argument("--workers", type=int, default=8, help="eşzamanlı handler thread'i")
+    parser.add_argument("--latency", type=float, default=0.0, help="sahte API gecikmesi (saniye)")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429 ile reddedilen API çağrısı oranı")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--real-limits", action="store_true", help="Telegram hız limitlerini (SEND_*) kapatma")
+    parser.add_argument("--json", help="raporu bu dosyaya yaz")
+    parser.add_argument("--compare", help="temel rapor (JSON); gerileme varsa çıkış kodu 1")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    global bot
+    api = FakeTelegramAPI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          retry_after=args.retry_after, seed=args.seed).start()
+    os.environ.setdefault("TOKEN", "0:bench")
+    os.environ["DB_FILE"] = os.path.join(tempfile.mkdtemp(prefix="load_test_"), "load.db")
+    os.environ["TELEGRAM_API_URL"] = api.url
+    if not args.real_limits:
+        for name in ("SEND_GLOBAL_RATE", "SEND_CHAT_RATE", "SEND_CHAT_BURST"):
+            os.environ[name] = "1000000"
+    count_db_statements()
+    import bot
+
+    if args.updates:
+        with open(args.updates, encoding="utf-8") as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = generate(args.users, args.seed, args.mix)
+
+    bot.init_db()
+    bot.start_services()
+    bot.bot.threaded = False
+    statements_before = _db_statements
+    try:
+        elapsed, latencies, errors = replay(updates, args.workers)
+        db_statements = _db_statements - statements_before
+    finally:
+        bot.stop_services()
+    report = summarize(elapsed, latencies, errors, db_statements, api, bot.outbox.stats())
+    api.stop()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"❌ regression: {problem}")
+        if problems:
+            sys.exit(1)
+        print("✅ no regression against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# bench/replay_updates.py
+"""
+Kaydedilmiş Telegram update JSON'larını webhook endpoint'ine POST eder
+(BOT_MODE=webhook ile yerelde çalışan bot'u Telegram'a bağlanmadan test etmek için).
+
+    BOT_MODE=webhook WEBHOOK_PORT=8443 WEBHOOK_SECRET=s3cret python bot.py
+    python bench/replay_updates.py updates.jsonl --url http://127.0.0.1:8443/webhook --secret s3cret
+
+Girdi dosyası satır başına bir update (JSON lines) ya da update listesi içeren bir JSON dizisidir.
+"""
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def post(url, secret, update, retries):
+    body = json.dumps(update).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, body, headers), timeout=10) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            # Telegram gibi davran: 503'te biraz bekleyip tekrar dene
+            if e.code != 503 or attempt == retries:
+                return e.code
+            time.sleep(float(e.headers.get("Retry-After", "1")))
+        except OSError as e:
+            return type(e).__name__
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    updates = load_updates(args.file)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses = Counter(pool.map(lambda u: post(args.url, args.secret, u, args.retries), updates))
+    elapsed = time.perf_counter() - start
+    print(f"{len(updates)} updates in {elapsed:.2f}s ({len(updates) / elapsed:.0f}/s)")
+    for status, count in sorted(statuses.items(), key=str):
+        print(f"  {status}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
 # bot.py
 import os
+import re
+import string
+import asyncio
+import bisect
+import csv
+import functools
+import gzip
+import hmac
+import io
+import json
+import heapq
 import sqlite3
-from datetime import datetime, timedelta
+import unicodedata
+import weakref
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 import telebot
 from telebot import types
+from telebot.apihelper import ApiTelegramException
 from dotenv import load_dotenv
 import threading
 import time
+import queue
+import signal
+import multiprocessing
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # ====== CONFIG ======
 
@@ -17,9 +40,88 @@ DB_FILE = os.getenv("DB_FILE", "data.db")
 ADMIN_IDS = []
 # Varsayılan ilan süresi (gün)
 DEFAULT_LISTING_EXPIRY_DAYS = int(os.getenv("DEFAULT_LISTING_EXPIRY_DAYS", "7"))
+# /list sayfasındaki ilan sayısı
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "5"))
+# /search sonucunda tür başına gösterilecek en fazla ilan
+SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT", "10"))
+# Otomatik sipariş <-> yolculuk eşleştirme
+MATCHING_ENABLED = os.getenv("MATCHING_ENABLED", "1") == "1"
+MATCH_CANDIDATE_LIMIT = int(os.getenv("MATCH_CANDIDATE_LIMIT", "200"))
+MATCH_NOTIFY_LIMIT = int(os.getenv("MATCH_NOTIFY_LIMIT", "5"))
+# Giden mesaj kuyruğu: Telegram limitleri ~30 mesaj/sn toplam, sohbet başına ~1 mesaj/sn
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "4"))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+SEND_COALESCE = os.getenv("SEND_COALESCE", "1") == "1"
+# Çalışma modu: "polling" (TeleBot, thread havuzu), "async" (AsyncTeleBot), "webhook" veya "sharded"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Sharded mod: worker süreci sayısı, ön sürecin güncelleme kaynağı (polling/webhook), süreç başına kuyruk
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 2)))
+SHARD_INGRESS = os.getenv("SHARD_INGRESS", "polling").lower()
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+# Yerel Bot API sunucusu veya test için sahte API (örn: http://127.0.0.1:8081)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+# Async modda handler gövdelerini (DB erişimi dahil) koşturan executor; aynı anda işlenen güncelleme üst sınırı
+ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", "16"))
+# Webhook modu: Telegram'a bildirilecek genel URL (boşsa set_webhook çağrılmaz, yerel test için)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # zorunlu: X-Telegram-Bot-Api-Secret-Token başlığıyla karşılaştırılır
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "256"))  # worker başına
+WEBHOOK_MAX_BODY = 1024 * 1024
+# SQLite bağlantı ayarları
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Kullanıcı önbelleği (tg_id -> lang/username/isim)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+# Süresi dolan ilanları kapatan zamanlayıcı: transaction başına en fazla ilan, yeni satır tarama aralığı (sn)
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "200"))
+EXPIRY_SYNC_INTERVAL = float(os.getenv("EXPIRY_SYNC_INTERVAL", "30"))
+# Hazır ilan kartı önbelleği (kayıt sayısı)
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "20000"))
+# İletişim istekleri: aynı ilana tekrar istek engeli (saat), sahibine iki özet arası en az süre (sn),
+# özet başına en fazla istek, kalıcı gönderim kuyruğunun tarama aralığı / deneme sayısı / kiralama süresi (sn)
+CONTACT_DEDUP_HOURS = float(os.getenv("CONTACT_DEDUP_HOURS", "24"))
+CONTACT_OWNER_THROTTLE = float(os.getenv("CONTACT_OWNER_THROTTLE", "300"))
+CONTACT_DIGEST_LIMIT = int(os.getenv("CONTACT_DIGEST_LIMIT", "20"))
+CONTACT_POLL_INTERVAL = float(os.getenv("CONTACT_POLL_INTERVAL", "2"))
+CONTACT_MAX_ATTEMPTS = int(os.getenv("CONTACT_MAX_ATTEMPTS", "5"))
+CONTACT_LEASE = float(os.getenv("CONTACT_LEASE", "120"))
+# Para birimi yazılmamış fiyatlar (örn: "10") için varsayılan birim; boşsa bu fiyatlar fiyat görünümlerine girmez
+PRICE_DEFAULT_CURRENCY = os.getenv("PRICE_DEFAULT_CURRENCY", "EUR").upper() or None
+# Yönetici dışa aktarımı: imleçten tek seferde çekilen satır sayısı
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "1000"))
+# Ölçümler (handler / DB / Telegram API gecikmeleri): kapalıyken hiçbir şey sarılmaz.
+# METRICS_PORT'ta Prometheus metin formatı (/metrics); METRICS_LOG_INTERVAL > 0 ise özet JSON satırı olarak loglanır.
+# Sharded modda shard i METRICS_PORT + 1 + i portunu kullanır.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+# Bu süreyi (ms) aşan handler çağrıları ayrı bir JSON log satırı olarak yazılır
+METRICS_SLOW_MS = float(os.getenv("METRICS_SLOW_MS", "1000"))
+# Ertelenmiş (write-behind) yazmaların DB'ye aktarılma aralığı (saniye)
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "5"))
+# Bu süreden uzun süredir ilerlemeyen sihirbaz akışları terk edilmiş sayılır (saat)
+CONVERSATION_TTL_HOURS = float(os.getenv("CONVERSATION_TTL_HOURS", "24"))
 
 if not TOKEN:
     raise Exception("TOKEN bulunamadı! Railway Variables kısmını kontrol et.")
+# Webhook sunucusu tüm arayüzleri dinler; gizli anahtar olmadan herkes sahte update (admin komutları dahil) yollayabilirdi
+if (BOT_MODE == "webhook" or (BOT_MODE == "sharded" and SHARD_INGRESS == "webhook")) \
+        and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+    raise Exception("WEBHOOK_SECRET gerekli (1-256 karakter: A-Z a-z 0-9 _ -); webhook modu gizli anahtarsız başlatılmaz.")
+
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
 
 bot = telebot.TeleBot(TOKEN, parse_mode="HTML")
 
@@ -42,7 +144,9 @@ MESSAGES = {
                "/post_order - Post an order\n"
                "/post_trip - Post a trip\n"
                "/list - See active listings\n"
+               "/search - Search listings by route\n"
                "/profile - Your profile\n"
+               "/reserve - Reserve space on a trip for your order\n"
                "/my_listings - Your active listings"),
         "tr": ("👋 Hoş geldiniz — CantaOrtak prototipi!\n\n"
                "Sipariş verebilir veya yolculuk ilanı ekleyebilirsiniz.\n\n"
@@ -50,7 +154,9 @@ MESSAGES = {
                "/post_order - Sipariş ekle\n"
                "/post_trip - Yolculuk ekle\n"
                "/list - İlanları gör\n"
+               "/search - Güzergaha göre ilan ara\n"
                "/profile - Profiliniz\n"
+               "/reserve - Siparişiniz için yolculukta yer ayırın\n"
                "/my_listings - Aktif ilanlarınız"),
         "ru": ("👋 Добро пожаловать — прототип CantaOrtak!\n\n"
                "Вы можете разместить заказ или поездку.\n\n"
@@ -58,7 +164,9 @@ MESSAGES = {
                "/post_order - Разместить заказ\n"
                "/post_trip - Разместить поездку\n"
                "/list - Активные объявления\n"
+               "/search - Поиск объявлений по маршруту\n"
                "/profile - Ваш профиль\n"
+               "/reserve - Забронировать место в поездке для заказа\n"
                "/my_listings - Ваши активные объявления")
     },
     "profile_not_found": {
@@ -185,15 +293,483 @@ MESSAGES = {
         "en": "❌ You are not the owner of this listing.",
         "tr": "❌ Bu ilanın sahibi siz değilsiniz.",
         "ru": "❌ Вы не владелец этого объявления."
+    },
+    "search_usage": {
+        "en": ("🔍 Usage: /search FROM TO [YYYY-MM-DD [YYYY-MM-DD]] [orders|trips] [price[=CUR]] [max=AMOUNT]\n"
+               "e.g. /search Istanbul Lefkoşa 2024-12-20\n"
+               "For multi-word cities: /search New York > London\n"
+               "Cheapest first (orders or trips): /search Istanbul Lefkoşa trips max=5€"),
+        "tr": ("🔍 Kullanım: /search NEREDEN NEREYE [YYYY-AA-GG [YYYY-AA-GG]] [orders|trips] [price[=PARA]] [max=TUTAR]\n"
+               "örn: /search İstanbul Lefkoşa 2024-12-20\n"
+               "Birden fazla kelimeli şehirler için: /search New York > London\n"
+               "En ucuzlar önce (orders ya da trips): /search İstanbul Lefkoşa trips max=5€"),
+        "ru": ("🔍 Использование: /search ОТКУДА КУДА [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [orders|trips] [price[=ВАЛЮТА]] [max=СУММА]\n"
+               "напр. /search Стамбул Лефкоша 2024-12-20\n"
+               "Для названий из нескольких слов: /search New York > London\n"
+               "Сначала дешёвые (orders или trips): /search Стамбул Лефкоша trips max=5€")
+    },
+    "search_header": {
+        "en": "🔍 Listings on this route:",
+        "tr": "🔍 Bu güzergahtaki ilanlar:",
+        "ru": "🔍 Объявления по этому маршруту:"
+    },
+    "price_view_header": {
+        "en": "💶 Listings by price ({currency}{limit}):",
+        "tr": "💶 Fiyata göre ilanlar ({currency}{limit}):",
+        "ru": "💶 Объявления по цене ({currency}{limit}):"
+    },
+    "price_view_limit": {
+        "en": ", up to {amount}",
+        "tr": ", en fazla {amount}",
+        "ru": ", не дороже {amount}"
+    },
+    "price_view_empty": {
+        "en": "No active listings match this price filter.",
+        "tr": "Bu fiyat filtresine uyan aktif ilan yok.",
+        "ru": "Нет активных объявлений, подходящих под этот фильтр цены."
+    },
+    "list_usage": {
+        "en": ("Usage: /list [orders|trips] [price[=CUR]] [max=AMOUNT]\n"
+               "Price sorting needs orders (total price) or trips (price per kg).\n"
+               "e.g. /list trips max=3€ — cheapest trips up to 3€/kg"),
+        "tr": ("Kullanım: /list [orders|trips] [price[=PARA]] [max=TUTAR]\n"
+               "Fiyata göre sıralama için orders (toplam fiyat) ya da trips (kg başı fiyat) gerekir.\n"
+               "örn: /list trips max=3€ — kg başı en fazla 3€ olan en ucuz yolculuklar"),
+        "ru": ("Использование: /list [orders|trips] [price[=ВАЛЮТА]] [max=СУММА]\n"
+               "Для сортировки по цене укажите orders (общая цена) или trips (цена за кг).\n"
+               "напр. /list trips max=3€ — самые дешёвые поездки до 3€/кг")
+    },
+    "search_no_results": {
+        "en": "No active listings found on this route.",
+        "tr": "Bu güzergahta aktif ilan bulunamadı.",
+        "ru": "По этому маршруту активных объявлений не найдено."
+    },
+    "match_orders_for_trip": {
+        "en": "🤝 Orders matching your Trip #{id}:",
+        "tr": "🤝 Yolculuğunuza (#{id}) uyan siparişler:",
+        "ru": "🤝 Заказы, подходящие к вашей поездке #{id}:"
+    },
+    "match_trips_for_order": {
+        "en": "🤝 Trips matching your Order #{id}:",
+        "tr": "🤝 Siparişinize (#{id}) uyan yolculuklar:",
+        "ru": "🤝 Поездки, подходящие к вашему заказу #{id}:"
+    },
+    "match_new_trip": {
+        "en": "🤝 A new trip matches your Order #{id}:",
+        "tr": "🤝 Siparişinize (#{id}) uyan yeni bir yolculuk var:",
+        "ru": "🤝 Новая поездка подходит к вашему заказу #{id}:"
+    },
+    "match_new_order": {
+        "en": "🤝 A new order matches your Trip #{id}:",
+        "tr": "🤝 Yolculuğunuza (#{id}) uyan yeni bir sipariş var:",
+        "ru": "🤝 Новый заказ подходит к вашей поездке #{id}:"
+    },
+    "match_line_order": {
+        "en": "📦 Order #{id}: {product}, {weight} kg (until {until})",
+        "tr": "📦 Sipariş #{id}: {product}, {weight} kg ({until} tarihine kadar)",
+        "ru": "📦 Заказ #{id}: {product}, {weight} кг (до {until})"
+    },
+    "match_line_trip": {
+        "en": "🛄 Trip #{id}: {date}, {capacity} kg free, {price}",
+        "tr": "🛄 Yolculuk #{id}: {date}, {capacity} kg boş, {price}",
+        "ru": "🛄 Поездка #{id}: {date}, свободно {capacity} кг, {price}"
+    },
+    # ---- ilan kartları ----
+    "status_active": {
+        "en": "✅ Active",
+        "tr": "✅ Aktif",
+        "ru": "✅ Активно"
+    },
+    "status_inactive": {
+        "en": "❌ Inactive",
+        "tr": "❌ Pasif",
+        "ru": "❌ Неактивно"
+    },
+    "order_card": {
+        "en": ("📦 <b>Order #{id}</b> - {status}\n👤 Owner: <code>{owner}</code>\n{route}"
+               "📝 Product: {product}\n⚖️ Weight: {weight} kg\n💰 Price: {price}\n"
+               "🕒 Created: {created}\n⏰ Expires: {expires}"),
+        "tr": ("📦 <b>Sipariş #{id}</b> - {status}\n👤 Sahibi: <code>{owner}</code>\n{route}"
+               "📝 Ürün: {product}\n⚖️ Ağırlık: {weight} kg\n💰 Ücret: {price}\n"
+               "🕒 Oluşturuldu: {created}\n⏰ Son geçerlilik: {expires}"),
+        "ru": ("📦 <b>Заказ #{id}</b> - {status}\n👤 Владелец: <code>{owner}</code>\n{route}"
+               "📝 Товар: {product}\n⚖️ Вес: {weight} кг\n💰 Цена: {price}\n"
+               "🕒 Создано: {created}\n⏰ Истекает: {expires}")
+    },
+    "trip_card": {
+        "en": ("🛄 <b>Trip #{id}</b> - {status}\n👤 Owner: <code>{owner}</code>\n"
+               "📍 <b>{from_city}</b> → <b>{to_city}</b>\n📅 Trip Date: {date}\n⚖️ Free: {remaining} / {capacity} kg\n"
+               "💵 Price: {price}\n🕒 Created: {created}\n⏰ Expires: {expires}"),
+        "tr": ("🛄 <b>Yolculuk #{id}</b> - {status}\n👤 Sahibi: <code>{owner}</code>\n"
+               "📍 <b>{from_city}</b> → <b>{to_city}</b>\n📅 Seyahat tarihi: {date}\n⚖️ Boş kapasite: {remaining} / {capacity} kg\n"
+               "💵 Ücret: {price}\n🕒 Oluşturuldu: {created}\n⏰ Son geçerlilik: {expires}"),
+        "ru": ("🛄 <b>Поездка #{id}</b> - {status}\n👤 Владелец: <code>{owner}</code>\n"
+               "📍 <b>{from_city}</b> → <b>{to_city}</b>\n📅 Дата поездки: {date}\n⚖️ Свободно: {remaining} / {capacity} кг\n"
+               "💵 Цена: {price}\n🕒 Создано: {created}\n⏰ Истекает: {expires}")
+    },
+    # ---- butonlar ----
+    "btn_contact_order": {
+        "en": "📩 Contact owner · Order #{id}",
+        "tr": "📩 İlan sahibine yaz · Sipariş #{id}",
+        "ru": "📩 Связаться · Заказ #{id}"
+    },
+    "btn_contact_trip": {
+        "en": "📩 Contact owner · Trip #{id}",
+        "tr": "📩 İlan sahibine yaz · Yolculuk #{id}",
+        "ru": "📩 Связаться · Поездка #{id}"
+    },
+    "btn_reserve": {
+        "en": "🧳 Reserve · Trip #{id}",
+        "tr": "🧳 Yer ayır · Yolculuk #{id}",
+        "ru": "🧳 Бронь · Поездка #{id}"
+    },
+    "btn_cancel_reservation": {
+        "en": "↩️ Cancel reservation #{id}",
+        "tr": "↩️ Rezervasyon #{id} iptal",
+        "ru": "↩️ Отменить бронь #{id}"
+    },
+    "btn_deactivate": {
+        "en": "❌ Deactivate",
+        "tr": "❌ Yayından kaldır",
+        "ru": "❌ Деактивировать"
+    },
+    "btn_prev": {
+        "en": "⬅️ Prev",
+        "tr": "⬅️ Önceki",
+        "ru": "⬅️ Назад"
+    },
+    "btn_next": {
+        "en": "Next ➡️",
+        "tr": "Sonraki ➡️",
+        "ru": "Далее ➡️"
+    },
+    # Dil seçimi henüz yapılmadığı için menü tüm dillerde aynıdır (yedek zincirinden "en" gelir)
+    "language_menu": {
+        "en": ("🌐 Choose / Dil seçin / Выберите язык:\n\n"
+               "English 🇬🇧  — press English\n"
+               "Türkçe 🇹🇷  — Türkçe'ye basın\n"
+               "Русский 🇷🇺 — нажмите Русский")
+    },
+    "language_name": {
+        "en": "English 🇬🇧",
+        "tr": "Türkçe 🇹🇷",
+        "ru": "Русский 🇷🇺"
+    },
+    # ---- iletişim isteği ----
+    "contact_request_order": {
+        "en": ("📩 Your <b>Order #{id}</b> has a contact request.\n\n"
+               "Requester: {name}\nUsername: @{username}\n\n"
+               "Product: {product}\n\nRespond if you want to proceed."),
+        "tr": ("📩 <b>Sipariş #{id}</b> ilanınız için iletişim isteği var.\n\n"
+               "İsteyen: {name}\nKullanıcı adı: @{username}\n\n"
+               "Ürün: {product}\n\nDevam etmek istiyorsanız cevap verin."),
+        "ru": ("📩 По вашему <b>заказу #{id}</b> поступил запрос на контакт.\n\n"
+               "От: {name}\nИмя пользователя: @{username}\n\n"
+               "Товар: {product}\n\nОтветьте, если хотите продолжить.")
+    },
+    "contact_request_trip": {
+        "en": ("📩 Your <b>Trip #{id}</b> has a contact request.\n\n"
+               "Requester: {name}\nUsername: @{username}\n"
+               "Route: {from_city} → {to_city} (Date: {date})\n\nRespond if you want to proceed."),
+        "tr": ("📩 <b>Yolculuk #{id}</b> ilanınız için iletişim isteği var.\n\n"
+               "İsteyen: {name}\nKullanıcı adı: @{username}\n"
+               "Güzergah: {from_city} → {to_city} (Tarih: {date})\n\nDevam etmek istiyorsanız cevap verin."),
+        "ru": ("📩 По вашей <b>поездке #{id}</b> поступил запрос на контакт.\n\n"
+               "От: {name}\nИмя пользователя: @{username}\n"
+               "Маршрут: {from_city} → {to_city} (Дата: {date})\n\nОтветьте, если хотите продолжить.")
+    },
+    "contact_already_sent": {
+        "en": "ℹ️ You have already contacted the owner about this listing. Please wait for their reply.",
+        "tr": "ℹ️ Bu ilan için ilan sahibine zaten istek gönderdiniz. Lütfen cevabını bekleyin.",
+        "ru": "ℹ️ Вы уже отправили запрос владельцу этого объявления. Пожалуйста, дождитесь ответа."
+    },
+    "contact_digest_header": {
+        "en": "📩 You have <b>{count}</b> new contact requests:",
+        "tr": "📩 <b>{count}</b> yeni iletişim isteğiniz var:",
+        "ru": "📩 У вас <b>{count}</b> новых запросов на контакт:"
+    },
+    "contact_digest_line_order": {
+        "en": "• <b>Order #{id}</b> ({product}): {name} @{username}",
+        "tr": "• <b>Sipariş #{id}</b> ({product}): {name} @{username}",
+        "ru": "• <b>Заказ #{id}</b> ({product}): {name} @{username}"
+    },
+    "contact_digest_line_trip": {
+        "en": "• <b>Trip #{id}</b> ({from_city} → {to_city}, {date}): {name} @{username}",
+        "tr": "• <b>Yolculuk #{id}</b> ({from_city} → {to_city}, {date}): {name} @{username}",
+        "ru": "• <b>Поездка #{id}</b> ({from_city} → {to_city}, {date}): {name} @{username}"
+    },
+    "contact_digest_footer": {
+        "en": "Respond to the ones you want to proceed with.",
+        "tr": "Devam etmek istediklerinize cevap verin.",
+        "ru": "Ответьте тем, с кем хотите продолжить."
+    },
+    # ---- rezervasyonlar ----
+    "reserve_usage": {
+        "en": ("🧳 Usage: /reserve TRIP_ID [ORDER_ID]\n"
+               "Without ORDER_ID your newest active order on the trip's route is used."),
+        "tr": ("🧳 Kullanım: /reserve YOLCULUK_ID [SİPARİŞ_ID]\n"
+               "SİPARİŞ_ID verilmezse yolculuğun güzergahındaki en yeni aktif siparişiniz kullanılır."),
+        "ru": ("🧳 Использование: /reserve ID_ПОЕЗДКИ [ID_ЗАКАЗА]\n"
+               "Без ID_ЗАКАЗА используется ваш последний активный заказ по маршруту поездки.")
+    },
+    "reserve_no_order": {
+        "en": "You have no active order on this trip's route that could be reserved. Post one with /post_order.",
+        "tr": "Bu yolculuğun güzergahında yer ayırabileceğiniz aktif siparişiniz yok. /post_order ile ekleyebilirsiniz.",
+        "ru": "У вас нет активного заказа по маршруту этой поездки. Разместите его через /post_order."
+    },
+    "reservation_confirmed": {
+        "en": "✅ Reserved {weight} kg on <b>Trip #{trip_id}</b> for <b>Order #{order_id}</b>. Free capacity left: {remaining} kg.",
+        "tr": "✅ <b>Sipariş #{order_id}</b> için <b>Yolculuk #{trip_id}</b> üzerinde {weight} kg ayrıldı. Kalan boş kapasite: {remaining} kg.",
+        "ru": "✅ Для <b>заказа #{order_id}</b> забронировано {weight} кг в <b>поездке #{trip_id}</b>. Осталось свободно: {remaining} кг."
+    },
+    "reservation_owner_notice": {
+        "en": ("🧳 <b>Order #{order_id}</b> ({product}, {weight} kg) reserved space on your <b>Trip #{trip_id}</b>.\n"
+               "Requester: {name} @{username}\nFree capacity left: {remaining} kg."),
+        "tr": ("🧳 <b>Sipariş #{order_id}</b> ({product}, {weight} kg) <b>Yolculuk #{trip_id}</b> ilanınızda yer ayırdı.\n"
+               "İsteyen: {name} @{username}\nKalan boş kapasite: {remaining} kg."),
+        "ru": ("🧳 <b>Заказ #{order_id}</b> ({product}, {weight} кг) забронировал место в вашей <b>поездке #{trip_id}</b>.\n"
+               "От: {name} @{username}\nОсталось свободно: {remaining} кг.")
+    },
+    "reservation_trip_full": {
+        "en": "🔒 Trip #{trip_id} is now full and has been closed.",
+        "tr": "🔒 Yolculuk #{trip_id} doldu ve yayından kaldırıldı.",
+        "ru": "🔒 Поездка #{trip_id} заполнена и закрыта."
+    },
+    "reservation_trip_reopened": {
+        "en": "🔓 Trip #{trip_id} has free capacity again ({remaining} kg) and is listed again.",
+        "tr": "🔓 Yolculuk #{trip_id} üzerinde yeniden boş yer açıldı ({remaining} kg) ve tekrar yayında.",
+        "ru": "🔓 В поездке #{trip_id} снова есть свободное место ({remaining} кг), она снова опубликована."
+    },
+    "reservation_full": {
+        "en": "❌ Not enough free capacity left on this trip.",
+        "tr": "❌ Bu yolculukta yeterli boş kapasite kalmadı.",
+        "ru": "❌ В этой поездке недостаточно свободного места."
+    },
+    "reservation_unavailable": {
+        "en": "❌ This trip or order is no longer available, or they are not on the same route and dates.",
+        "tr": "❌ Yolculuk ya da sipariş artık aktif değil veya güzergah ve tarihleri uyuşmuyor.",
+        "ru": "❌ Поездка или заказ больше не активны, либо не совпадают маршрут и даты."
+    },
+    "reservation_exists": {
+        "en": "ℹ️ This order already has a reservation.",
+        "tr": "ℹ️ Bu sipariş için zaten yer ayrılmış.",
+        "ru": "ℹ️ Для этого заказа уже есть бронь."
+    },
+    "reservation_cancelled": {
+        "en": "✅ Reservation #{id} has been cancelled.",
+        "tr": "✅ Rezervasyon #{id} iptal edildi.",
+        "ru": "✅ Бронь #{id} отменена."
+    },
+    "reservation_cancel_notice": {
+        "en": "↩️ Reservation #{id} ({weight} kg of Order #{order_id} on Trip #{trip_id}) was cancelled.",
+        "tr": "↩️ Rezervasyon #{id} (Sipariş #{order_id}, Yolculuk #{trip_id} üzerinde {weight} kg) iptal edildi.",
+        "ru": "↩️ Бронь #{id} ({weight} кг заказа #{order_id} в поездке #{trip_id}) отменена."
+    },
+    "reservation_order_closed_notice": {
+        "en": "↩️ Reservation #{id} ({weight} kg on your Trip #{trip_id}) was released: Order #{order_id} is no longer active.",
+        "tr": "↩️ Rezervasyon #{id} (Yolculuk #{trip_id} ilanınızda {weight} kg) kaldırıldı: Sipariş #{order_id} artık aktif değil.",
+        "ru": "↩️ Бронь #{id} ({weight} кг в вашей поездке #{trip_id}) снята: заказ #{order_id} больше не активен."
+    },
+    "reservation_trip_closed_notice": {
+        "en": "↩️ Reservation #{id} for your Order #{order_id} was released: Trip #{trip_id} is no longer active.",
+        "tr": "↩️ Sipariş #{order_id} için yapılan rezervasyon #{id} kaldırıldı: Yolculuk #{trip_id} artık aktif değil.",
+        "ru": "↩️ Бронь #{id} для вашего заказа #{order_id} снята: поездка #{trip_id} больше не активна."
+    },
+    "reservation_not_found": {
+        "en": "Reservation not found or already cancelled.",
+        "tr": "Rezervasyon bulunamadı veya zaten iptal edilmiş.",
+        "ru": "Бронь не найдена или уже отменена."
+    },
+    "no_username": {
+        "en": "(no username)",
+        "tr": "(kullanıcı adı yok)",
+        "ru": "(нет имени пользователя)"
+    },
+    # ---- hatalar ----
+    "listing_not_found_or_inactive": {
+        "en": "Listing not found or inactive.",
+        "tr": "İlan bulunamadı veya aktif değil.",
+        "ru": "Объявление не найдено или неактивно."
+    },
+    "listing_not_found": {
+        "en": "Listing not found.",
+        "tr": "İlan bulunamadı.",
+        "ru": "Объявление не найдено."
+    },
+    "generic_error": {
+        "en": "Error.",
+        "tr": "Hata.",
+        "ru": "Ошибка."
+    },
+    "not_admin": {
+        "en": "Not admin.",
+        "tr": "Bu komut yalnızca yöneticiler içindir.",
+        "ru": "Команда только для администраторов."
+    },
+    "export_usage": {
+        "en": "Usage: /all_orders or /all_trips [csv|jsonl] [active] [from=YYYY-MM-DD] [to=YYYY-MM-DD]",
+        "tr": "Kullanım: /all_orders veya /all_trips [csv|jsonl] [active] [from=YYYY-AA-GG] [to=YYYY-AA-GG]",
+        "ru": "Использование: /all_orders или /all_trips [csv|jsonl] [active] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]"
+    },
+    "export_empty": {
+        "en": "No listings match these filters.",
+        "tr": "Bu filtrelere uyan ilan yok.",
+        "ru": "Нет объявлений, подходящих под эти фильтры."
+    },
+    "export_caption": {
+        "en": "📄 {table}: {count} rows",
+        "tr": "📄 {table}: {count} satır",
+        "ru": "📄 {table}: {count} строк"
+    },
+    "unknown_command": {
+        "en": "❌ Unknown command. Use /start to see available commands.",
+        "tr": "❌ Bilinmeyen komut. Komutları görmek için /start kullanın.",
+        "ru": "❌ Неизвестная команда. Используйте /start, чтобы увидеть доступные команды."
     }
 }
 
+# ====== MESSAGE CATALOG ======
+# MESSAGES yalnızca kaynak metindir. Import sırasında her dil için, anahtarların tamsayı id'siyle
+# (MSG.<anahtar>) indekslenen düz bir listeye derlenir: eksik çeviriler yedek zincirinden doldurulur,
+# yer tutuculu şablonlar bir kez parçalanır. Çalışma anında mesaj almak tek bir liste indekslemesidir.
+DEFAULT_LANG = "tr"
+FALLBACK_LANG = "en"
+# Çevirisi olmayan anahtarlar için dil -> sırayla denenecek diller (en sonda FALLBACK_LANG)
+LANG_FALLBACKS = {"tr": ("en",), "ru": ("en",)}
+
+class Template:
+    """Yer tutuculu ({isim}) mesaj şablonu; import sırasında parçalara ayrılır"""
+    __slots__ = ("parts", "fields")
+
+    def __init__(self, text):
+        self.parts = []
+        for literal, field_name, spec, conversion in string.Formatter().parse(text):
+            if field_name is not None and (not field_name.isidentifier() or conversion):
+                raise ValueError(f"Unsupported placeholder {{{field_name}}} in {text!r}")
+            self.parts.append((literal, field_name, spec or ""))
+        self.fields = frozenset(name for _, name, _ in self.parts if name)
+
+    def render(self, values):
+        out = []
+        for literal, field_name, spec in self.parts:
+            out.append(literal)
+            if field_name is not None:
+                out.append(format(values[field_name], spec))
+        return "".join(out)
+
+def compile_catalog(messages, fallbacks=LANG_FALLBACKS, fallback_lang=FALLBACK_LANG):
+    """anahtar -> dil -> metin sözlüğünü derler: ({anahtar: id}, {dil: [metin ya da Template]})"""
+    ids = {key: i for i, key in enumerate(messages)}
+    languages = list(dict.fromkeys(lang for texts in messages.values() for lang in texts))
+    tables = {}
+    for lang in languages:
+        chain = (lang,) + tuple(fallbacks.get(lang, ())) + (fallback_lang,) + tuple(languages)
+        table = []
+        for key, texts in messages.items():
+            template = Template(next(texts[l] for l in chain if l in texts))
+            # Yer tutucusu olmayan mesajlar düz str olarak saklanır ('{{' kaçışları çözülmüş halde)
+            table.append(template if template.fields else template.render({}))
+        tables[lang] = table
+    for key, i in ids.items():
+        fields = {lang: tables[lang][i].fields if isinstance(tables[lang][i], Template) else frozenset()
+                  for lang in languages}
+        if len(set(fields.values())) > 1:
+            raise ValueError(f"Message {key!r} uses different placeholders per language: {fields}")
+    return ids, tables
+
+class MSG:
+    """Mesaj id'leri (MSG.list_header gibi); derleme sırasında doldurulur"""
+
+MSG_IDS, _CATALOG = compile_catalog(MESSAGES)
+for _key, _id in MSG_IDS.items():
+    setattr(MSG, _key, _id)
+LANGUAGES = tuple(_CATALOG)
+
+def catalog_for(lang):
+    """Dilin derlenmiş mesaj tablosu; bilinmeyen dil için varsayılan dilinki"""
+    table = _CATALOG.get(lang)
+    return table if table is not None else _CATALOG[DEFAULT_LANG]
+
+def text_for(lang, msg_id, **values):
+    """Mesajı verilen dilde döndürür; şablonsa values ile doldurur"""
+    entry = catalog_for(lang)[msg_id]
+    return entry.render(values) if entry.__class__ is Template else entry
+
 # ====== DB HELPERS ======
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+# Her thread (telebot worker'ları, expiry zamanlayıcısı) kendi kalıcı bağlantısını kullanır
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+_db_generation = 0
+# METRICS_ENABLED ise import sırasında deyimleri zamanlayan TimedConnection olur (METRICS bölümü);
+# açık bağlantılar hiçbir zaman değiştirilmez, aksi halde yarım kalan transaction iki bağlantıya bölünürdü
+_db_factory = sqlite3.Connection
+
+def _open_connection():
+    """Yeni bir SQLite bağlantısı açar ve pragma ayarlarını uygular"""
+    # isolation_level=None: tek ifadeler autocommit, çoklu ifadeler db_transaction ile
+    conn = sqlite3.connect(DB_FILE, timeout=DB_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False,
+                           factory=_db_factory)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def get_db():
+    """Mevcut thread'in bağlantısını döndürür, yoksa açar"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None or _db_local.generation != _db_generation:
+        conn = _open_connection()
+        _db_local.conn = conn
+        _db_local.generation = _db_generation
+        _db_local.tx_depth = 0
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+@contextmanager
+def db_transaction():
+    """Bloğu tek bir transaction içinde çalıştırır; iç içe kullanımda dıştaki transaction geçerlidir"""
+    conn = get_db()
+    depth = _db_local.tx_depth
+    if depth == 0:
+        conn.execute("BEGIN IMMEDIATE")
+    _db_local.tx_depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        _db_local.tx_depth = depth
+        if depth == 0:
+            conn.rollback()
+        raise
+    _db_local.tx_depth = depth
+    if depth == 0:
+        conn.commit()
+
+def close_db_connections():
+    """Açık tüm bağlantıları kapatır (kapanışta çağrılır)"""
+    global _db_generation
+    with _db_connections_lock:
+        _db_generation += 1
+        conns = list(_db_connections)
+        _db_connections.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+# ====== SCHEMA MIGRATIONS ======
+# Her migration kendi transaction'ında bir kez çalışır; uygulananlar schema_version'da tutulur.
+# Yeni şema değişiklikleri MIGRATIONS listesinin sonuna eklenmeli, mevcutlar değiştirilmemeli.
+def _table_columns(conn, table):
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+def _migrate_base_tables(conn):
     # create users with lang column (if not exists)
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
         tg_id INTEGER PRIMARY KEY,
         username TEXT,
@@ -203,7 +779,7 @@ def init_db():
         lang TEXT
     )
     """)
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         tg_id INTEGER,
@@ -212,12 +788,10 @@ def init_db():
         from_city TEXT,
         to_city TEXT,
         price TEXT,
-        created_at TEXT,
-        expires_at TEXT,
-        is_active BOOLEAN DEFAULT 1
+        created_at TEXT
     )
     """)
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS trips (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         tg_id INTEGER,
@@ -226,13 +800,11 @@ def init_db():
         date TEXT,
         capacity_kg REAL,
         price_per_kg TEXT,
-        created_at TEXT,
-        expires_at TEXT,
-        is_active BOOLEAN DEFAULT 1
+        created_at TEXT
     )
     """)
     # User states için tablo (komut algılama için)
-    c.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS user_states (
         user_id INTEGER PRIMARY KEY,
         state TEXT,
@@ -240,440 +812,2398 @@ def init_db():
         updated_at TEXT
     )
     """)
-    conn.commit()
 
+def _migrate_users_lang(conn):
     # Migration safety: if users table existed but lacked 'lang', add it
-    c.execute("PRAGMA table_info(users)")
-    cols = [r[1] for r in c.fetchall()]
-    if 'lang' not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN lang TEXT")
-        conn.commit()
-    
-    # Migration: orders ve trips tablolarına expires_at ve is_active ekle
-    c.execute("PRAGMA table_info(orders)")
-    cols = [r[1] for r in c.fetchall()]
-    if 'expires_at' not in cols:
-        c.execute("ALTER TABLE orders ADD COLUMN expires_at TEXT")
-        c.execute("ALTER TABLE orders ADD COLUMN is_active BOOLEAN DEFAULT 1")
-        # Mevcut kayıtlar için expires_at değeri ata
-        c.execute("UPDATE orders SET expires_at = datetime(created_at, '+' || ? || ' days')", (DEFAULT_LISTING_EXPIRY_DAYS,))
-        conn.commit()
-    
-    c.execute("PRAGMA table_info(trips)")
-    cols = [r[1] for r in c.fetchall()]
-    if 'expires_at' not in cols:
-        c.execute("ALTER TABLE trips ADD COLUMN expires_at TEXT")
-        c.execute("ALTER TABLE trips ADD COLUMN is_active BOOLEAN DEFAULT 1")
+    if 'lang' not in _table_columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN lang TEXT")
+
+def _migrate_listing_expiry(conn):
+    # orders ve trips tablolarına expires_at ve is_active ekle
+    for table in ("orders", "trips"):
+        if 'expires_at' in _table_columns(conn, table):
+            continue
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN expires_at TEXT")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN is_active BOOLEAN DEFAULT 1")
         # Mevcut kayıtlar için expires_at değeri ata
-        c.execute("UPDATE trips SET expires_at = datetime(created_at, '+' || ? || ' days')", (DEFAULT_LISTING_EXPIRY_DAYS,))
-        conn.commit()
+        conn.execute(f"UPDATE {table} SET expires_at = datetime(created_at, '+' || ? || ' days')", (DEFAULT_LISTING_EXPIRY_DAYS,))
+
+def _migrate_listing_indexes(conn):
+    # /list: aktif ilanlar created_at sırasıyla; expires_at indekste olduğu için filtre tabloya gitmeden yapılır
+    # /my_listings: aynı erişim, tg_id önekiyle
+    # cleanup: aktif ilanlar expires_at aralığıyla
+    for table in ("orders", "trips"):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_active_created ON {table}(created_at, expires_at) WHERE is_active = 1")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_owner_active ON {table}(tg_id, created_at, expires_at) WHERE is_active = 1")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_active_expires ON {table}(expires_at) WHERE is_active = 1")
+
+def _backfill(conn, table, source_cols, target_cols, compute, batch=5000):
+    """Her satır için target sütunlarını compute(*source) ile id sırasıyla partiler halinde doldurur"""
+    assignments = ", ".join(f"{col} = ?" for col in target_cols)
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT id, {', '.join(source_cols)} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, batch)
+        ).fetchall()
+        if not rows:
+            break
+        conn.executemany(
+            f"UPDATE {table} SET {assignments} WHERE id = ?",
+            [tuple(compute(*row[1:])) + (row[0],) for row in rows]
+        )
+        last_id = rows[-1][0]
+
+def _migrate_route_keys(conn):
+    # Güzergah aramaları için normalize edilmiş şehir anahtarları
+    for table in ("orders", "trips"):
+        if 'from_key' not in _table_columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN from_key TEXT")
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN to_key TEXT")
+        _backfill(conn, table, ("from_city", "to_city"), ("from_key", "to_key"),
+                  lambda from_city, to_city: (normalize_city_key(from_city), normalize_city_key(to_city)))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_route ON orders(from_key, to_key, created_at) WHERE is_active = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trips_route ON trips(from_key, to_key, date) WHERE is_active = 1")
+
+def _migrate_city_ids(conn):
+    # Şehir sözlüğü: her takma ad (katlanmış anahtar) bir kanonik şehre bağlanır
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS city_aliases (
+        alias TEXT PRIMARY KEY,
+        city_id INTEGER NOT NULL REFERENCES cities(id)
+    ) WITHOUT ROWID
+    """)
+    for name, aliases in CITY_ALIASES.items():
+        key = normalize_city_key(name)
+        if conn.execute("SELECT 1 FROM city_aliases WHERE alias = ?", (key,)).fetchone():
+            continue
+        city_id = conn.execute("INSERT INTO cities (name) VALUES (?)", (name,)).lastrowid
+        conn.executemany(
+            "INSERT OR IGNORE INTO city_aliases (alias, city_id) VALUES (?, ?)",
+            [(alias_key, city_id) for alias_key in {key, *map(normalize_city_key, aliases)}]
+        )
+    load_city_aliases(conn)
+    for table in ("orders", "trips"):
+        if 'from_city_id' not in _table_columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN from_city_id INTEGER")
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN to_city_id INTEGER")
+        _backfill(conn, table, ("from_city", "to_city"), ("from_key", "to_key", "from_city_id", "to_city_id"),
+                  lambda from_city, to_city: (normalize_city_key(from_city), normalize_city_key(to_city),
+                                              resolve_city_id(from_city), resolve_city_id(to_city)))
+    # Güzergah sorguları artık tamsayı id'lerle yapılıyor
+    conn.execute("DROP INDEX IF EXISTS idx_orders_route")
+    conn.execute("DROP INDEX IF EXISTS idx_trips_route")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_city_route ON orders(from_city_id, to_city_id, created_at) WHERE is_active = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trips_city_route ON trips(from_city_id, to_city_id, date) WHERE is_active = 1")
+
+def _migrate_match_index(conn):
+    # Yeni yolculuğa uyan siparişler: aynı güzergah, weight <= capacity_kg
+    # (trip tarafı için güzergah + tarih indeksi yeterli)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_city_weight ON orders(from_city_id, to_city_id, weight) WHERE is_active = 1")
+
+def _migrate_contact_requests(conn):
+    # Her "iletişime geç" isteği bir satır; digest_id, isteği sahibine taşıyan özet mesajı gösterir
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS contact_requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        item_id INTEGER NOT NULL,
+        owner_id INTEGER NOT NULL,
+        requester_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        requester_name TEXT,
+        requester_username TEXT,
+        details TEXT,
+        created_at TEXT NOT NULL,
+        digest_id INTEGER
+    )
+    """)
+    # Sahibine gidecek özet mesajları; gönderilene kadar 'pending', sonra 'sent' ya da 'failed'
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS contact_digests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        owner_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        next_attempt_at TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'pending',
+        last_error TEXT
+    )
+    """)
+    # dedup: (isteyen, ilan) için pencere içindeki son istek
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_requests_dedup ON contact_requests(requester_id, kind, item_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_requests_undigested ON contact_requests(owner_id, id) WHERE digest_id IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_requests_digest ON contact_requests(digest_id)")
+    # throttle: sahibinin son özeti; drain: zamanı gelmiş bekleyen özetler
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_digests_owner ON contact_digests(owner_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contact_digests_due ON contact_digests(next_attempt_at) WHERE status = 'pending'")
+
+def _migrate_epoch_columns(conn):
+    # Zaman filtreleri ve sıralamalar ISO metin yerine UTC epoch saniyesi tutan tamsayı sütunlarla yapılır.
+    # Metin sütunları dışa aktarım için kalır; migration 3'ün datetime() ile yazdığı boşluk ayraçlı
+    # expires_at değerleri de burada isoformat() biçimine çevrilir.
+    def parse(value):
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+
+    def times(created_at, expires_at):
+        created, expires = parse(created_at), parse(expires_at)
+        return (created.isoformat() if created else created_at, expires.isoformat() if expires else expires_at,
+                to_ts(created), to_ts(expires))
+
+    for table in ("orders", "trips"):
+        if 'created_ts' not in _table_columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN created_ts INTEGER")
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN expires_ts INTEGER")
+    if 'date_ts' not in _table_columns(conn, "trips"):
+        conn.execute("ALTER TABLE trips ADD COLUMN date_ts INTEGER")
+    _backfill(conn, "orders", ("created_at", "expires_at"), ("created_at", "expires_at", "created_ts", "expires_ts"), times)
+    _backfill(conn, "trips", ("created_at", "expires_at", "date"), ("created_at", "expires_at", "created_ts", "expires_ts", "date_ts"),
+              lambda created_at, expires_at, date: times(created_at, expires_at) + (to_ts(parse(date)),))
+    # Metin sütunlarındaki indeksler aynı erişim yollarıyla tamsayı sütunlara taşınır
+    for table in ("orders", "trips"):
+        for name in ("active_created", "owner_active", "active_expires", "city_route"):
+            conn.execute(f"DROP INDEX IF EXISTS idx_{table}_{name}")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_active_created_ts ON {table}(created_ts, expires_ts) WHERE is_active = 1")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_owner_active_ts ON {table}(tg_id, created_ts, expires_ts) WHERE is_active = 1")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_active_expires_ts ON {table}(expires_ts) WHERE is_active = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_city_route_ts ON orders(from_city_id, to_city_id, created_ts) WHERE is_active = 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_trips_city_route_ts ON trips(from_city_id, to_city_id, date_ts) WHERE is_active = 1")
+
+def _migrate_price_columns(conn):
+    # Fiyat metinlerinin ayrıştırılmış hali; fiyat görünümleri (en ucuz önce, üst sınırlı) bu sütunlarla sıralanır
+    for kind, table, text_col, weight_col in (("order", "orders", "price", "weight"), ("trip", "trips", "price_per_kg", "NULL")):
+        if 'price_cents' not in _table_columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN price_cents INTEGER")
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN price_currency TEXT")
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN price_unit TEXT")
+        _backfill(conn, table, (text_col, weight_col), ("price_cents", "price_currency", "price_unit"),
+                  lambda text, weight, kind=kind: price_fields(kind, text, weight))
+        # /list fiyat görünümü: para birimi içinde tutara göre; /search: aynı sıralama güzergah önekiyle
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_active_price ON {table}(price_currency, price_cents) WHERE is_active = 1")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_route_price ON {table}(from_city_id, to_city_id, price_currency, price_cents) WHERE is_active = 1")
+
+def _migrate_reservations(conn):
+    # Yolculuk kapasitesinin siparişlere ayrılması: her ayırma defterde bir satır, trips.reserved_kg aktif satırların toplamı
+    columns = _table_columns(conn, "trips")
+    if 'reserved_kg' not in columns:
+        conn.execute("ALTER TABLE trips ADD COLUMN reserved_kg REAL NOT NULL DEFAULT 0")
+    # Dolduğu için kapanan yolculuk: iptalle yer açılınca (süresi geçmemişse) yeniden yayına alınır
+    if 'closed_full' not in columns:
+        conn.execute("ALTER TABLE trips ADD COLUMN closed_full INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        trip_id INTEGER NOT NULL REFERENCES trips(id),
+        order_id INTEGER NOT NULL REFERENCES orders(id),
+        trip_owner_id INTEGER NOT NULL,
+        requester_id INTEGER NOT NULL,
+        weight_kg REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'active',
+        created_ts INTEGER NOT NULL,
+        cancelled_ts INTEGER
+    )
+    """)
+    # Bir sipariş aynı anda tek yolculukta yer tutabilir
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_reservations_order_active ON reservations(order_id) WHERE status = 'active'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_trip ON reservations(trip_id, status)")
+    # Son savunma hattı: reserved_kg'yi kapasitenin üstüne çıkaran her yazma (hangi yoldan gelirse gelsin) geri alınır
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_trips_no_overbooking
+    BEFORE UPDATE OF reserved_kg ON trips
+    WHEN NEW.reserved_kg > NEW.capacity_kg
+    BEGIN
+        SELECT RAISE(ABORT, 'trip capacity exceeded');
+    END
+    """)
+
+MIGRATIONS = [
+    (1, "base tables", _migrate_base_tables),
+    (2, "users.lang", _migrate_users_lang),
+    (3, "listing expires_at/is_active", _migrate_listing_expiry),
+    (4, "listing indexes", _migrate_listing_indexes),
+    (5, "route keys", _migrate_route_keys),
+    (6, "canonical city ids", _migrate_city_ids),
+    (7, "order match index", _migrate_match_index),
+    (8, "contact requests and digest outbox", _migrate_contact_requests),
+    (9, "epoch timestamp columns", _migrate_epoch_columns),
+    (10, "structured prices", _migrate_price_columns),
+    (11, "trip capacity reservations", _migrate_reservations),
+]
 
-    conn.close()
+def init_db():
+    """schema_version'a göre bekleyen migration'ları sırayla uygular"""
+    with db_transaction() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+        """)
+        current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with db_transaction() as conn:
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat())
+            )
+        print(f"✅ Applied migration {version}: {name}")
+    get_db().execute("PRAGMA optimize")
 
 def db_execute(query, params=(), fetch=False, many=False):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
+    conn = get_db()
     if many:
-        c.executemany(query, params)
-        conn.commit()
-        conn.close()
+        with db_transaction():
+            conn.executemany(query, params)
         return
-    c.execute(query, params)
+    c = conn.execute(query, params)
     if fetch:
-        rows = c.fetchall()
-        conn.close()
-        return rows
-    conn.commit()
-    conn.close()
+        return c.fetchall()
+
+# ====== IN-MEMORY CACHES ======
+_MISSING = object()
+
+class LRUCache:
+    """Thread-safe, boyutu sınırlı LRU önbellek; ttl verilirse kayıtlar o kadar saniye geçerlidir"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._data)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+UserRow = namedtuple("UserRow", "lang username first_name last_name")
+# Değer None ise kullanıcı DB'de yok demektir (negatif önbellek)
+user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def get_user(tg_id):
+    """Kullanıcı satırını önbellekten, yoksa DB'den getirir"""
+    row = user_cache.get(tg_id, _MISSING)
+    if row is _MISSING:
+        rows = db_execute("SELECT lang, username, first_name, last_name FROM users WHERE tg_id = ?", (tg_id,), fetch=True)
+        row = UserRow(*rows[0]) if rows else None
+        user_cache.set(tg_id, row)
+    return row
 
 # ====== DATE HELPER FUNCTIONS ======
-def parse_date_input(date_input, user_lang="tr"):
-    """Kullanıcının tarih girdisini parse eder"""
+# İlan zamanları (created_ts, expires_ts, date_ts) UTC epoch saniyesi olarak tutulur ve sorgular bu
+# tamsayılarla yapılır. Metin <-> sayı dönüşümleri yalnızca buradaki fonksiyonlarla yapılmalı.
+_EPOCH = datetime(1970, 1, 1)
+DAY_SECONDS = 86400
+
+def to_ts(value):
+    """datetime (naive = UTC), date, ISO metni ('T' ya da boşluk ayraçlı, yalnız tarih de olabilir) ya da sayıyı epoch saniyesine çevirir"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    elif not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // timedelta(seconds=1)
+
+def now_ts():
+    return int(time.time())
+
+def today_ts():
+    """Bugünün (UTC) başlangıcı"""
+    now = now_ts()
+    return now - now % DAY_SECONDS
+
+def ts_to_datetime(ts):
+    return _EPOCH + timedelta(seconds=ts)
+
+def ts_to_iso(ts):
+    return ts_to_datetime(ts).isoformat()
+
+def ts_to_day(ts):
+    """'YYYY-MM-DD' (kartlarda gösterilen biçim)"""
+    return ts_to_datetime(ts).date().isoformat()
+
+def parse_day(text):
+    """'YYYY-MM-DD' -> o günün başlangıcı (epoch saniyesi); geçersizse ValueError"""
+    return to_ts(datetime.strptime(text, "%Y-%m-%d"))
+
+def parse_date_input(date_input, user_lang=DEFAULT_LANG):
+    """Kullanıcının tarih girdisini (gün sayısı ya da YYYY-MM-DD) epoch saniyesine çevirir"""
     try:
         # Eğer sayı ise (gün sayısı)
         if date_input.isdigit():
             days = int(date_input)
             if days <= 0:
-                return None, MESSAGES["date_in_past"].get(user_lang)
-            return datetime.utcnow() + timedelta(days=days), None
+                return None, text_for(user_lang, MSG.date_in_past)
+            return now_ts() + days * DAY_SECONDS, None
         
         # Tarih formatı ise (YYYY-MM-DD)
-        date_obj = datetime.strptime(date_input, "%Y-%m-%d")
-        if date_obj.date() < datetime.utcnow().date():
-            return None, MESSAGES["date_in_past"].get(user_lang)
-        return date_obj, None
+        day = parse_day(date_input)
+        if day < today_ts():
+            return None, text_for(user_lang, MSG.date_in_past)
+        return day, None
         
     except ValueError:
-        return None, MESSAGES["invalid_date"].get(user_lang)
+        return None, text_for(user_lang, MSG.invalid_date)
 
 def calculate_trip_expiry(trip_date_str):
-    """Seyahat tarihine göre expiry hesaplar (seyahat tarihi + 1 gün)"""
+    """Seyahat tarihine göre expiry hesaplar (seyahat tarihi + 1 gün, epoch saniyesi)"""
     try:
-        trip_date = datetime.strptime(trip_date_str, "%Y-%m-%d")
         # Seyahat tarihinden sonraki günün başlangıcı
-        expiry_date = trip_date + timedelta(days=1)
-        return expiry_date
+        return parse_day(trip_date_str) + DAY_SECONDS
     except ValueError:
         # Geçersiz tarih durumunda varsayılan süre
-        return datetime.utcnow() + timedelta(days=DEFAULT_LISTING_EXPIRY_DAYS)
-
-# ====== USER STATE MANAGEMENT ======
-def set_user_state(user_id, state, data=None):
-    """Kullanıcının mevcut durumunu kaydeder"""
-    updated_at = datetime.utcnow().isoformat()
-    db_execute(
-        "INSERT OR REPLACE INTO user_states (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)",
-        (user_id, state, data, updated_at)
-    )
+        return now_ts() + DEFAULT_LISTING_EXPIRY_DAYS * DAY_SECONDS
+
+# ====== PRICES ======
+# Serbest metin fiyatlar ("10€", "2 eur/kg", "1.500 TL") ilan kaydedilirken ayrıştırılır ve ham metnin yanında
+# price_cents (kuruş cinsinden karşılaştırılabilir tutar: sipariş için toplam, yolculuk için kg başı),
+# price_currency (ISO kodu) ve price_unit ('kg' ya da NULL) sütunlarına yazılır. Ayrıştırılamayan fiyatlar
+# NULL kalır ve yalnızca fiyat görünümlerinde görünmez.
+Price = namedtuple("Price", "cents currency unit")
+
+CURRENCY_CODES = {
+    "€": "EUR", "eur": "EUR", "euro": "EUR", "euros": "EUR", "avro": "EUR", "евро": "EUR",
+    "$": "USD", "usd": "USD", "dollar": "USD", "dollars": "USD", "dolar": "USD", "доллар": "USD", "долларов": "USD",
+    "£": "GBP", "gbp": "GBP", "pound": "GBP", "pounds": "GBP", "sterlin": "GBP",
+    "₺": "TRY", "tl": "TRY", "try": "TRY", "lira": "TRY",
+    "₽": "RUB", "rub": "RUB", "руб": "RUB", "рубль": "RUB", "рублей": "RUB",
+}
+FREE_PRICE_WORDS = ("free", "ücretsiz", "bedava", "бесплатно")
+_CURRENCY_TOKEN = re.compile(
+    r"[€$£₺₽]|\b(?:" + "|".join(sorted((re.escape(k) for k in CURRENCY_CODES if k.isalpha()), key=len, reverse=True)) + r")\b"
+)
+# Binlik ayraçlı (1.500, 10 000) ya da en fazla iki ondalıklı (2,5 / 12.90) sayı
+_PRICE_NUMBER = re.compile(r"(?<![\d.,])(?:\d{1,3}(?:[ .,]\d{3})+|\d+(?:[.,]\d{1,2})?)(?![\d])")
+_PER_KG = re.compile(r"(?:/|\bper\b|\bза\b)\s*(?:kg|кг)\b|\b(?:kg|кг)\s*(?:başı|basi)\b")
+
+def parse_price(text, default_currency=PRICE_DEFAULT_CURRENCY):
+    """Fiyat metnini Price(cents, currency, unit)'e çevirir; tek bir tutar ve en fazla bir para birimi yoksa None"""
+    lowered = (text or "").lower()
+    currencies = {CURRENCY_CODES[token] for token in _CURRENCY_TOKEN.findall(lowered)}
+    if len(currencies) > 1:
+        return None
+    currency = currencies.pop() if currencies else default_currency
+    unit = "kg" if _PER_KG.search(lowered) else None
+    if any(word in lowered for word in FREE_PRICE_WORDS):
+        return Price(0, currency, unit) if currency else None
+    numbers = _PRICE_NUMBER.findall(_PER_KG.sub(" ", lowered))
+    if len(numbers) != 1 or not currency:
+        return None
+    number = numbers[0]
+    if re.fullmatch(r"\d{1,3}(?:[ .,]\d{3})+", number):
+        cents = int(re.sub(r"\D", "", number)) * 100
+    else:
+        whole, _, fraction = number.replace(",", ".").partition(".")
+        cents = int(whole) * 100 + int(fraction.ljust(2, "0") or 0)
+    return Price(cents, currency, unit)
+
+def price_fields(kind, text, weight=None):
+    """İlanın (price_cents, price_currency, price_unit) sütun değerleri"""
+    price = parse_price(text)
+    if price is None:
+        return None, None, None
+    cents = price.cents
+    # Yolculuk fiyatı her zaman kg başıdır; kg başı yazılmış sipariş fiyatı toplam tutara çevrilir
+    if kind == "trip":
+        return cents, price.currency, "kg"
+    if price.unit == "kg":
+        if not weight:
+            return None, None, None
+        cents = round(cents * weight)
+    return cents, price.currency, price.unit
+
+def format_price(cents, currency):
+    amount = f"{cents / 100:.2f}".rstrip("0").rstrip(".")
+    return f"{amount} {currency}"
+
+# Fiyat görünümü: hangi ilan türleri, hangi para birimi ve (varsa) üst sınır; en ucuz önce sıralanır.
+# Sipariş fiyatı toplam, yolculuk fiyatı kg başı tutardır; karşılaştırılamadıkları için fiyat görünümü tek türlüdür.
+ListView = namedtuple("ListView", "kinds currency max_cents")
+VIEW_KIND_TOKENS = {"orders": ("order",), "trips": ("trip",)}
+
+def parse_price_view(tokens):
+    """'price', 'price=TRY', 'max=20€', 'orders'/'trips' argümanlarını ayıklar: (view ya da None, kalan tokenlar);
+    geçersizse ya da fiyat görünümünde tür (orders/trips) seçilmemişse None"""
+    kinds, currency, max_text, sort_by_price, rest = ("order", "trip"), None, None, False, []
+    for i, token in enumerate(tokens):
+        lowered = token.lower()
+        if i and lowered in CURRENCY_CODES and tokens[i - 1].lower().startswith("max="):
+            max_text = f"{max_text} {token}"  # 'max=1000 TL'
+        elif lowered in VIEW_KIND_TOKENS:
+            kinds = VIEW_KIND_TOKENS[lowered]
+        elif lowered == "price":
+            sort_by_price = True
+        elif lowered.startswith("price="):
+            currency = CURRENCY_CODES.get(lowered[6:], lowered[6:].upper())
+            if not re.fullmatch(r"[A-Z]{3}", currency):
+                return None
+            sort_by_price = True
+        elif lowered.startswith("max="):
+            max_text, sort_by_price = token[4:], True
+        else:
+            rest.append(token)
+    if not sort_by_price:
+        return (ListView(kinds, None, None) if kinds != ("order", "trip") else None), rest
+    if len(kinds) != 1:
+        return None
+    max_cents = None
+    if max_text is not None:
+        price = parse_price(max_text, default_currency=currency or PRICE_DEFAULT_CURRENCY)
+        if price is None or (currency and price.currency != currency):
+            return None
+        max_cents, currency = price.cents, price.currency
+    currency = currency or PRICE_DEFAULT_CURRENCY
+    if not currency:
+        return None
+    return ListView(kinds, currency, max_cents), rest
+
+def encode_view(view):
+    """Callback verisine eklenen kısa biçim: 'ot.EUR.2000'"""
+    return f"{''.join(kind[0] for kind in view.kinds)}.{view.currency or ''}.{'' if view.max_cents is None else view.max_cents}"
+
+def decode_view(text):
+    code, currency, max_cents = text.split(".")
+    kinds = tuple(kind for kind in ("order", "trip") if kind[0] in code)
+    if len(kinds) != 1:
+        # Eski mesajlardaki karışık fiyat görünümü düğmeleri: fiyat süzgeci olmadan tarih sırasına düşer
+        return ListView(kinds, None, None)
+    return ListView(kinds, currency or None, int(max_cents) if max_cents else None)
+
+# ====== CITY NAMES ======
+# Kanonik şehir adı -> bilinen yazımlar (EN / TR / RU). Anahtarlar normalize_city_key ile katlanarak
+# city_aliases tablosuna yazılır; listede olmayan şehirler ilk görüldüklerinde otomatik eklenir.
+CITY_ALIASES = {
+    "Lefkoşa": ["Lefkosa", "Nicosia", "Lefkosia", "Лефкоша", "Никосия"],
+    "Girne": ["Kyrenia", "Keryneia", "Кирения", "Гирне"],
+    "Gazimağusa": ["Mağusa", "Famagusta", "Ammochostos", "Фамагуста", "Газимагуса"],
+    "Güzelyurt": ["Morphou", "Morfou", "Морфу", "Гюзельюрт"],
+    "İskele": ["Trikomo", "Искеле"],
+    "Lefke": ["Lefka", "Лефке"],
+    "Larnaka": ["Larnaca", "Ларнака"],
+    "Limasol": ["Limassol", "Lemesos", "Лимасол"],
+    "Baf": ["Paphos", "Pafos", "Пафос"],
+    "Ercan": ["Ercan Airport", "Эрджан"],
+    "İstanbul": ["Constantinople", "Стамбул"],
+    "Ankara": ["Анкара"],
+    "İzmir": ["Smyrna", "Измир"],
+    "Antalya": ["Анталья", "Анталия"],
+    "Adana": ["Адана"],
+    "Mersin": ["Мерсин"],
+    "Bursa": ["Бурса"],
+    "Moskova": ["Moscow", "Moskva", "Москва"],
+    "Sankt-Peterburg": ["Saint Petersburg", "St Petersburg", "St. Petersburg", "Petersburg", "Санкт-Петербург", "Питер"],
+    "Londra": ["London", "Лондон"],
+    "Berlin": ["Берлин"],
+    "Bakü": ["Baku", "Баку"],
+    "Tiflis": ["Tbilisi", "Тбилиси"],
+    "Dubai": ["Dubay", "Дубай"],
+}
+
+# Kiril -> Latin (tek yönlü, yalnızca eşleştirme anahtarı için)
+_CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i",
+    "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t",
+    "у": "u", "ф": "f", "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "",
+    "э": "e", "ю": "yu", "я": "ya",
+})
+# Türkçe noktalı/noktasız I: hepsi 'i' kabul edilir ("Istanbul" == "İstanbul" == "ıstanbul")
+_TURKISH_I = str.maketrans({"İ": "i", "I": "i", "ı": "i"})
+
+def normalize_city_key(city):
+    """Şehir adını eşleştirme anahtarına katlar: büyük/küçük harf, Türkçe I, aksan, Kiril, boşluk ve noktalama farkları yok sayılır"""
+    text = (city or "").translate(_TURKISH_I).casefold().translate(_CYRILLIC_TO_LATIN)
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in text if ch.isalnum() and not unicodedata.combining(ch))
+
+# alias anahtarı -> şehir id (başlangıçta bir kez yüklenir; başka süreçlerin eklediği şehirler ilk sorulduğunda DB'den)
+_city_ids = {}
+_city_ids_lock = threading.Lock()
+_city_ids_loaded = False
+
+def load_city_aliases(conn=None):
+    """city_aliases tablosunu belleğe yükler"""
+    global _city_ids_loaded
+    conn = conn or get_db()
+    rows = conn.execute("SELECT alias, city_id FROM city_aliases").fetchall()
+    with _city_ids_lock:
+        _city_ids.clear()
+        _city_ids.update(rows)
+        _city_ids_loaded = True
+    return len(rows)
+
+def lookup_city_id(city):
+    """Bilinen bir şehrin id'sini döndürür; tanınmıyorsa None"""
+    if not _city_ids_loaded:
+        load_city_aliases()
+    key = normalize_city_key(city)
+    city_id = _city_ids.get(key)
+    if city_id is None and key:
+        # Başka bir shard resolve_city_id ile eklemiş olabilir; bulunursa önbelleğe alınır
+        rows = db_execute("SELECT city_id FROM city_aliases WHERE alias = ?", (key,), fetch=True)
+        if rows:
+            city_id = _city_ids[key] = rows[0][0]
+    return city_id
+
+def resolve_city_id(city):
+    """Şehrin kanonik id'sini döndürür; tanınmıyorsa yeni şehir olarak ekler (boş ad için None)"""
+    key = normalize_city_key(city)
+    if not key:
+        return None
+    city_id = lookup_city_id(city)
+    if city_id is not None:
+        return city_id
+    with _city_ids_lock:
+        with db_transaction() as conn:
+            # Başka bir süreç aynı şehri eklemiş olabilir
+            row = conn.execute("SELECT city_id FROM city_aliases WHERE alias = ?", (key,)).fetchone()
+            if row:
+                city_id = row[0]
+            else:
+                city_id = conn.execute("INSERT INTO cities (name) VALUES (?)", (" ".join(city.split()),)).lastrowid
+                conn.execute("INSERT INTO city_aliases (alias, city_id) VALUES (?, ?)", (key, city_id))
+        _city_ids[key] = city_id
+    return city_id
+
+# ====== CONVERSATION STATE MACHINE ======
+# Sihirbaz akışları (sipariş / yolculuk ekleme) tanımsal olarak Flow/Step ile tanımlanır.
+# Aktif durum bellekte tutulur; user_states tablosuna yalnızca ertelenmiş checkpoint yazılır.
+Step = namedtuple("Step", "field prompt_key parse")   # parse(text, lang) -> (value, error)
+Flow = namedtuple("Flow", "name steps on_complete")   # on_complete(message, data)
+
+FLOWS = {}
+
+@dataclass
+class Conversation:
+    flow: str
+    step: int = 0
+    data: dict = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def state(self):
+        """user_states.state sütununda saklanan biçim: '<flow>:<field>'"""
+        return f"{self.flow}:{FLOWS[self.flow].steps[self.step].field}"
+
+def register_flow(flow):
+    FLOWS[flow.name] = flow
+    return flow
+
+_conversations = {}
+# user_id -> (state, data_json, updated_at) ya da silinecekse None
+_dirty_states = {}
+_dirty_states_lock = threading.Lock()
+# user_states tablosunda satırı olan kullanıcılar (gereksiz DELETE'leri önlemek için)
+_persisted_states = set()
+
+def _mark_state_dirty(user_id, conv):
+    snapshot = None
+    if conv is not None:
+        snapshot = (conv.state, json.dumps(conv.data, ensure_ascii=False), datetime.utcfromtimestamp(conv.updated_at).isoformat())
+    with _dirty_states_lock:
+        _dirty_states[user_id] = snapshot
+
+def set_user_state(user_id, conv):
+    """Kullanıcının mevcut durumunu bellekte günceller ve checkpoint için işaretler"""
+    conv.updated_at = time.time()
+    _conversations[user_id] = conv
+    _mark_state_dirty(user_id, conv)
 
 def get_user_state(user_id):
-    """Kullanıcının mevcut durumunu getirir"""
-    row = db_execute("SELECT state, data FROM user_states WHERE user_id = ?", (user_id,), fetch=True)
-    if row:
-        return row[0][0], row[0][1]
-    return None, None
+    """Kullanıcının mevcut durumunu getirir (DB'ye gitmez)"""
+    return _conversations.get(user_id)
 
 def clear_user_state(user_id):
     """Kullanıcının durumunu temizler"""
-    db_execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+    if _conversations.pop(user_id, None) is not None or user_id in _persisted_states:
+        _mark_state_dirty(user_id, None)
 
-# ====== EXPIRED LISTINGS CLEANUP ======
-def cleanup_expired_listings():
-    """Süresi dolmuş veya seyahat tarihi geçmiş ilanları temizler"""
-    now = datetime.utcnow().isoformat()
-    
-    # Orders temizleme (expires_at geçmiş ve aktif olanlar)
-    expired_orders = db_execute(
-        "SELECT id FROM orders WHERE expires_at < ? AND is_active = 1", 
-        (now,), 
-        fetch=True
-    )
-    if expired_orders:
-        db_execute("UPDATE orders SET is_active = 0 WHERE expires_at < ? AND is_active = 1", (now,))
-        print(f"✅ Deactivated {len(expired_orders)} expired orders")
-    
-    # Trips temizleme (expires_at geçmiş ve aktif olanlar)
-    expired_trips = db_execute(
-        "SELECT id FROM trips WHERE expires_at < ? AND is_active = 1", 
-        (now,), 
-        fetch=True
-    )
-    if expired_trips:
-        db_execute("UPDATE trips SET is_active = 0 WHERE expires_at < ? AND is_active = 1", (now,))
-        print(f"✅ Deactivated {len(expired_trips)} expired trips")
+def flush_state_checkpoints():
+    """Değişen durumları user_states tablosuna tek transaction ile yazar"""
+    global _dirty_states
+    with _dirty_states_lock:
+        dirty, _dirty_states = _dirty_states, {}
+    if not dirty:
+        return
+    upserts = [(uid,) + snap for uid, snap in dirty.items() if snap is not None]
+    deletes = [(uid,) for uid, snap in dirty.items() if snap is None and uid in _persisted_states]
+    try:
+        with db_transaction() as conn:
+            if upserts:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_states (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                    upserts
+                )
+            if deletes:
+                conn.executemany("DELETE FROM user_states WHERE user_id = ?", deletes)
+    except Exception:
+        with _dirty_states_lock:
+            for uid, snap in dirty.items():
+                _dirty_states.setdefault(uid, snap)
+        raise
+    _persisted_states.update(row[0] for row in upserts)
+    _persisted_states.difference_update(row[0] for row in deletes)
 
-def auto_cleanup_worker():
-    """Her gün otomatik temizleme yapar"""
-    while True:
-        try:
-            cleanup_expired_listings()
-            # 24 saat bekle
-            time.sleep(24 * 60 * 60)
-        except Exception as e:
-            print(f"❌ Cleanup error: {e}")
-            time.sleep(60 * 60)  # 1 saat sonra tekrar dene
+# Eski sürümün user_states kayıtları: state adı -> (flow, adım), data '|' ile birleştirilmiş
+_LEGACY_STATES = {
+    "waiting_product": ("order", 0),
+    "waiting_weight": ("order", 1),
+    "waiting_from_city": ("order", 2),
+    "waiting_to_city": ("order", 3),
+    "waiting_price": ("order", 4),
+    "waiting_order_expiry": ("order", 5),
+    "waiting_trip_from": ("trip", 0),
+    "waiting_trip_to": ("trip", 1),
+    "waiting_trip_date": ("trip", 2),
+    "waiting_trip_capacity": ("trip", 3),
+    "waiting_trip_price": ("trip", 4),
+}
+
+def _decode_state(state, data, updated_at):
+    """user_states satırını Conversation'a çevirir; tanınmıyorsa None döner"""
+    try:
+        if state in _LEGACY_STATES:
+            flow_name, step = _LEGACY_STATES[state]
+            flow = FLOWS[flow_name]
+            values = data.split("|") if data else []
+            if len(values) != step:
+                return None
+            conv_data = {}
+            for past, raw in zip(flow.steps, values):
+                value, error = past.parse(raw, "en")
+                if error:
+                    return None
+                conv_data[past.field] = value
+        else:
+            flow_name, step_field = state.split(":", 1)
+            flow = FLOWS[flow_name]
+            step = [s.field for s in flow.steps].index(step_field)
+            conv_data = json.loads(data) if data else {}
+        ts = datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc).timestamp() if updated_at else time.time()
+    except (KeyError, ValueError, TypeError):
+        return None
+    return Conversation(flow_name, step, conv_data, ts)
+
+def restore_conversations(owns=None):
+    """Başlangıçta yarım kalmış akışları user_states'ten tek sorguda belleğe yükler (owns: yalnızca bu kullanıcılar)"""
+    cutoff = (datetime.utcnow() - timedelta(hours=CONVERSATION_TTL_HOURS)).isoformat()
+    with db_transaction() as conn:
+        conn.execute("DELETE FROM user_states WHERE updated_at < ? OR updated_at IS NULL", (cutoff,))
+        rows = conn.execute("SELECT user_id, state, data, updated_at FROM user_states").fetchall()
+        invalid = []
+        restored = 0
+        for user_id, state, data, updated_at in rows:
+            if owns and not owns(user_id):
+                continue
+            conv = _decode_state(state, data, updated_at)
+            if conv is None:
+                invalid.append((user_id,))
+                continue
+            _conversations[user_id] = conv
+            _persisted_states.add(user_id)
+            restored += 1
+        if invalid:
+            conn.executemany("DELETE FROM user_states WHERE user_id = ?", invalid)
+    return restored
+
+def expire_stale_conversations():
+    """CONVERSATION_TTL_HOURS boyunca ilerlemeyen akışları bellekten ve DB'den siler"""
+    cutoff = time.time() - CONVERSATION_TTL_HOURS * 3600
+    stale = [uid for uid, conv in list(_conversations.items()) if conv.updated_at < cutoff]
+    for uid in stale:
+        clear_user_state(uid)
+    return len(stale)
+
+def start_conversation(message, flow):
+    """Akışı ilk adımdan başlatır ve ilk soruyu gönderir"""
+    user_id = message.from_user.id
+    conv = Conversation(flow.name)
+    set_user_state(user_id, conv)
+    send_message(message.chat.id, get_text(flow.steps[0].prompt_key, user_id))
+
+def advance_conversation(message, conv):
+    """Mesajı akışın mevcut adımına uygular; son adımda on_complete çağrılır"""
+    user_id = message.from_user.id
+    flow = FLOWS[conv.flow]
+    step = flow.steps[conv.step]
+    value, error = step.parse(message.text.strip(), get_lang(user_id))
+    if error:
+        send_message(message.chat.id, error)
+        return
+    conv.data[step.field] = value
+    if conv.step + 1 < len(flow.steps):
+        conv.step += 1
+        set_user_state(user_id, conv)
+        send_message(message.chat.id, get_text(flow.steps[conv.step].prompt_key, user_id))
+        return
+    flow.on_complete(message, conv.data)
+    clear_user_state(user_id)
+
+# ---- Step parsers: (text, lang) -> (value, error) ----
+def parse_text(text, user_lang):
+    return text, None
+
+def parse_float(text, user_lang):
+    try:
+        return float(text), None
+    except ValueError:
+        return 0.0, None
+
+def parse_order_expiry(text, user_lang):
+    expires_ts, error = parse_date_input(text, user_lang)
+    if error:
+        return None, error
+    return expires_ts, None
+
+def parse_trip_date(text, user_lang):
+    try:
+        trip_day = parse_day(text)
+    except ValueError:
+        return None, text_for(user_lang, MSG.invalid_date)
+    if trip_day < today_ts():
+        return None, text_for(user_lang, MSG.date_in_past)
+    return text, None
+
+# ====== EXPIRY SCHEDULER ======
+class ExpiryScheduler:
+    """
+    Aktif ilanların bitiş zamanlarını bir min-heap'te tutar ve her ilanı süresi dolduğu anda
+    küçük transaction'larla devre dışı bırakır. Bu süreçte eklenen ilanlar schedule() ile,
+    başka süreçlerin eklediği satırlar sync() ile id > son görülen id üzerinden heap'e girer.
+    """
+
+    def __init__(self, batch_size=EXPIRY_BATCH_SIZE, sync_interval=EXPIRY_SYNC_INTERVAL):
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self._heap = []
+        self._last_ids = {"order": 0, "trip": 0}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def schedule(self, kind, item_id, expires_ts):
+        """Yeni ilanı bitiş zamanında kapatılmak üzere sıraya koyar"""
+        if not self.running:
+            return  # zamanlayıcı başka süreçte çalışıyor; ilan oradaki sync() ile alınır
+        entry = (expires_ts, kind, item_id)
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            self._last_ids[kind] = max(self._last_ids[kind], item_id)
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def sync(self):
+        """DB'de henüz görülmemiş aktif ilanları heap'e ekler"""
+        for kind, table, _ in LISTING_TABLES:
+            rows = db_execute(
+                f"SELECT id, expires_ts, is_active FROM {table} WHERE id > ?",
+                (self._last_ids[kind],),
+                fetch=True
+            ) or []
+            entries = [(expires_ts, kind, item_id)
+                       for item_id, expires_ts, is_active in rows if is_active and expires_ts is not None]
+            with self._cond:
+                if len(entries) > len(self._heap):
+                    self._heap.extend(entries)
+                    heapq.heapify(self._heap)
+                else:
+                    for entry in entries:
+                        heapq.heappush(self._heap, entry)
+                if rows:
+                    self._last_ids[kind] = max(self._last_ids[kind], rows[-1][0])
+                    self._cond.notify()
+
+    def _pop_due(self, now):
+        due = defaultdict(list)
+        for _ in range(self.batch_size):
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, kind, item_id = heapq.heappop(self._heap)
+            due[kind].append(item_id)
+        return due
+
+    def _deactivate(self, kind, item_ids):
+        placeholders = ", ".join("?" * len(item_ids))
+        if kind == "order":
+            query = f"UPDATE orders SET is_active = 0 WHERE id IN ({placeholders}) AND is_active = 1 RETURNING id"
+        else:
+            # Dolduğu için zaten kapalı olan yolculuğun da süresi biter: rezervasyonları bırakılır, yeniden açılmaz
+            query = (f"UPDATE trips SET is_active = 0, closed_full = 0 WHERE id IN ({placeholders}) "
+                     "AND (is_active = 1 OR closed_full = 1) RETURNING id")
+        released = reopened = ()
+        with db_transaction() as conn:
+            closed = [row[0] for row in conn.execute(query, item_ids).fetchall()]
+            if closed:
+                released, reopened = release_reservations(conn, kind, closed, "expired")
+        if closed:
+            on_listings_deactivated(kind, closed)
+            on_reservations_released(kind, released, reopened)
+        return len(closed)
+
+    def run_due(self):
+        """Süresi dolmuş ilanları batch_size'lık transaction'larla kapatır; kapatılan ilan sayısını döner"""
+        total = 0
+        while True:
+            with self._cond:
+                due = self._pop_due(time.time())
+            if not due:
+                break
+            for kind, item_ids in due.items():
+                try:
+                    total += self._deactivate(kind, item_ids)
+                except Exception as e:
+                    print(f"❌ Expiry batch for {len(item_ids)} {kind}s failed: {e}")
+                    retry_at = time.time() + 60
+                    with self._cond:
+                        for item_id in item_ids:
+                            heapq.heappush(self._heap, (retry_at, kind, item_id))
+        if total:
+            print(f"✅ Deactivated {total} expired listings")
+        return total
+
+    def _run(self):
+        next_sync = time.time() + self.sync_interval
+        while True:
+            self.run_due()
+            with self._cond:
+                if self._stopping:
+                    return
+                now = time.time()
+                timeout = next_sync - now
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+            if time.time() >= next_sync:
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"❌ Expiry sync error: {e}")
+                next_sync = time.time() + self.sync_interval
+
+    def start(self):
+        """Aktif ilanları yükler, süresi geçmişleri hemen kapatır ve zamanlayıcı thread'ini başlatır"""
+        self.sync()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="expiry-scheduler")
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Zamanlayıcıyı durdurur (graceful shutdown)"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+expiry_scheduler = ExpiryScheduler()
 
 # ====== COMMAND DETECTION MIDDLEWARE ======
 def is_command(message):
     """Mesajın komut olup olmadığını kontrol eder"""
     return (message.text and 
             (message.text.startswith('/') or 
-             message.text in ['/start', '/post_order', '/post_trip', '/list', '/profile', '/all_orders', '/all_trips', '/my_listings']))
+             message.text in ['/start', '/post_order', '/post_trip', '/list', '/search', '/profile', '/all_orders', '/all_trips', '/my_listings']))
 
 # ====== LANGUAGE HELPERS ======
 def get_lang(user_id):
-    row = db_execute("SELECT lang FROM users WHERE tg_id = ?", (user_id,), fetch=True)
-    if row and row[0][0]:
-        return row[0][0]
-    return "tr"
+    row = get_user(user_id)
+    if row and row.lang:
+        return row.lang
+    return DEFAULT_LANG
 
-def get_text(key, user_id):
-    lang = get_lang(user_id)
-    return MESSAGES.get(key, {}).get(lang, MESSAGES.get(key, {}).get("en", ""))
+def get_text(msg_id, user_id, **values):
+    return text_for(get_lang(user_id), msg_id, **values)
 
 # ====== USER REGISTER ======
+# tg_id -> (username, first_name, last_name); write_behind_worker toplu olarak yazar
+_pending_profile_writes = {}
+_pending_profile_lock = threading.Lock()
+
 def register_user(message):
+    """Yeni kullanıcıyı hemen ekler; profil değişikliklerini yalnızca fark varsa ertelenmiş yazmaya bırakır"""
     tg_id = message.from_user.id
     username = message.from_user.username
     first_name = message.from_user.first_name or ""
     last_name = message.from_user.last_name or ""
-    registered_at = datetime.utcnow().isoformat()
-    exists = db_execute("SELECT 1 FROM users WHERE tg_id = ?", (tg_id,), fetch=True)
-    if not exists:
+    existing = get_user(tg_id)
+    if existing is None:
+        registered_at = datetime.utcnow().isoformat()
         db_execute(
-            "INSERT INTO users (tg_id, username, first_name, last_name, registered_at, lang) VALUES (?, ?, ?, ?, ?, ?)",
+            "INSERT OR IGNORE INTO users (tg_id, username, first_name, last_name, registered_at, lang) VALUES (?, ?, ?, ?, ?, ?)",
             (tg_id, username, first_name, last_name, registered_at, None)
         )
-    else:
+        user_cache.set(tg_id, UserRow(None, username, first_name, last_name))
+        return
+    # Önbellekteki profil parmak izi aynıysa DB'ye dokunma
+    profile = (username, first_name, last_name)
+    if (existing.username, existing.first_name, existing.last_name) == profile:
+        return
+    user_cache.set(tg_id, existing._replace(username=username, first_name=first_name, last_name=last_name))
+    with _pending_profile_lock:
+        _pending_profile_writes[tg_id] = profile
+
+def flush_profile_writes():
+    """Bekleyen profil güncellemelerini tek bir executemany ile yazar"""
+    global _pending_profile_writes
+    with _pending_profile_lock:
+        pending, _pending_profile_writes = _pending_profile_writes, {}
+    if not pending:
+        return
+    try:
         db_execute(
             "UPDATE users SET username = ?, first_name = ?, last_name = ? WHERE tg_id = ?",
-            (username, first_name, last_name, tg_id)
+            [(username, first_name, last_name, tg_id) for tg_id, (username, first_name, last_name) in pending.items()],
+            many=True
         )
+    except Exception:
+        # Yazılamayanları geri koy; bu arada gelen daha yeni değerleri ezme
+        with _pending_profile_lock:
+            for tg_id, profile in pending.items():
+                _pending_profile_writes.setdefault(tg_id, profile)
+        raise
 
-# ====== UTIL FORMATTERS (orders/trips) ======
-def format_order_row(row, show_controls=False, user_id=None):
-    oid, tg_id, product, weight, from_city, to_city, price, created_at, expires_at, is_active = row
-    status = "✅ Active" if is_active else "❌ Inactive"
-    text = f"📦 <b>Order #{oid}</b> - {status}\n"
-    text += f"👤 Owner: <code>{tg_id}</code>\n"
-    if from_city and to_city:
-        text += f"📍 <b>{from_city}</b> → <b>{to_city}</b>\n"
-    text += f"📝 Product: {product}\n⚖️ Weight: {weight} kg\n💰 Price: {price}\n🕒 Created: {created_at.split('T')[0]}\n⏰ Expires: {expires_at.split('T')[0]}"
-    
-    return text
-
-def format_trip_row(row, show_controls=False, user_id=None):
-    tid, tg_id, from_city, to_city, date, capacity_kg, price_per_kg, created_at, expires_at, is_active = row
-    status = "✅ Active" if is_active else "❌ Inactive"
-    text = f"🛄 <b>Trip #{tid}</b> - {status}\n"
-    text += f"👤 Owner: <code>{tg_id}</code>\n"
-    text += f"📍 <b>{from_city}</b> → <b>{to_city}</b>\n📅 Trip Date: {date}\n⚖️ Free: {capacity_kg} kg\n💵 Price: {price_per_kg}\n🕒 Created: {created_at.split('T')[0]}\n⏰ Expires: {expires_at.split('T')[0]}"
-    
-    return text
+# ====== WRITE-BEHIND WORKER ======
+shutdown_event = threading.Event()
 
-# ====== COMMANDS / HANDLERS ======
-@bot.message_handler(commands=['start'])
-def cmd_start(message):
-    register_user(message)
-    clear_user_state(message.from_user.id)
-    markup = types.InlineKeyboardMarkup()
-    markup.row(
-        types.InlineKeyboardButton("English 🇬🇧", callback_data="setlang_en"),
-        types.InlineKeyboardButton("Türkçe 🇹🇷", callback_data="setlang_tr")
-    )
-    markup.row(
-        types.InlineKeyboardButton("Русский 🇷🇺", callback_data="setlang_ru")
-    )
-    prompt = ("🌐 Choose / Dil seçin / Выберите язык:\n\n"
-              "English 🇬🇧  — press English\n"
-              "Türkçe 🇹🇷  — Türkçe'ye basın\n"
-              "Русский 🇷🇺 — нажмите Русский")
-    bot.send_message(message.chat.id, prompt, reply_markup=markup)
+def flush_pending_writes():
+    """Bellekte bekleyen tüm ertelenmiş yazmaları DB'ye aktarır"""
+    flush_profile_writes()
+    flush_state_checkpoints()
 
-@bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("setlang_"))
-def callback_setlang(call):
-    lang = call.data.split("_")[1]
-    db_execute("UPDATE users SET lang = ? WHERE tg_id = ?", (lang, call.from_user.id))
-    bot.answer_callback_query(call.id, MESSAGES["lang_set_confirm"].get(lang, "✅ Language set!"))
-    bot.send_message(call.message.chat.id, get_text("start_welcome", call.from_user.id))
+def write_behind_worker():
+    """Ertelenmiş yazmaları WRITE_BEHIND_INTERVAL aralıklarla DB'ye aktarır"""
+    while not shutdown_event.wait(WRITE_BEHIND_INTERVAL):
+        try:
+            expire_stale_conversations()
+            flush_pending_writes()
+        except Exception as e:
+            print(f"❌ Write-behind flush error: {e}")
 
-# ---- POST ORDER flow ----
-@bot.message_handler(commands=['post_order'])
-def cmd_post_order(message):
-    register_user(message)
-    clear_user_state(message.from_user.id)
-    set_user_state(message.from_user.id, "waiting_product")
-    msg = bot.send_message(message.chat.id, get_text("ask_product", message.from_user.id))
-    bot.register_next_step_handler(msg, post_order_product)
+# ====== OUTBOUND SEND QUEUE ======
+# Tüm giden çağrılar (send_message / edit_* / answer_callback_query) tek bir dağıtıcıdan geçer: genel ve sohbet
+# başına token bucket, 429'da retry_after kadar bekleme, öncelik şeritleri ve aynı sohbete art arda giden düz
+# metinlerin birleştirilmesi. chat_id'si None olan işler (callback cevapları) yalnızca genel limite tabidir.
+LANE_INTERACTIVE, LANE_NOTIFY, LANE_BULK = 0, 1, 2
+LANE_NAMES = ("interactive", "notify", "bulk")
+TELEGRAM_MAX_TEXT = 4096
 
-def post_order_product(message):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    product = message.text.strip()
-    set_user_state(message.from_user.id, "waiting_weight", product)
-    msg = bot.send_message(message.chat.id, get_text("ask_weight", message.from_user.id))
-    bot.register_next_step_handler(msg, post_order_weight, product)
+class TokenBucket:
+    """Basit token bucket; kilitleme çağıran tarafta (SendDispatcher) yapılır"""
 
-def post_order_weight(message, product):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    try:
-        weight = float(message.text.strip())
-    except Exception:
-        weight = 0.0
-    set_user_state(message.from_user.id, "waiting_from_city", f"{product}|{weight}")
-    msg = bot.send_message(message.chat.id, get_text("ask_from", message.from_user.id))
-    bot.register_next_step_handler(msg, post_order_from, product, weight)
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
 
-def post_order_from(message, product, weight):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    from_city = message.text.strip()
-    set_user_state(message.from_user.id, "waiting_to_city", f"{product}|{weight}|{from_city}")
-    msg = bot.send_message(message.chat.id, get_text("ask_to", message.from_user.id))
-    bot.register_next_step_handler(msg, post_order_to, product, weight, from_city)
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
 
-def post_order_to(message, product, weight, from_city):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    to_city = message.text.strip()
-    set_user_state(message.from_user.id, "waiting_price", f"{product}|{weight}|{from_city}|{to_city}")
-    msg = bot.send_message(message.chat.id, get_text("ask_price", message.from_user.id))
-    bot.register_next_step_handler(msg, post_order_price, product, weight, from_city, to_city)
+    def ready_at(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
 
-def post_order_price(message, product, weight, from_city, to_city):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+class OutboundJob:
+    __slots__ = ("method", "chat_id", "args", "kwargs", "lane", "enqueued_at", "attempts", "on_error", "on_success")
+
+    def __init__(self, method, chat_id, args, kwargs, lane, on_error=None, on_success=None):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.on_error = on_error
+        self.on_success = on_success
+
+    @property
+    def coalescible(self):
+        # Geri çağrılı işler birleştirilmez; birleşen işin callback'i kaybolurdu
+        return (SEND_COALESCE and self.method == "send_message" and not self.kwargs and len(self.args) == 2
+                and self.on_error is None and self.on_success is None)
+
+class SendDispatcher:
+    """Öncelik şeritli, hız sınırlı giden mesaj kuyruğu"""
+    SCAN_LIMIT = 512
+    CHAT_BUCKET_LIMIT = 10000
+
+    def __init__(self, api, workers=SEND_WORKERS, global_rate=SEND_GLOBAL_RATE):
+        self.api = api
+        self.workers = workers
+        self._lanes = [deque() for _ in LANE_NAMES]
+        self._cond = threading.Condition()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._inflight = set()
+        self._threads = []
+        self._running = False
+        self.counters = {"submitted": 0, "sent": 0, "failed": 0, "retried": 0, "rate_limited": 0, "coalesced": 0}
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"send-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout=10):
+        """Kuyruktaki mesajların gönderilmesini timeout süresince bekler, sonra worker'ları durdurur"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while (any(self._lanes) or self._inflight) and time.monotonic() < deadline:
+                self._cond.wait(0.1)
+            self._running = False
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, method, chat_id, args, kwargs=None, lane=LANE_INTERACTIVE, on_error=None, on_success=None):
+        """api.<method>(*args, **kwargs) çağrısını kuyruğa ekler; chat_id hız sınırı için kullanılır"""
+        job = OutboundJob(method, chat_id, tuple(args), kwargs or {}, lane, on_error, on_success)
+        if not self._running:
+            # Dağıtıcı çalışmıyorsa (script / test kullanımı) doğrudan gönder
+            return self._execute(job)
+        with self._cond:
+            self._lanes[lane].append(job)
+            self.counters["submitted"] += 1
+            if len(self._chats) > self.CHAT_BUCKET_LIMIT:
+                now = time.monotonic()
+                for chat_id_, bucket in list(self._chats.items()):
+                    if bucket.idle(now) and chat_id_ not in self._inflight:
+                        del self._chats[chat_id_]
+            self._cond.notify()
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(SEND_CHAT_RATE, SEND_CHAT_BURST)
+        return bucket
+
+    def _pick(self, now):
+        """Gönderilmeye hazır en öncelikli işi seçer; yoksa (None, en erken hazır olma zamanı) döner"""
+        global_ready = self._global.ready_at(now)
+        if global_ready > now:
+            return None, global_ready
+        next_ready = None
+        for lane in self._lanes:
+            skipped = set()
+            for idx, job in enumerate(lane):
+                if idx >= self.SCAN_LIMIT:
+                    break
+                chat_id = job.chat_id
+                if chat_id is None:
+                    # Sohbete mesaj değil (callback cevabı): sohbet sırası ve limiti yok
+                    del lane[idx]
+                    self._global.consume(now)
+                    return job, None
+                if chat_id in skipped or chat_id in self._inflight:
+                    skipped.add(chat_id)
+                    continue
+                ready = self._bucket(chat_id).ready_at(now)
+                if ready > now:
+                    skipped.add(chat_id)
+                    next_ready = ready if next_ready is None else min(next_ready, ready)
+                    continue
+                del lane[idx]
+                if job.coalescible:
+                    self._coalesce(job, lane, idx)
+                self._global.consume(now)
+                self._bucket(chat_id).consume(now)
+                self._inflight.add(chat_id)
+                return job, None
+        return None, next_ready
+
+    def _coalesce(self, job, lane, start):
+        """Aynı şeritte aynı sohbete sırada bekleyen düz metinleri job'a ekler"""
+        text = job.args[1]
+        idx = start
+        while idx < len(lane) and idx < start + self.SCAN_LIMIT:
+            other = lane[idx]
+            if other.chat_id != job.chat_id:
+                idx += 1
+                continue
+            if not other.coalescible or len(text) + 2 + len(other.args[1]) > TELEGRAM_MAX_TEXT:
+                break
+            text = f"{text}\n\n{other.args[1]}"
+            del lane[idx]
+            self.counters["coalesced"] += 1
+        job.args = (job.chat_id, text)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    job, ready = self._pick(time.monotonic())
+                    if job is not None:
+                        break
+                    self._cond.wait(None if ready is None else max(0.0, ready - time.monotonic()))
+            try:
+                self._execute(job)
+            finally:
+                with self._cond:
+                    self._inflight.discard(job.chat_id)
+                    self._cond.notify_all()
+
+    def _execute(self, job):
+        for arg in job.args:
+            if isinstance(arg, io.IOBase):
+                arg.seek(0)  # dosya yüklemesi yeniden denenirken baştan okunmalı
+        try:
+            result = getattr(self.api, job.method)(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and job.attempts < SEND_MAX_RETRIES:
+                retry_after = ((e.result_json or {}).get("parameters") or {}).get("retry_after", 1)
+                self._count("rate_limited")
+                self._retry(job, retry_after)
+                return None
+            self._fail(job, e)
+            return None
+        except Exception as e:
+            # Ağ hataları: üstel geri çekilme ile yeniden dene
+            if job.attempts < SEND_MAX_RETRIES and self._running:
+                self._retry(job, min(30, 2 ** job.attempts))
+                return None
+            self._fail(job, e)
+            return None
+        latency = time.monotonic() - job.enqueued_at
+        with self._cond:
+            self.counters["sent"] += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+        if job.on_success is not None:
+            try:
+                job.on_success(result)
+            except Exception as e:
+                print(f"❌ on_success callback failed: {e}")
+        return result
+
+    def _count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    def _retry(self, job, delay):
+        job.attempts += 1
+        with self._cond:
+            self.counters["retried"] += 1
+            if self._running:
+                bucket = self._global if job.chat_id is None else self._bucket(job.chat_id)
+                bucket.block(time.monotonic() + delay)
+                self._lanes[job.lane].appendleft(job)
+                self._cond.notify_all()
+                return
+        # Dağıtıcı çalışmıyor: çağıran thread'i (handler) bekletmeden zamanlayıcıyla yeniden dene
+        timer = threading.Timer(delay, self._execute, (job,))
+        timer.daemon = True
+        timer.start()
+
+    def _fail(self, job, error):
+        self._count("failed")
+        print(f"❌ {job.method} to {job.chat_id} failed: {error}")
+        if job.on_error is not None:
+            try:
+                job.on_error(error)
+            except Exception as e:
+                print(f"❌ on_error callback failed: {e}")
+
+    def stats(self):
+        with self._cond:
+            depth = {name: len(lane) for name, lane in zip(LANE_NAMES, self._lanes)}
+            counters = dict(self.counters)
+            latency_sum, latency_max = self.latency_sum, self.latency_max
+        sent = counters["sent"]
+        return dict(
+            counters,
+            queue_depth=depth,
+            latency_avg=latency_sum / sent if sent else 0.0,
+            latency_max=latency_max,
+        )
+
+outbox = SendDispatcher(bot)
+
+def send_message(chat_id, text, lane=LANE_INTERACTIVE, on_error=None, on_success=None, **kwargs):
+    """Mesajı giden kuyruğa bırakır (kuyruk çalışmıyorsa doğrudan gönderir)"""
+    return outbox.submit("send_message", chat_id, (chat_id, text), kwargs, lane, on_error, on_success)
+
+def send_document(chat_id, document, file_name, lane=LANE_BULK, **kwargs):
+    """Açık dosyayı giden kuyruğa bırakır; gönderim sonuçlanınca dosya kapatılır"""
+    def close(_):
+        document.close()
+    kwargs["visible_file_name"] = file_name
+    return outbox.submit("send_document", chat_id, (chat_id, document), kwargs, lane, on_error=close, on_success=close)
+
+def edit_message_text(text, chat_id, message_id, **kwargs):
+    return outbox.submit("edit_message_text", chat_id, (text, chat_id, message_id), kwargs)
+
+def edit_message_reply_markup(chat_id, message_id, **kwargs):
+    return outbox.submit("edit_message_reply_markup", chat_id, (chat_id, message_id), kwargs)
+
+def answer_callback_query(callback_query_id, text=None, **kwargs):
+    """Callback cevabını interaktif şeride bırakır; 429'da handler'da hata yerine dağıtıcı yeniden dener"""
+    return outbox.submit("answer_callback_query", None, (callback_query_id, text), kwargs)
+
+# ====== UTIL FORMATTERS (orders/trips) ======
+# Formatter'ların beklediği sütun sırası; tablolara sonradan eklenen sütunlar SELECT * ile karışmasın diye
+ORDER_COLUMNS = "id, tg_id, product, weight, from_city, to_city, price, created_ts, expires_ts, is_active"
+TRIP_COLUMNS = "id, tg_id, from_city, to_city, date, capacity_kg, reserved_kg, price_per_kg, created_ts, expires_ts, is_active"
+def format_order_row(row, lang=DEFAULT_LANG):
+    oid, tg_id, product, weight, from_city, to_city, price, created_ts, expires_ts, is_active = row
+    route = f"📍 <b>{from_city}</b> → <b>{to_city}</b>\n" if from_city and to_city else ""
+    return text_for(lang, MSG.order_card, id=oid, status=text_for(lang, MSG.status_active if is_active else MSG.status_inactive),
+                    owner=tg_id, route=route, product=product, weight=weight, price=price,
+                    created=ts_to_day(created_ts), expires=ts_to_day(expires_ts))
+
+def remaining_capacity(capacity_kg, reserved_kg):
+    """Yolculuğun boş kapasitesi; toplamadaki kayan nokta artıkları gram hassasiyetinde atılır"""
+    # RETURNING, tam sayı değerli REAL'leri int döndürebiliyor; gösterim kartlardaki gibi float olsun
+    return round(float(capacity_kg or 0) - float(reserved_kg or 0), 3)
+
+def format_trip_row(row, lang=DEFAULT_LANG):
+    tid, tg_id, from_city, to_city, date, capacity_kg, reserved_kg, price_per_kg, created_ts, expires_ts, is_active = row
+    return text_for(lang, MSG.trip_card, id=tid, status=text_for(lang, MSG.status_active if is_active else MSG.status_inactive),
+                    owner=tg_id, from_city=from_city, to_city=to_city, date=date, capacity=capacity_kg,
+                    remaining=remaining_capacity(capacity_kg, reserved_kg), price=price_per_kg, created=ts_to_day(created_ts), expires=ts_to_day(expires_ts))
+
+# ====== LISTING CARDS ======
+# İlanlar yayınlandıktan sonra is_active ve yolculukların reserved_kg'si dışında değişmez. Kart metni ve
+# butonunun JSON'u (kind, id, lang, variant) anahtarıyla saklanır: ilan eklenirken doldurulur, ilan kapanınca
+# (elle, süre dolunca ya da yolculuk dolunca) silinir. Yalnızca aktif ilanlar önbelleğe girer. Yolculuk kartı
+# oluşturulduğu andaki reserved_kg ile saklanır; satırdaki değer farklıysa (başka bir süreçteki rezervasyon
+# dahil) kart yeniden oluşturulur.
+CARD_BROWSE = "browse"  # /list, /search: kart + iletişim butonu
+CARD_OWNER = "owner"    # /my_listings: kart + kapatma butonu
+CARD_VARIANTS = (CARD_BROWSE, CARD_OWNER)
+
+# button_row: klavyenin tek satırının JSON'u; markup_json: yalnızca bu satırdan oluşan reply_markup
+Card = namedtuple("Card", "text button_row markup_json version")
+card_cache = LRUCache(CARD_CACHE_SIZE)
+
+def keyboard_json(rows):
+    """Önceden serileştirilmiş buton satırlarından inline klavye JSON'u kurar"""
+    return '{"inline_keyboard": [' + ", ".join(rows) + "]}"
+
+def contact_button(kind, item_id, lang):
+    """İlan sahibine iletişim isteği gönderen butonun sözlüğü"""
+    label = text_for(lang, MSG.btn_contact_order if kind == "order" else MSG.btn_contact_trip, id=item_id)
+    return {"text": label, "callback_data": f"contact_{kind}_{item_id}"}
+
+def reserve_button(trip_id, order_id, lang):
+    """Siparişe yolculukta yer ayıran butonun sözlüğü"""
+    return {"text": text_for(lang, MSG.btn_reserve, id=trip_id), "callback_data": f"reserve_{trip_id}_{order_id}"}
+
+def _card_version(kind, row):
+    return row[6] if kind == "trip" else None
+
+def _build_card(kind, row, lang, variant):
+    text = format_order_row(row, lang) if kind == "order" else format_trip_row(row, lang)
+    if variant == CARD_OWNER:
+        button = {"text": text_for(lang, MSG.btn_deactivate), "callback_data": f"deactivate_{kind}_{row[0]}"}
+    else:
+        button = contact_button(kind, row[0], lang)
+    button_row = json.dumps([button])
+    return Card(text, button_row, keyboard_json([button_row]), _card_version(kind, row))
+
+def get_card(kind, row, lang, variant=CARD_BROWSE):
+    """İlan kartını önbellekten döndürür; yoksa oluşturur"""
+    key = (kind, row[0], lang, variant)
+    card = card_cache.get(key)
+    if card is None or card.version != _card_version(kind, row):
+        card = _build_card(kind, row, lang, variant)
+        if row[-1]:
+            card_cache.set(key, card)
+    return card
+
+def prime_listing_cards(kind, row, owner_lang):
+    """Yeni ilanın kartlarını önbelleğe koyar (göz atma: tüm diller, sahip: sahibinin dili)"""
+    for lang in LANGUAGES:
+        get_card(kind, row, lang, CARD_BROWSE)
+    get_card(kind, row, owner_lang, CARD_OWNER)
+
+def evict_listing_cards(kind, item_ids):
+    """Kapanan ilanların kartlarını önbellekten siler"""
+    for item_id in item_ids:
+        for lang in LANGUAGES:
+            for variant in CARD_VARIANTS:
+                card_cache.pop((kind, item_id, lang, variant))
+
+# ====== LISTING PAGINATION ======
+# /list akışı orders ve trips'i (created_ts, kind, id) anahtarına göre azalan sırada tek liste olarak gösterir;
+# fiyat görünümünde anahtar (price_cents, kind, id), sıra artandır (en ucuz önce) ve tek para birimiyle sınırlıdır.
+# Sayfalar OFFSET yerine bir önceki sayfanın uç ilanından (anchor) devam eder.
+LISTING_TABLES = (("order", "orders", ORDER_COLUMNS), ("trip", "trips", TRIP_COLUMNS))
+
+def _page_condition(kind, anchor, direction, column="created_ts", descending=True):
+    """Tablodaki satırlardan anchor'dan sonra (next) ya da önce (prev) gelenler için WHERE parçası"""
+    anchor_kind, anchor_id, anchor_value = anchor
+    lower = (direction == "next") == descending
+    if kind == anchor_kind:
+        return (f"({column}, id) < (?, ?)" if lower else f"({column}, id) > (?, ?)"), (anchor_value, anchor_id)
+    # Aynı sıralama değerinde kind sırası belirleyicidir ('order' < 'trip')
+    if (kind < anchor_kind) == lower:
+        return (f"{column} <= ?" if lower else f"{column} >= ?"), (anchor_value,)
+    return (f"{column} < ?" if lower else f"{column} > ?"), (anchor_value,)
+
+def fetch_listing_page(anchor=None, direction="next", limit=LIST_PAGE_SIZE, view=None):
+    """
+    Aktif ilanlardan bir sayfa döndürür: ([(kind, row), ...], has_prev, has_next).
+    anchor: (kind, id) — bu ilandan sonraki (next) ya da önceki (prev) sayfa getirilir.
+    view: ListView — ilan türü süzgeci; para birimi verilmişse fiyat sırası (ve üst sınır).
+    """
+    now = now_ts()
+    by_price = view is not None and view.currency is not None
+    column, descending = ("price_cents", False) if by_price else ("created_ts", True)
+    tables = [entry for entry in LISTING_TABLES if view is None or entry[0] in view.kinds]
+    if anchor is not None:
+        kind, item_id = anchor
+        table = dict((k, t) for k, t, _ in LISTING_TABLES)[kind]
+        rows = db_execute(f"SELECT {column} FROM {table} WHERE id = ?", (item_id,), fetch=True)
+        if not rows or rows[0][0] is None:
+            anchor, direction = None, "next"
+        else:
+            anchor = (kind, item_id, rows[0][0])
+    lower = (direction == "next") == descending
+    order = "DESC" if lower else "ASC"
+    items = []
+    for kind, table, columns in tables:
+        where, params = "+expires_ts > ? AND is_active = 1", (now,)
+        if by_price:
+            where, params = f"{where} AND price_currency = ? AND price_cents IS NOT NULL", params + (view.currency,)
+            if view.max_cents is not None:
+                where, params = f"{where} AND price_cents <= ?", params + (view.max_cents,)
+        if anchor is not None:
+            cond, extra = _page_condition(kind, anchor, direction, column, descending)
+            where, params = f"{where} AND {cond}", params + extra
+        # '+expires_ts': planner'ın expires_ts indeksini seçip sıralama yapmasını engeller;
+        # idx_*_active_created_ts (fiyatta idx_*_active_price) üzerinden sırayla okunup limit+1 satırda durulur
+        rows = db_execute(
+            f"SELECT {column}, {columns} FROM {table} WHERE {where} ORDER BY {column} {order}, id {order} LIMIT ?",
+            params + (limit + 1,),
+            fetch=True
+        ) or []
+        items.extend((row[0], kind, row[1:]) for row in rows)
+    items.sort(key=lambda item: (item[0], item[1], item[2][0]), reverse=lower)
+    more = len(items) > limit
+    items = [(kind, row) for _, kind, row in items[:limit]]
+    if direction == "next":
+        return items, anchor is not None, more
+    items.reverse()
+    return items, more, True
+
+def render_listing_page(user_id, anchor=None, direction="next", view=None):
+    """Bir /list sayfasının metnini ve (iletişim + gezinme) klavyesini hazırlar"""
+    items, has_prev, has_next = fetch_listing_page(anchor, direction, view=view)
+    lang = get_lang(user_id)
+    by_price = view is not None and view.currency is not None
+    if not items:
+        return text_for(lang, MSG.price_view_empty if by_price else MSG.list_no_active), None
+    if by_price:
+        limit = "" if view.max_cents is None else text_for(lang, MSG.price_view_limit, amount=format_price(view.max_cents, view.currency))
+        cards = [text_for(lang, MSG.price_view_header, currency=view.currency, limit=limit)]
+    else:
+        cards = [text_for(lang, MSG.list_header)]
+    rows = []
+    for kind, row in items:
+        card = get_card(kind, row, lang)
+        cards.append(card.text)
+        rows.append(card.button_row)
+    # Görünüm, sayfalar arasında korunmak üzere callback verisinin sonuna eklenir
+    suffix = f"_{encode_view(view)}" if view is not None else ""
+    nav = []
+    if has_prev:
+        first_kind, first_row = items[0]
+        nav.append({"text": text_for(lang, MSG.btn_prev), "callback_data": f"list_prev_{first_kind}_{first_row[0]}{suffix}"})
+    if has_next:
+        last_kind, last_row = items[-1]
+        nav.append({"text": text_for(lang, MSG.btn_next), "callback_data": f"list_next_{last_kind}_{last_row[0]}{suffix}"})
+    if nav:
+        rows.append(json.dumps(nav))
+    return "\n\n".join(cards), keyboard_json(rows)
+
+# ====== ROUTE INDEX ======
+class RouteIndex:
+    """
+    Aktif ilanların bellekteki güzergah indeksi: (kind, from_city_id, to_city_id) -> {id: (created_ts, expires_ts, date_ts)}.
+    Yeni ilanlar on_listing_created ile eklenir; başka süreçlerin eklediği satırlar sync() ile id > son görülen id
+    üzerinden alınır. Süresi dolan kayıtlar sorgu sırasında ayıklanır.
+    Son görülen id yalnızca sync() içinde ilerler: add() ilerletseydi, başka bir shard'ın daha küçük id ile
+    eklediği ama henüz okunmamış satırlar hiç alınmazdı. sync() yerel eklenen satırları tekrar okur (add idempotent).
+    """
+
+    def __init__(self):
+        self._routes = defaultdict(dict)
+        self._by_id = {}
+        self._last_ids = {"order": 0, "trip": 0}
+        self._lock = threading.Lock()
+
+    def add(self, kind, item_id, from_id, to_id, created_ts, expires_ts, date_ts=None):
+        route = (kind, from_id, to_id)
+        with self._lock:
+            self._routes[route][item_id] = (created_ts, expires_ts, date_ts)
+            self._by_id[(kind, item_id)] = route
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            route = self._by_id.pop((kind, item_id), None)
+            if route is not None:
+                entries = self._routes[route]
+                entries.pop(item_id, None)
+                if not entries:
+                    del self._routes[route]
+
+    def sync(self):
+        """DB'de bu indeksin henüz görmediği aktif ilanları ekler"""
+        now = now_ts()
+        for kind, table, date_col in (("order", "orders", "NULL"), ("trip", "trips", "date_ts")):
+            # Yalnızca rowid aralığı: aktiflik/süre filtresi burada yapılırsa planner expires_ts indeksini seçiyor
+            rows = db_execute(
+                f"SELECT id, from_city_id, to_city_id, created_ts, expires_ts, {date_col}, is_active FROM {table} WHERE id > ?",
+                (self._last_ids[kind],),
+                fetch=True
+            ) or []
+            for item_id, from_id, to_id, created_ts, expires_ts, date_ts, is_active in rows:
+                if is_active and expires_ts is not None and expires_ts > now:
+                    self.add(kind, item_id, from_id, to_id, created_ts, expires_ts, date_ts)
+            if rows:
+                with self._lock:
+                    self._last_ids[kind] = max(self._last_ids[kind], rows[-1][0])
+
+    def lookup(self, kind, from_id, to_id, limit, date_from=None, date_to=None):
+        """Güzergahtaki en yeni `limit` ilanın id'lerini döndürür (trip'ler için date_ts aralığı uygulanır)"""
+        now = now_ts()
+        with self._lock:
+            entries = self._routes.get((kind, from_id, to_id))
+            if not entries:
+                return []
+            expired = [item_id for item_id, (_, expires_ts, _) in entries.items() if expires_ts <= now]
+            candidates = [
+                (created_ts, item_id) for item_id, (created_ts, expires_ts, date_ts) in entries.items()
+                if expires_ts > now
+                and (date_from is None or (date_ts is not None and date_ts >= date_from))
+                and (date_to is None or (date_ts is not None and date_ts <= date_to))
+            ]
+        for item_id in expired:
+            self.remove(kind, item_id)
+        return [item_id for _, item_id in heapq.nlargest(limit, candidates)]
+
+    def __len__(self):
+        return len(self._by_id)
+
+route_index = RouteIndex()
+
+def search_listings(kind, from_id, to_id, limit=SEARCH_RESULT_LIMIT, date_from=None, date_to=None, view=None):
+    """Güzergahtaki aktif ilan satırlarını (en yeni önce; fiyat görünümünde en ucuz önce) döndürür"""
+    table, columns = ("orders", ORDER_COLUMNS) if kind == "order" else ("trips", TRIP_COLUMNS)
+    now = now_ts()
+    if view is not None and view.currency is not None:
+        return _search_by_price(table, columns, from_id, to_id, limit, date_from, date_to, view, now)
+    route_index.sync()
+    while True:
+        ids = route_index.lookup(kind, from_id, to_id, limit, date_from, date_to)
+        if not ids:
+            return []
+        placeholders = ", ".join("?" * len(ids))
+        rows = db_execute(
+            f"SELECT {columns} FROM {table} WHERE id IN ({placeholders}) AND is_active = 1 AND expires_ts > ?",
+            tuple(ids) + (now,),
+            fetch=True
+        ) or []
+        if len(rows) == len(ids):
+            break
+        # Başka bir süreç tarafından kapatılmış ilanları indeksten düşüp tekrar dene
+        found = {row[0] for row in rows}
+        for item_id in ids:
+            if item_id not in found:
+                route_index.remove(kind, item_id)
+    rank = {item_id: i for i, item_id in enumerate(ids)}
+    rows.sort(key=lambda row: rank[row[0]])
+    return rows
+
+def _search_by_price(table, columns, from_id, to_id, limit, date_from, date_to, view, now):
+    # Bellekteki route index yalnızca tarih sırasını tutar; fiyat sırası idx_*_route_price üzerinden DB'den okunur
+    where = "from_city_id = ? AND to_city_id = ? AND is_active = 1 AND price_currency = ? AND price_cents IS NOT NULL AND +expires_ts > ?"
+    params = (from_id, to_id, view.currency, now)
+    if view.max_cents is not None:
+        where, params = f"{where} AND price_cents <= ?", params + (view.max_cents,)
+    if date_from is not None:
+        where, params = f"{where} AND +date_ts >= ? AND +date_ts <= ?", params + (date_from, date_to)
+    return db_execute(
+        f"SELECT {columns} FROM {table} WHERE {where} ORDER BY price_cents, id LIMIT ?",
+        params + (limit,),
+        fetch=True
+    ) or []
+
+# ====== MATCHING ENGINE ======
+# Yeni ilan eklenince aynı güzergahtaki karşı ilanlar indeks üzerinden bulunur, sıralanır ve
+# iki tarafa da bildirim gönderilir. Hesaplama ve gönderim handler thread'inde değil match_worker'da yapılır.
+_match_queue = queue.Queue()
+
+def find_orders_for_trip(trip):
+    """Yolculuğa uyan aktif siparişler: aynı güzergah, ağırlık boş kapasiteye sığıyor, yolculuk tarihinde hâlâ geçerli,
+    henüz başka bir yolculukta yer ayırmamış"""
+    trip_id, tg_id, from_id, to_id, date_ts, capacity_kg = trip
+    rows = db_execute(
+        "SELECT id, tg_id, product, weight, expires_ts FROM orders "
+        "WHERE from_city_id = ? AND to_city_id = ? AND is_active = 1 AND weight <= ? AND expires_ts > ? AND tg_id != ? "
+        "AND NOT EXISTS (SELECT 1 FROM reservations WHERE order_id = orders.id AND status = 'active') "
+        "LIMIT ?",
+        (from_id, to_id, capacity_kg, date_ts, tg_id, MATCH_CANDIDATE_LIMIT),
+        fetch=True
+    ) or []
+    # Önce yolculuk tarihine en yakın son geçerlilik günü (en acil sipariş), sonra kapasiteyi en iyi dolduran
+    rows.sort(key=lambda r: (r[4] // DAY_SECONDS, -(r[3] / capacity_kg if capacity_kg else 0)))
+    return rows
+
+def find_trips_for_order(order):
+    """Siparişe uyan aktif yolculuklar: aynı güzergah, boş kapasite yeterli, tarih bugün ile son geçerlilik arasında"""
+    order_id, tg_id, from_id, to_id, weight, expires_ts = order
+    rows = db_execute(
+        "SELECT id, tg_id, date, capacity_kg - reserved_kg, price_per_kg, date_ts FROM trips "
+        "WHERE from_city_id = ? AND to_city_id = ? AND is_active = 1 AND date_ts >= ? AND date_ts <= ? AND capacity_kg - reserved_kg >= ? AND tg_id != ? "
+        "LIMIT ?",
+        (from_id, to_id, today_ts(), expires_ts, weight, tg_id, MATCH_CANDIDATE_LIMIT),
+        fetch=True
+    ) or []
+    # Önce en yakın tarihli yolculuk, sonra ağırlığa en uygun (en az boşa kalan) boş kapasite
+    rows.sort(key=lambda r: (r[5], r[3] - weight))
+    return rows
+
+def _match_line(kind, row, lang):
+    if kind == "order":
+        oid, _, product, weight, expires_ts = row
+        return text_for(lang, MSG.match_line_order, id=oid, product=product, weight=weight, until=ts_to_day(expires_ts))
+    tid, _, date, free_kg, price_per_kg = row[:5]
+    return text_for(lang, MSG.match_line_trip, id=tid, date=date, capacity=round(free_kg, 3), price=price_per_kg)
+
+def collect_match_notifications(kind, item_id):
+    """Yeni ilan için gönderilecek bildirimleri döndürür: [(chat_id, kind, item_id, header_id, lines, buttons)]
+    lines: alıcının dilinde render edilecek (kind, satır) çiftleri
+    buttons: (kind, id, order_id) — yolculuk butonlarında order_id alıcının siparişidir ("yer ayır" butonu eklenir)"""
+    if kind == "trip":
+        rows = db_execute(
+            "SELECT id, tg_id, from_city_id, to_city_id, date_ts, capacity_kg - reserved_kg, price_per_kg, date FROM trips WHERE id = ? AND is_active = 1",
+            (item_id,), fetch=True
+        )
+        if not rows:
+            return []
+        trip = rows[0]
+        matches = find_orders_for_trip(trip[:6])
+        own_line = ("trip", (trip[0], trip[1], trip[7], trip[5], trip[6]))
+        owner_header, counterpart_header, counterpart_kind = MSG.match_orders_for_trip, MSG.match_new_trip, "order"
+    else:
+        rows = db_execute(
+            "SELECT id, tg_id, from_city_id, to_city_id, weight, expires_ts, product FROM orders WHERE id = ? AND is_active = 1",
+            (item_id,), fetch=True
+        )
+        if not rows:
+            return []
+        order = rows[0]
+        matches = find_trips_for_order(order[:6])
+        own_line = ("order", (order[0], order[1], order[6], order[4], order[5]))
+        owner_header, counterpart_header, counterpart_kind = MSG.match_trips_for_order, MSG.match_new_order, "trip"
+    if not matches:
+        return []
+    owner_id = rows[0][1]
+    top = matches[:MATCH_NOTIFY_LIMIT]
+    notifications = [(
+        owner_id, kind, item_id, owner_header,
+        [(counterpart_kind, row) for row in top],
+        [(counterpart_kind, row[0], item_id if kind == "order" else None) for row in top],
+    )]
+    # Karşı tarafın her ilan sahibine kendi ilanı için tek bildirim
+    for row in top:
+        notifications.append((row[1], counterpart_kind, row[0], counterpart_header, [own_line],
+                              [(kind, item_id, row[0] if kind == "trip" else None)]))
+    return notifications
+
+def send_match_notification(chat_id, kind, item_id, header_id, lines, buttons):
+    lang = get_lang(chat_id)
+    text = "\n".join([text_for(lang, header_id, id=item_id), ""] + [_match_line(k, row, lang) for k, row in lines])
+    rows = []
+    for button_kind, button_id, order_id in buttons:
+        row = [contact_button(button_kind, button_id, lang)]
+        if order_id is not None:
+            row.append(reserve_button(button_id, order_id, lang))
+        rows.append(json.dumps(row))
+    send_message(chat_id, text, lane=LANE_NOTIFY, reply_markup=keyboard_json(rows))
+
+def match_worker():
+    """Eşleştirme kuyruğunu boşaltır; aynı anda biriken ilanları tek partide işler (gönderim hızını outbox sınırlar)"""
+    while not shutdown_event.is_set():
+        try:
+            batch = [_match_queue.get(timeout=1)]
+        except queue.Empty:
+            continue
+        while True:
+            try:
+                batch.append(_match_queue.get_nowait())
+            except queue.Empty:
+                break
+        notifications = []
+        for kind, item_id in dict.fromkeys(batch):
+            try:
+                notifications.extend(collect_match_notifications(kind, item_id))
+            except Exception as e:
+                print(f"❌ Matching error for {kind} #{item_id}: {e}")
+        for notification in notifications:
+            try:
+                send_match_notification(*notification)
+            except Exception as e:
+                print(f"❌ Match notification to {notification[0]} failed: {e}")
+
+# ====== LISTING EVENTS ======
+def on_listing_created(kind, item_id, from_id, to_id, created_ts, expires_ts, date_ts=None):
+    """Yeni ilan eklendikten sonra bellekteki yapıları günceller ve eşleştirmeyi tetikler"""
+    route_index.add(kind, item_id, from_id, to_id, created_ts, expires_ts, date_ts)
+    expiry_scheduler.schedule(kind, item_id, expires_ts)
+    if MATCHING_ENABLED:
+        _match_queue.put((kind, item_id))
+
+def on_listings_deactivated(kind, item_ids):
+    """İlanlar devre dışı kaldıktan (elle ya da süre dolunca) sonra bellekteki yapılardan çıkarır"""
+    for item_id in item_ids:
+        route_index.remove(kind, item_id)
+    evict_listing_cards(kind, item_ids)
+
+def on_trips_reopened(rows):
+    """Dolduğu için kapanıp yeniden açılan yolculukları bellekteki yapılara geri ekler (reopen_full_trips satırları)"""
+    for trip_id, from_id, to_id, created_ts, expires_ts, date_ts in rows:
+        route_index.add("trip", trip_id, from_id, to_id, created_ts, expires_ts, date_ts)
+        # Kapanırken heap'teki kayıt silinmez; olası ikinci kayıt _deactivate'te etkisizdir
+        expiry_scheduler.schedule("trip", trip_id, expires_ts)
+    evict_listing_cards("trip", [row[0] for row in rows])
+
+# ====== CONTACT REQUESTS ======
+# "İletişime geç" istekleri önce contact_requests'e yazılır ve callback hemen döner. ContactDigester
+# throttle süresi dolmuş sahiplerin bekleyen isteklerini tek özet mesajında toplar; contact_digests
+# kalıcı gönderim kuyruğudur: kiralanan özet gönderilemeden süreç düşerse kira bitince yeniden denenir.
+CONTACT_LISTINGS = {
+    "order": ("SELECT tg_id, product FROM orders WHERE id = ? AND is_active = 1", ("product",)),
+    "trip": ("SELECT tg_id, from_city, to_city, date FROM trips WHERE id = ? AND is_active = 1", ("from_city", "to_city", "date")),
+}
+CONTACT_SENT, CONTACT_DUPLICATE, CONTACT_NOT_FOUND = "sent", "duplicate", "not_found"
+
+def record_contact_request(kind, item_id, requester, chat_id):
+    """İsteği kaydeder; aynı ilana CONTACT_DEDUP_HOURS içinde tekrar istek yazılmaz"""
+    query, detail_cols = CONTACT_LISTINGS[kind]
+    now = datetime.utcnow()
+    cutoff = (now - timedelta(hours=CONTACT_DEDUP_HOURS)).isoformat()
+    with db_transaction() as conn:
+        row = conn.execute(query, (item_id,)).fetchone()
+        if row is None:
+            return CONTACT_NOT_FOUND
+        if conn.execute(
+            "SELECT 1 FROM contact_requests WHERE requester_id = ? AND kind = ? AND item_id = ? AND created_at >= ? LIMIT 1",
+            (requester.id, kind, item_id, cutoff)
+        ).fetchone():
+            return CONTACT_DUPLICATE
+        name = f"{requester.first_name or ''} {requester.last_name or ''}".strip()
+        details = json.dumps(dict(zip(detail_cols, row[1:])), ensure_ascii=False)
+        conn.execute(
+            "INSERT INTO contact_requests (kind, item_id, owner_id, requester_id, chat_id, requester_name, requester_username, details, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, item_id, row[0], requester.id, chat_id, name, requester.username, details, now.isoformat())
+        )
+    contact_digester.wake()
+    return CONTACT_SENT
+
+def render_contact_digest(owner_id, requests):
+    """Özeti sahibinin dilinde hazırlar; tek istek için ayrıntılı şablon kullanılır"""
+    lang = get_lang(owner_id)
+    no_username = text_for(lang, MSG.no_username)
+    if len(requests) == 1:
+        kind, item_id, name, username, details = requests[0]
+        msg_id = MSG.contact_request_order if kind == "order" else MSG.contact_request_trip
+        return text_for(lang, msg_id, id=item_id, name=name, username=username or no_username, **details)
+    lines = []
+    for kind, item_id, name, username, details in requests:
+        msg_id = MSG.contact_digest_line_order if kind == "order" else MSG.contact_digest_line_trip
+        lines.append(text_for(lang, msg_id, id=item_id, name=name, username=username or no_username, **details))
+    return "\n\n".join((
+        text_for(lang, MSG.contact_digest_header, count=len(requests)),
+        "\n".join(lines),
+        text_for(lang, MSG.contact_digest_footer),
+    ))
+
+class ContactDigester:
+    """Bekleyen iletişim isteklerini sahip başına özetler ve contact_digests kuyruğunu outbox'a boşaltır"""
+    CLAIM_BATCH = 100
+    PRUNE_INTERVAL = 3600
+
+    def __init__(self, throttle=CONTACT_OWNER_THROTTLE, poll_interval=CONTACT_POLL_INTERVAL,
+                 max_attempts=CONTACT_MAX_ATTEMPTS, lease=CONTACT_LEASE, limit=CONTACT_DIGEST_LIMIT):
+        self.throttle = throttle
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.limit = limit
+        self.shard = None  # (index, shards): yalnızca bu shard'a düşen sahiplerin özetleri
+        self._cond = threading.Condition()
+        self._woken = False
+        self._stopping = False
+        self._thread = None
+        self._next_prune = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def _owner_filter(self, column):
+        if self.shard is None:
+            return "", ()
+        index, shards = self.shard
+        return f" AND {column} % ? = ?", (shards, index)
+
+    def compose(self):
+        """Throttle süresi dolmuş sahiplerin bekleyen isteklerini yeni özetlere bağlar; özet sayısını döner"""
+        now = datetime.utcnow().isoformat()
+        since = (datetime.utcnow() - timedelta(seconds=self.throttle)).isoformat()
+        owner_sql, owner_params = self._owner_filter("r.owner_id")
+        with db_transaction() as conn:
+            owners = conn.execute(
+                f"""SELECT DISTINCT r.owner_id FROM contact_requests r
+                    WHERE r.digest_id IS NULL{owner_sql}
+                    AND NOT EXISTS (SELECT 1 FROM contact_digests d WHERE d.owner_id = r.owner_id AND d.created_at > ?)""",
+                owner_params + (since,)
+            ).fetchall()
+            for (owner_id,) in owners:
+                request_ids = [r[0] for r in conn.execute(
+                    "SELECT id FROM contact_requests WHERE owner_id = ? AND digest_id IS NULL ORDER BY id LIMIT ?",
+                    (owner_id, self.limit)
+                )]
+                digest_id = conn.execute(
+                    "INSERT INTO contact_digests (owner_id, created_at, next_attempt_at) VALUES (?, ?, ?)",
+                    (owner_id, now, now)
+                ).lastrowid
+                conn.execute(
+                    f"UPDATE contact_requests SET digest_id = ? WHERE id IN ({', '.join('?' * len(request_ids))})",
+                    (digest_id, *request_ids)
+                )
+        return len(owners)
+
+    def claim(self):
+        """Zamanı gelmiş özetleri lease süresi boyunca kiralar: [(digest_id, owner_id, attempts)]"""
+        now = datetime.utcnow()
+        lease_until = (now + timedelta(seconds=self.lease)).isoformat()
+        owner_sql, owner_params = self._owner_filter("owner_id")
+        with db_transaction() as conn:
+            return conn.execute(
+                f"""UPDATE contact_digests SET next_attempt_at = ?, attempts = attempts + 1
+                    WHERE id IN (SELECT id FROM contact_digests
+                                 WHERE status = 'pending' AND next_attempt_at <= ?{owner_sql}
+                                 ORDER BY next_attempt_at LIMIT ?)
+                    RETURNING id, owner_id, attempts""",
+                (lease_until, now.isoformat()) + owner_params + (self.CLAIM_BATCH,)
+            ).fetchall()
+
+    def deliver(self, digest_id, owner_id, attempts):
+        """Özeti gönderim anında sahibinin diliyle hazırlayıp outbox'a bırakır"""
+        rows = db_execute(
+            "SELECT kind, item_id, requester_name, requester_username, details FROM contact_requests WHERE digest_id = ? ORDER BY id",
+            (digest_id,),
+            fetch=True
+        ) or []
+        if not rows:
+            self._mark_sent(digest_id)
+            return
+        requests = [(kind, item_id, name, username, json.loads(details or "{}"))
+                    for kind, item_id, name, username, details in rows]
+        send_message(
+            owner_id, render_contact_digest(owner_id, requests), lane=LANE_NOTIFY,
+            on_success=lambda result: self._mark_sent(digest_id),
+            on_error=lambda error: self._mark_failed(digest_id, attempts, error)
+        )
+
+    def _mark_sent(self, digest_id):
+        db_execute("UPDATE contact_digests SET status = 'sent', last_error = NULL WHERE id = ?", (digest_id,))
+
+    def _mark_failed(self, digest_id, attempts, error):
+        # 400/403 (engellendi, sohbet yok) tekrar denemekle düzelmez
+        permanent = isinstance(error, ApiTelegramException) and error.error_code in (400, 403)
+        if not permanent and attempts < self.max_attempts:
+            retry_at = datetime.utcnow() + timedelta(seconds=min(600, 15 * 2 ** attempts))
+            db_execute("UPDATE contact_digests SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                       (retry_at.isoformat(), str(error), digest_id))
+            return
+        db_execute("UPDATE contact_digests SET status = 'failed', last_error = ? WHERE id = ?", (str(error), digest_id))
+        rows = db_execute("SELECT DISTINCT chat_id, requester_id FROM contact_requests WHERE digest_id = ?",
+                          (digest_id,), fetch=True) or []
+        for chat_id, requester_id in rows:
+            send_message(chat_id, get_text(MSG.contact_sent_failed, requester_id), lane=LANE_NOTIFY)
+
+    def prune(self):
+        """Dedup ve throttle pencerelerinden eski, sonuçlanmış özetleri ve isteklerini siler"""
+        cutoff = (datetime.utcnow() - timedelta(seconds=max(CONTACT_DEDUP_HOURS * 3600, self.throttle))).isoformat()
+        with db_transaction() as conn:
+            conn.execute(
+                "DELETE FROM contact_requests WHERE digest_id IN (SELECT id FROM contact_digests WHERE status != 'pending' AND created_at < ?)",
+                (cutoff,)
+            )
+            conn.execute("DELETE FROM contact_digests WHERE status != 'pending' AND created_at < ?", (cutoff,))
+
+    def run_once(self):
+        """Bir tur: özet oluştur, zamanı gelenleri gönder; gönderilen özet sayısını döner"""
+        self.compose()
+        digests = self.claim()
+        for digest in digests:
+            try:
+                self.deliver(*digest)
+            except Exception as e:
+                print(f"❌ Contact digest #{digest[0]} failed: {e}")
+        return len(digests)
+
+    def _run(self):
+        while True:
+            try:
+                if time.time() >= self._next_prune:
+                    self.prune()
+                    self._next_prune = time.time() + self.PRUNE_INTERVAL
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Contact digester error: {e}")
+            with self._cond:
+                if not self._woken and not self._stopping:
+                    self._cond.wait(self.poll_interval)
+                self._woken = False
+                if self._stopping:
+                    return
+
+    def wake(self):
+        """Yeni istek geldiğinde bir sonraki turu beklemeden başlatır"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="contact-digester", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """Thread'i durdurur; kiralanmış ama gönderilmemiş özetler kira bitince yeniden denenir"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+contact_digester = ContactDigester()
+
+# ====== RESERVATIONS ======
+# Sipariş sahibi, siparişin ağırlığı kadar yeri bir yolculuktan ayırır. reservations defteri her ayırmayı,
+# trips.reserved_kg aktif ayırmaların toplamını tutar. Kapasite kontrolü ve artırma tek bir koşullu UPDATE'tir
+# (reserved_kg + ağırlık <= capacity_kg); BEGIN IMMEDIATE yazarları süreçler arasında da sıraya koyduğundan
+# eşzamanlı callback'ler yolculuğu aşırı dolduramaz. Dolan yolculuk aynı transaction'da closed_full ile kapatılır;
+# bir iptal yer açtığında (süresi dolmamışsa) yine aynı transaction'da yeniden açılır. Sipariş ya da yolculuk
+# kapandığında (elle ya da süre dolunca) aktif rezervasyonları aynı transaction'da bırakılır ve karşı tarafa haber verilir.
+RESERVE_OK, RESERVE_FULL, RESERVE_UNAVAILABLE, RESERVE_EXISTS, RESERVE_NOT_OWNER = "ok", "full", "unavailable", "exists", "not_owner"
+RESERVE_ERRORS = {
+    RESERVE_FULL: MSG.reservation_full,
+    RESERVE_UNAVAILABLE: MSG.reservation_unavailable,
+    RESERVE_EXISTS: MSG.reservation_exists,
+    RESERVE_NOT_OWNER: MSG.not_listing_owner,
+}
+Reservation = namedtuple("Reservation", "id trip_id order_id trip_owner_id requester_id product weight remaining trip_full trip_reopened",
+                         defaults=(False,))
+
+def reopen_full_trips(conn, trip_ids, now):
+    """Dolduğu için kapanmış ve yeniden yeri açılmış yolculukları açar (çağıranın transaction'ında);
+    on_trips_reopened'a verilecek satırları döner"""
+    placeholders = ", ".join("?" * len(trip_ids))
+    return conn.execute(
+        f"UPDATE trips SET is_active = 1, closed_full = 0 WHERE id IN ({placeholders}) AND closed_full = 1 "
+        "AND expires_ts > ? AND round(capacity_kg - reserved_kg, 3) > 0 "
+        "RETURNING id, from_city_id, to_city_id, created_ts, expires_ts, date_ts",
+        tuple(trip_ids) + (now,)
+    ).fetchall()
+
+def reserve_trip(trip_id, order_id, requester_id):
+    """Siparişe yolculukta yer ayırır: (sonuç, Reservation ya da None)"""
+    now = now_ts()
+    with db_transaction() as conn:
+        order = conn.execute(
+            "SELECT tg_id, product, weight, from_city_id, to_city_id, expires_ts FROM orders WHERE id = ? AND is_active = 1 AND expires_ts > ?",
+            (order_id, now)
+        ).fetchone()
+        if order is None or not order[2] or order[2] <= 0:
+            return RESERVE_UNAVAILABLE, None
+        owner_id, product, weight, from_id, to_id, order_expires_ts = order
+        if owner_id != requester_id:
+            return RESERVE_NOT_OWNER, None
+        if conn.execute("SELECT 1 FROM reservations WHERE order_id = ? AND status = 'active'", (order_id,)).fetchone():
+            return RESERVE_EXISTS, None
+        # Eşleştirmedeki koşullar (güzergah, tarih, başkasının yolculuğu) + kapasite; sığmıyorsa hiçbir satır güncellenmez
+        trip_filter = "id = ? AND is_active = 1 AND expires_ts > ? AND from_city_id = ? AND to_city_id = ? AND date_ts <= ? AND tg_id != ?"
+        trip_params = (trip_id, now, from_id, to_id, order_expires_ts, requester_id)
+        row = conn.execute(
+            f"UPDATE trips SET reserved_kg = round(reserved_kg + ?, 3) WHERE {trip_filter} AND round(reserved_kg + ?, 3) <= capacity_kg "
+            "RETURNING tg_id, capacity_kg, reserved_kg",
+            (weight,) + trip_params + (weight,)
+        ).fetchone()
+        if row is None:
+            open_trip = conn.execute(f"SELECT 1 FROM trips WHERE {trip_filter}", trip_params).fetchone()
+            return (RESERVE_FULL if open_trip else RESERVE_UNAVAILABLE), None
+        trip_owner_id, capacity_kg, reserved_kg = row
+        cur = conn.execute(
+            "INSERT INTO reservations (trip_id, order_id, trip_owner_id, requester_id, weight_kg, status, created_ts) VALUES (?, ?, ?, ?, ?, 'active', ?)",
+            (trip_id, order_id, trip_owner_id, requester_id, weight, now)
+        )
+        remaining = remaining_capacity(capacity_kg, reserved_kg)
+        trip_full = remaining <= 0
+        if trip_full:
+            conn.execute("UPDATE trips SET is_active = 0, closed_full = 1 WHERE id = ?", (trip_id,))
+    if trip_full:
+        on_listings_deactivated("trip", [trip_id])
+    return RESERVE_OK, Reservation(cur.lastrowid, trip_id, order_id, trip_owner_id, requester_id, product, weight, remaining, trip_full)
+
+def cancel_reservation(reservation_id, user_id):
+    """Aktif rezervasyonu iptal edip yeri yolculuğa geri verir; iptal edilen Reservation ya da None döner.
+    Rezervasyonu yapan da yolculuk sahibi de iptal edebilir. Dolduğu için kapanmış yolculuk yeniden açılır."""
+    now = now_ts()
+    with db_transaction() as conn:
+        row = conn.execute(
+            "UPDATE reservations SET status = 'cancelled', cancelled_ts = ? "
+            "WHERE id = ? AND status = 'active' AND ? IN (requester_id, trip_owner_id) "
+            "RETURNING trip_id, order_id, trip_owner_id, requester_id, weight_kg",
+            (now, reservation_id, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+        trip_id, order_id, trip_owner_id, requester_id, weight = row[:4] + (float(row[4]),)
+        capacity_kg, reserved_kg = conn.execute(
+            "UPDATE trips SET reserved_kg = max(0, round(reserved_kg - ?, 3)) WHERE id = ? RETURNING capacity_kg, reserved_kg",
+            (weight, trip_id)
+        ).fetchone()
+        reopened = reopen_full_trips(conn, [trip_id], now)
+    if reopened:
+        on_trips_reopened(reopened)
+    return Reservation(reservation_id, trip_id, order_id, trip_owner_id, requester_id, None, weight,
+                       remaining_capacity(capacity_kg, reserved_kg), False, bool(reopened))
+
+def release_reservations(conn, kind, item_ids, status="cancelled"):
+    """Kapanan ilanların aktif rezervasyonlarını status ile kapatıp yeri yolculuklara geri verir (çağıranın
+    transaction'ında); (bırakılan Reservation'lar, reopen_full_trips satırları) döner"""
+    column = "order_id" if kind == "order" else "trip_id"
+    placeholders = ", ".join("?" * len(item_ids))
+    now = now_ts()
+    rows = conn.execute(
+        f"UPDATE reservations SET status = ?, cancelled_ts = ? WHERE {column} IN ({placeholders}) AND status = 'active' "
+        "RETURNING id, trip_id, order_id, trip_owner_id, requester_id, weight_kg",
+        (status, now) + tuple(item_ids)
+    ).fetchall()
+    if not rows:
+        return [], []
+    freed = defaultdict(float)
+    for row in rows:
+        freed[row[1]] += row[5]
+    remaining = {}
+    for trip_id, weight in freed.items():
+        capacity_kg, reserved_kg = conn.execute(
+            "UPDATE trips SET reserved_kg = max(0, round(reserved_kg - ?, 3)) WHERE id = ? RETURNING capacity_kg, reserved_kg",
+            (weight, trip_id)
+        ).fetchone()
+        remaining[trip_id] = remaining_capacity(capacity_kg, reserved_kg)
+    # Kapanan siparişin bıraktığı yer, dolduğu için kapanmış yolculuğu yeniden açabilir
+    reopened = reopen_full_trips(conn, list(freed), now) if kind == "order" else []
+    reopened_ids = {row[0] for row in reopened}
+    released = [Reservation(reservation_id, trip_id, order_id, trip_owner_id, requester_id, None, float(weight),
+                            remaining[trip_id], False, trip_id in reopened_ids)
+                for reservation_id, trip_id, order_id, trip_owner_id, requester_id, weight in rows]
+    return released, reopened
+
+def on_reservations_released(kind, released, reopened):
+    """release_reservations sonrası: yeniden açılan yolculukları geri ekler, kapanmayan tarafa haber verir"""
+    if reopened:
+        on_trips_reopened(reopened)
+    for reservation in released:
+        values = dict(id=reservation.id, order_id=reservation.order_id, trip_id=reservation.trip_id, weight=reservation.weight)
+        try:
+            if kind == "order":
+                lang = get_lang(reservation.trip_owner_id)
+                text = text_for(lang, MSG.reservation_order_closed_notice, **values)
+                if reservation.trip_reopened:
+                    text = f"{text}\n\n{text_for(lang, MSG.reservation_trip_reopened, trip_id=reservation.trip_id, remaining=reservation.remaining)}"
+                send_message(reservation.trip_owner_id, text, lane=LANE_NOTIFY)
+            else:
+                lang = get_lang(reservation.requester_id)
+                send_message(reservation.requester_id, text_for(lang, MSG.reservation_trip_closed_notice, **values), lane=LANE_NOTIFY)
+        except Exception as e:
+            print(f"❌ Reservation release notice for #{reservation.id} failed: {e}")
+
+# ====== ADMIN EXPORT ======
+# /all_orders ve /all_trips tabloyu satır satır mesaj atmak yerine tek bir gzip'li CSV/JSONL dosyası olarak yollar.
+# Satırlar imleçten EXPORT_FETCH_SIZE'lık parçalarla okunup doğrudan diskteki geçici dosyaya sıkıştırılır;
+# bellek kullanımı tablo boyutundan bağımsızdır.
+EXPORT_FORMATS = ("csv", "jsonl")
+# Dosyada zamanlar okunabilir ISO metni olarak yer alır (created_at/expires_at, *_ts ile birlikte yazılır)
+EXPORT_COLUMNS = {
+    "order": "id, tg_id, product, weight, from_city, to_city, price, price_cents, price_currency, price_unit, created_at, expires_at, is_active",
+    "trip": "id, tg_id, from_city, to_city, date, capacity_kg, reserved_kg, price_per_kg, price_cents, price_currency, price_unit, created_at, expires_at, is_active",
+}
+
+def parse_export_args(text):
+    """'/all_orders jsonl active from=2024-01-01 to=2024-01-31' -> (fmt, active_only, since, until); geçersizse None"""
+    fmt, active_only, since, until = "csv", False, None, None
+    for token in text.split()[1:]:
+        token = token.lower()
+        if token in EXPORT_FORMATS:
+            fmt = token
+        elif token == "active":
+            active_only = True
+        elif token.startswith(("from=", "to=")):
+            name, _, value = token.partition("=")
+            try:
+                day = parse_day(value)
+            except ValueError:
+                return None
+            if name == "from":
+                since = day
+            else:
+                until = day
+        else:
+            return None
+    return fmt, active_only, since, until
+
+def export_listings(kind, fmt="csv", active_only=False, since=None, until=None):
+    """İlanları id sırasıyla gzip'li geçici dosyaya yazar; (dosya, satır sayısı) döner"""
+    table = "orders" if kind == "order" else "trips"
+    columns = EXPORT_COLUMNS[kind]
+    names = [name.strip() for name in columns.split(",")]
+    conditions, params = [], []
+    if active_only:
+        conditions.append("is_active = 1")
+    if since is not None:
+        conditions.append("created_ts >= ?")
+        params.append(since)
+    if until is not None:
+        # 'to' günü dahil
+        conditions.append("created_ts < ?")
+        params.append(until + DAY_SECONDS)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = get_db().execute(f"SELECT {columns} FROM {table}{where} ORDER BY id", params)
+
+    document = tempfile.TemporaryFile()
+    count = 0
+    try:
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=document, mode="wb"), encoding="utf-8", newline="") as out:
+            if fmt == "csv":
+                writer = csv.writer(out)
+                writer.writerow(names)
+                write = writer.writerows
+            else:
+                def write(rows):
+                    out.writelines(json.dumps(dict(zip(names, row)), ensure_ascii=False) + "\n" for row in rows)
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                write(rows)
+                count += len(rows)
+    except BaseException:
+        document.close()
+        raise
+    finally:
+        cursor.close()
+    return document, count
+
+def send_listing_export(message, kind):
+    """Yönetici komutunun argümanlarına göre dışa aktarımı hazırlayıp dosya olarak gönderir"""
+    user_id = message.from_user.id
+    if user_id not in ADMIN_IDS:
+        send_message(message.chat.id, get_text(MSG.not_admin, user_id), reply_to_message_id=message.message_id)
         return
-        
-    price = message.text.strip()
-    set_user_state(message.from_user.id, "waiting_order_expiry", f"{product}|{weight}|{from_city}|{to_city}|{price}")
-    msg = bot.send_message(message.chat.id, get_text("ask_order_expiry", message.from_user.id))
-    bot.register_next_step_handler(msg, post_order_expiry, product, weight, from_city, to_city, price)
+    args = parse_export_args(message.text or "")
+    if args is None:
+        send_message(message.chat.id, get_text(MSG.export_usage, user_id))
+        return
+    fmt = args[0]
+    document, count = export_listings(kind, *args)
+    if not count:
+        document.close()
+        send_message(message.chat.id, get_text(MSG.export_empty, user_id))
+        return
+    table = "orders" if kind == "order" else "trips"
+    file_name = f"{table}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}.gz"
+    send_document(message.chat.id, document, file_name,
+                  caption=get_text(MSG.export_caption, user_id, table=table, count=count))
 
-def post_order_expiry(message, product, weight, from_city, to_city, price):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
+# ====== COMMANDS / HANDLERS ======
+# ---- CONVERSATION DISPATCH ----
+# Komut handler'larından önce kayıtlı olmalı: akış ortasındaki kullanıcının mesajları buraya düşer
+@bot.message_handler(func=lambda message: message.from_user.id in _conversations)
+def handle_conversation(message):
+    user_id = message.from_user.id
+    conv = get_user_state(user_id)
+    if conv is None:
         return
-        
-    expiry_input = message.text.strip()
-    user_lang = get_lang(message.from_user.id)
-    
-    expiry_date, error = parse_date_input(expiry_input, user_lang)
-    if error:
-        msg = bot.send_message(message.chat.id, error)
-        bot.register_next_step_handler(msg, post_order_expiry, product, weight, from_city, to_city, price)
+    if is_command(message):
+        send_message(message.chat.id, get_text(MSG.command_intercepted, user_id))
+        clear_user_state(user_id)
         return
-    
-    created_at = datetime.utcnow().isoformat()
-    expires_at = expiry_date.isoformat()
-    
-    db_execute(
-        "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, created_at, expires_at, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (message.from_user.id, product, weight, from_city, to_city, price, created_at, expires_at, 1)
-    )
-    clear_user_state(message.from_user.id)
-    bot.send_message(message.chat.id, get_text("order_posted", message.from_user.id))
+    advance_conversation(message, conv)
 
-# ---- POST TRIP flow ----
-@bot.message_handler(commands=['post_trip'])
-def cmd_post_trip(message):
+@bot.message_handler(commands=['start'])
+def cmd_start(message):
     register_user(message)
     clear_user_state(message.from_user.id)
-    set_user_state(message.from_user.id, "waiting_trip_from")
-    msg = bot.send_message(message.chat.id, get_text("ask_trip_from", message.from_user.id))
-    bot.register_next_step_handler(msg, post_trip_from)
+    # Her dil kendi adıyla, satır başına iki buton
+    buttons = [{"text": text_for(lang, MSG.language_name), "callback_data": f"setlang_{lang}"} for lang in LANGUAGES]
+    rows = [json.dumps(buttons[i:i + 2]) for i in range(0, len(buttons), 2)]
+    send_message(message.chat.id, text_for(DEFAULT_LANG, MSG.language_menu), reply_markup=keyboard_json(rows))
 
-def post_trip_from(message):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    from_city = message.text.strip()
-    set_user_state(message.from_user.id, "waiting_trip_to", from_city)
-    msg = bot.send_message(message.chat.id, get_text("ask_trip_to", message.from_user.id))
-    bot.register_next_step_handler(msg, post_trip_to, from_city)
+@bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("setlang_"))
+def callback_setlang(call):
+    lang = call.data.split("_")[1]
+    db_execute("UPDATE users SET lang = ? WHERE tg_id = ?", (lang, call.from_user.id))
+    existing = get_user(call.from_user.id)
+    if existing is not None:
+        user_cache.set(call.from_user.id, existing._replace(lang=lang))
+    answer_callback_query(call.id, text_for(lang, MSG.lang_set_confirm))
+    send_message(call.message.chat.id, get_text(MSG.start_welcome, call.from_user.id))
 
-def post_trip_to(message, from_city):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    to_city = message.text.strip()
-    set_user_state(message.from_user.id, "waiting_trip_date", f"{from_city}|{to_city}")
-    msg = bot.send_message(message.chat.id, get_text("ask_trip_date", message.from_user.id))
-    bot.register_next_step_handler(msg, post_trip_date, from_city, to_city)
+# ---- POST ORDER flow ----
+def save_order(message, data):
+    created_ts = now_ts()
+    # Yarım kalmış eski akışlardan gelen expires_at ISO metin olabilir
+    expires_ts = to_ts(data["expires_at"])
+    price_cents, price_currency, price_unit = price_fields("order", data["price"], data["weight"])
+    from_key, to_key = normalize_city_key(data["from_city"]), normalize_city_key(data["to_city"])
+    from_id, to_id = resolve_city_id(data["from_city"]), resolve_city_id(data["to_city"])
+    with db_transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO orders (tg_id, product, weight, from_city, to_city, price, price_cents, price_currency, price_unit, created_at, expires_at, created_ts, expires_ts, is_active, from_key, to_key, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (message.from_user.id, data["product"], data["weight"], data["from_city"], data["to_city"], data["price"],
+             price_cents, price_currency, price_unit, ts_to_iso(created_ts), ts_to_iso(expires_ts), created_ts, expires_ts, 1, from_key, to_key, from_id, to_id)
+        )
+    row = (cur.lastrowid, message.from_user.id, data["product"], data["weight"], data["from_city"], data["to_city"],
+           data["price"], created_ts, expires_ts, 1)
+    prime_listing_cards("order", row, get_lang(message.from_user.id))
+    on_listing_created("order", cur.lastrowid, from_id, to_id, created_ts, expires_ts)
+    send_message(message.chat.id, get_text(MSG.order_posted, message.from_user.id))
 
-def post_trip_date(message, from_city, to_city):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    trip_date_input = message.text.strip()
-    user_lang = get_lang(message.from_user.id)
-    
-    try:
-        trip_date = datetime.strptime(trip_date_input, "%Y-%m-%d")
-        if trip_date.date() < datetime.utcnow().date():
-            msg = bot.send_message(message.chat.id, MESSAGES["date_in_past"].get(user_lang))
-            bot.register_next_step_handler(msg, post_trip_date, from_city, to_city)
-            return
-    except ValueError:
-        msg = bot.send_message(message.chat.id, MESSAGES["invalid_date"].get(user_lang))
-        bot.register_next_step_handler(msg, post_trip_date, from_city, to_city)
-        return
-    
-    trip_date_str = trip_date_input
-    set_user_state(message.from_user.id, "waiting_trip_capacity", f"{from_city}|{to_city}|{trip_date_str}")
-    msg = bot.send_message(message.chat.id, get_text("ask_trip_capacity", message.from_user.id))
-    bot.register_next_step_handler(msg, post_trip_capacity, from_city, to_city, trip_date_str)
+ORDER_FLOW = register_flow(Flow("order", (
+    Step("product", MSG.ask_product, parse_text),
+    Step("weight", MSG.ask_weight, parse_float),
+    Step("from_city", MSG.ask_from, parse_text),
+    Step("to_city", MSG.ask_to, parse_text),
+    Step("price", MSG.ask_price, parse_text),
+    Step("expires_at", MSG.ask_order_expiry, parse_order_expiry),
+), save_order))
 
-def post_trip_capacity(message, from_city, to_city, trip_date):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    try:
-        capacity = float(message.text.strip())
-    except Exception:
-        capacity = 0.0
-    set_user_state(message.from_user.id, "waiting_trip_price", f"{from_city}|{to_city}|{trip_date}|{capacity}")
-    msg = bot.send_message(message.chat.id, get_text("ask_trip_price", message.from_user.id))
-    bot.register_next_step_handler(msg, post_trip_price, from_city, to_city, trip_date, capacity)
+@bot.message_handler(commands=['post_order'])
+def cmd_post_order(message):
+    register_user(message)
+    start_conversation(message, ORDER_FLOW)
 
-def post_trip_price(message, from_city, to_city, trip_date, capacity):
-    if is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", message.from_user.id))
-        clear_user_state(message.from_user.id)
-        return
-        
-    price_per_kg = message.text.strip()
-    created_at = datetime.utcnow().isoformat()
+# ---- POST TRIP flow ----
+def save_trip(message, data):
+    created_ts = now_ts()
+    date_ts = parse_day(data["date"])
     # Seyahat tarihinden sonraki gün expire edilecek
-    expires_at = calculate_trip_expiry(trip_date).isoformat()
-    
-    db_execute(
-        "INSERT INTO trips (tg_id, from_city, to_city, date, capacity_kg, price_per_kg, created_at, expires_at, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (message.from_user.id, from_city, to_city, trip_date, capacity, price_per_kg, created_at, expires_at, 1)
-    )
-    clear_user_state(message.from_user.id)
-    bot.send_message(message.chat.id, get_text("trip_posted", message.from_user.id))
+    expires_ts = calculate_trip_expiry(data["date"])
+    price_cents, price_currency, price_unit = price_fields("trip", data["price_per_kg"])
+    from_key, to_key = normalize_city_key(data["from_city"]), normalize_city_key(data["to_city"])
+    from_id, to_id = resolve_city_id(data["from_city"]), resolve_city_id(data["to_city"])
+    with db_transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO trips (tg_id, from_city, to_city, date, capacity_kg, price_per_kg, price_cents, price_currency, price_unit, created_at, expires_at, created_ts, expires_ts, date_ts, is_active, from_key, to_key, from_city_id, to_city_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (message.from_user.id, data["from_city"], data["to_city"], data["date"], data["capacity_kg"], data["price_per_kg"],
+             price_cents, price_currency, price_unit, ts_to_iso(created_ts), ts_to_iso(expires_ts), created_ts, expires_ts, date_ts, 1, from_key, to_key, from_id, to_id)
+        )
+    row = (cur.lastrowid, message.from_user.id, data["from_city"], data["to_city"], data["date"], data["capacity_kg"], 0,
+           data["price_per_kg"], created_ts, expires_ts, 1)
+    prime_listing_cards("trip", row, get_lang(message.from_user.id))
+    on_listing_created("trip", cur.lastrowid, from_id, to_id, created_ts, expires_ts, date_ts)
+    send_message(message.chat.id, get_text(MSG.trip_posted, message.from_user.id))
+
+TRIP_FLOW = register_flow(Flow("trip", (
+    Step("from_city", MSG.ask_trip_from, parse_text),
+    Step("to_city", MSG.ask_trip_to, parse_text),
+    Step("date", MSG.ask_trip_date, parse_trip_date),
+    Step("capacity_kg", MSG.ask_trip_capacity, parse_float),
+    Step("price_per_kg", MSG.ask_trip_price, parse_text),
+), save_trip))
+
+@bot.message_handler(commands=['post_trip'])
+def cmd_post_trip(message):
+    register_user(message)
+    start_conversation(message, TRIP_FLOW)
 
 # ---- LIST ----
 @bot.message_handler(commands=['list'])
 def cmd_list(message):
     register_user(message)
     clear_user_state(message.from_user.id)
-    
-    now = datetime.utcnow().isoformat()
-    orders = db_execute(
-        "SELECT * FROM orders WHERE expires_at > ? AND is_active = 1 ORDER BY created_at DESC LIMIT 10", 
-        (now,), 
-        fetch=True
-    ) or []
-    trips = db_execute(
-        "SELECT * FROM trips WHERE expires_at > ? AND is_active = 1 ORDER BY created_at DESC LIMIT 10", 
-        (now,), 
-        fetch=True
-    ) or []
-
-    if not orders and not trips:
-        bot.send_message(message.chat.id, get_text("list_no_active", message.from_user.id))
+    parsed = parse_price_view((message.text or "").split()[1:])
+    if parsed is None or parsed[1]:
+        send_message(message.chat.id, get_text(MSG.list_usage, message.from_user.id))
         return
+    text, markup = render_listing_page(message.from_user.id, view=parsed[0])
+    send_message(message.chat.id, text, reply_markup=markup)
 
-    bot.send_message(message.chat.id, get_text("list_header", message.from_user.id))
+@bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("list_"))
+def callback_list_page(call):
+    _, direction, kind, item_id, *view = call.data.split("_")
+    text, markup = render_listing_page(call.from_user.id, (kind, int(item_id)), direction, decode_view(view[0]) if view else None)
+    answer_callback_query(call.id)
+    edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
 
-    for row in orders:
-        text = format_order_row(row)
-        order_id = row[0]
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text="📩 Contact owner", callback_data=f"contact_order_{order_id}"))
-        bot.send_message(message.chat.id, text, reply_markup=markup)
+# ---- SEARCH ----
+_DATE_ARG = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+_ROUTE_SEPARATOR = re.compile(r"\s*(?:→|->|>|\|)\s*")
+
+def parse_search_args(text):
+    """'/search FROM TO [date [date]] [price/max=]' -> (from_city, to_city, date_from, date_to, view);
+    tarihler gün başı epoch saniyesi, geçersizse None"""
+    parts = text.split(maxsplit=1)
+    parsed_view = parse_price_view(parts[1].split() if len(parts) > 1 else [])
+    if parsed_view is None:
+        return None
+    view, rest = parsed_view
+    args = " ".join(rest)
+    dates = _DATE_ARG.findall(args)
+    args = _DATE_ARG.sub(" ", args).strip()
+    if len(dates) > 2:
+        return None
+    for value in dates:
+        try:
+            parse_day(value)
+        except ValueError:
+            return None
+    if _ROUTE_SEPARATOR.search(args):
+        cities = [c.strip() for c in _ROUTE_SEPARATOR.split(args, maxsplit=1)]
+    else:
+        cities = args.split()
+    if len(cities) != 2 or not all(cities):
+        return None
+    date_from = parse_day(dates[0]) if dates else None
+    date_to = parse_day(dates[-1]) if dates else None
+    return cities[0], cities[1], date_from, date_to, view
 
-    for row in trips:
-        text = format_trip_row(row)
-        trip_id = row[0]
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text="📩 Contact owner", callback_data=f"contact_trip_{trip_id}"))
-        bot.send_message(message.chat.id, text, reply_markup=markup)
+@bot.message_handler(commands=['search'])
+def cmd_search(message):
+    register_user(message)
+    user_id = message.from_user.id
+    parsed = parse_search_args(message.text or "")
+    if parsed is None:
+        send_message(message.chat.id, get_text(MSG.search_usage, user_id))
+        return
+    from_city, to_city, date_from, date_to, view = parsed
+    kinds = view.kinds if view is not None else ("order", "trip")
+    from_id, to_id = lookup_city_id(from_city), lookup_city_id(to_city)
+    orders, trips = [], []
+    if from_id is not None and to_id is not None:
+        if "order" in kinds:
+            orders = search_listings("order", from_id, to_id, view=view)
+        if "trip" in kinds:
+            trips = search_listings("trip", from_id, to_id, date_from=date_from, date_to=date_to, view=view)
+    if not orders and not trips:
+        send_message(message.chat.id, get_text(MSG.search_no_results, user_id))
+        return
+    lang = get_lang(user_id)
+    cards = [get_text(MSG.search_header, user_id)]
+    rows = []
+    for kind, listing_rows in (("order", orders), ("trip", trips)):
+        for row in listing_rows:
+            card = get_card(kind, row, lang)
+            cards.append(card.text)
+            rows.append(card.button_row)
+    send_message(message.chat.id, "\n\n".join(cards), reply_markup=keyboard_json(rows))
 
 # ---- MY LISTINGS ----
 @bot.message_handler(commands=['my_listings'])
@@ -682,43 +3212,34 @@ def cmd_my_listings(message):
     clear_user_state(message.from_user.id)
     
     user_id = message.from_user.id
-    now = datetime.utcnow().isoformat()
+    now = now_ts()
     
     # Aktif order'lar
     orders = db_execute(
-        "SELECT * FROM orders WHERE tg_id = ? AND expires_at > ? AND is_active = 1 ORDER BY created_at DESC", 
+        f"SELECT {ORDER_COLUMNS} FROM orders WHERE tg_id = ? AND expires_ts > ? AND is_active = 1 ORDER BY created_ts DESC", 
         (user_id, now), 
         fetch=True
     ) or []
     
     # Aktif trip'ler
     trips = db_execute(
-        "SELECT * FROM trips WHERE tg_id = ? AND expires_at > ? AND is_active = 1 ORDER BY created_at DESC", 
+        f"SELECT {TRIP_COLUMNS} FROM trips WHERE tg_id = ? AND expires_ts > ? AND is_active = 1 ORDER BY created_ts DESC", 
         (user_id, now), 
         fetch=True
     ) or []
 
     if not orders and not trips:
-        bot.send_message(message.chat.id, get_text("no_active_listings", user_id))
+        send_message(message.chat.id, get_text(MSG.no_active_listings, user_id))
         return
 
-    bot.send_message(message.chat.id, get_text("my_listings_header", user_id))
+    send_message(message.chat.id, get_text(MSG.my_listings_header, user_id))
 
-    # Order'ları göster
-    for row in orders:
-        text = format_order_row(row, show_controls=True, user_id=user_id)
-        order_id = row[0]
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text="❌ Deactivate", callback_data=f"deactivate_order_{order_id}"))
-        bot.send_message(message.chat.id, text, reply_markup=markup)
-
-    # Trip'leri göster
-    for row in trips:
-        text = format_trip_row(row, show_controls=True, user_id=user_id)
-        trip_id = row[0]
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text="❌ Deactivate", callback_data=f"deactivate_trip_{trip_id}"))
-        bot.send_message(message.chat.id, text, reply_markup=markup)
+    # Önce order'lar, sonra trip'ler; her ilan kendi "kapat" butonuyla
+    lang = get_lang(user_id)
+    for kind, listing_rows in (("order", orders), ("trip", trips)):
+        for row in listing_rows:
+            card = get_card(kind, row, lang, CARD_OWNER)
+            send_message(message.chat.id, card.text, reply_markup=card.markup_json)
 
 # ---- CALLBACK contact handlers ----
 @bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("contact_"))
@@ -728,46 +3249,20 @@ def callback_contact(call):
     kind = parts[1]
     item_id = int(parts[2])
 
-    requester = call.from_user
-    requester_info = f"{requester.first_name or ''} {requester.last_name or ''}".strip()
-    requester_username = requester.username or "(no username)"
-
     user_lang = get_lang(call.from_user.id)
 
-    if kind == "order":
-        rows = db_execute("SELECT tg_id, product FROM orders WHERE id = ? AND is_active = 1", (item_id,), fetch=True)
-        if not rows:
-            bot.answer_callback_query(call.id, "Listing not found or inactive.")
-            return
-        owner_tg, product = rows[0]
-        text_to_owner = (
-            f"📩 Your <b>Order #{item_id}</b> has a contact request.\n\n"
-            f"Requester: {requester_info}\nUsername: @{requester_username}\n\n"
-            f"Product: {product}\n\nRespond if you want to proceed."
-        )
-        try:
-            bot.send_message(owner_tg, text_to_owner)
-            bot.answer_callback_query(call.id, MESSAGES["contact_sent_success"].get(user_lang))
-        except Exception:
-            bot.answer_callback_query(call.id, MESSAGES["contact_sent_failed"].get(user_lang))
-    elif kind == "trip":
-        rows = db_execute("SELECT tg_id, from_city, to_city, date FROM trips WHERE id = ? AND is_active = 1", (item_id,), fetch=True)
-        if not rows:
-            bot.answer_callback_query(call.id, "Listing not found or inactive.")
-            return
-        owner_tg, from_city, to_city, date = rows[0]
-        text_to_owner = (
-            f"📩 Your <b>Trip #{item_id}</b> has a contact request.\n\n"
-            f"Requester: {requester_info}\nUsername: @{requester_username}\n"
-            f"Route: {from_city} → {to_city} (Date: {date})\n\nRespond if you want to proceed."
-        )
-        try:
-            bot.send_message(owner_tg, text_to_owner)
-            bot.answer_callback_query(call.id, MESSAGES["contact_sent_success"].get(user_lang))
-        except Exception:
-            bot.answer_callback_query(call.id, MESSAGES["contact_sent_failed"].get(user_lang))
+    if kind not in CONTACT_LISTINGS:
+        answer_callback_query(call.id, text_for(user_lang, MSG.generic_error))
+        return
+
+    # Sahibine mesaj burada gönderilmez; ContactDigester özetleyip kuyruktan yollar
+    result = record_contact_request(kind, item_id, call.from_user, call.message.chat.id)
+    if result == CONTACT_NOT_FOUND:
+        answer_callback_query(call.id, text_for(user_lang, MSG.listing_not_found_or_inactive))
+    elif result == CONTACT_DUPLICATE:
+        answer_callback_query(call.id, text_for(user_lang, MSG.contact_already_sent))
     else:
-        bot.answer_callback_query(call.id, "Error.")
+        answer_callback_query(call.id, text_for(user_lang, MSG.contact_sent_success))
 
 # ---- DEACTIVATE LISTING HANDLER ----
 @bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("deactivate_"))
@@ -784,94 +3279,858 @@ def callback_deactivate(call):
         # İlan sahibi kontrolü
         rows = db_execute("SELECT tg_id FROM orders WHERE id = ?", (item_id,), fetch=True)
         if not rows:
-            bot.answer_callback_query(call.id, "Listing not found.")
+            answer_callback_query(call.id, text_for(user_lang, MSG.listing_not_found))
             return
         
         owner_id = rows[0][0]
         if owner_id != user_id:
-            bot.answer_callback_query(call.id, MESSAGES["not_listing_owner"].get(user_lang))
+            answer_callback_query(call.id, text_for(user_lang, MSG.not_listing_owner))
             return
         
-        # İlanı deaktive et
-        db_execute("UPDATE orders SET is_active = 0 WHERE id = ?", (item_id,))
-        bot.answer_callback_query(call.id, MESSAGES["listing_deactivated"].get(user_lang))
+        # İlanı deaktive et; siparişin aktif rezervasyonu aynı transaction'da bırakılır
+        with db_transaction() as conn:
+            conn.execute("UPDATE orders SET is_active = 0 WHERE id = ?", (item_id,))
+            released, reopened = release_reservations(conn, "order", [item_id])
+        on_listings_deactivated("order", [item_id])
+        on_reservations_released("order", released, reopened)
+        answer_callback_query(call.id, text_for(user_lang, MSG.listing_deactivated))
         # Mesajı güncelle
-        try:
-            bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
-            bot.send_message(call.message.chat.id, MESSAGES["listing_deactivated"].get(user_lang))
-        except:
-            pass
+        edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+        send_message(call.message.chat.id, text_for(user_lang, MSG.listing_deactivated))
             
     elif kind == "trip":
         # İlan sahibi kontrolü
         rows = db_execute("SELECT tg_id FROM trips WHERE id = ?", (item_id,), fetch=True)
         if not rows:
-            bot.answer_callback_query(call.id, "Listing not found.")
+            answer_callback_query(call.id, text_for(user_lang, MSG.listing_not_found))
             return
         
         owner_id = rows[0][0]
         if owner_id != user_id:
-            bot.answer_callback_query(call.id, MESSAGES["not_listing_owner"].get(user_lang))
+            answer_callback_query(call.id, text_for(user_lang, MSG.not_listing_owner))
             return
         
-        # İlanı deaktive et
-        db_execute("UPDATE trips SET is_active = 0 WHERE id = ?", (item_id,))
-        bot.answer_callback_query(call.id, MESSAGES["listing_deactivated"].get(user_lang))
+        # İlanı deaktive et; yolculuktaki aktif rezervasyonlar aynı transaction'da bırakılır.
+        # closed_full sıfırlanır: sahibinin kapattığı yolculuğu sonraki bir iptal yeniden açmamalı
+        with db_transaction() as conn:
+            conn.execute("UPDATE trips SET is_active = 0, closed_full = 0 WHERE id = ?", (item_id,))
+            released, reopened = release_reservations(conn, "trip", [item_id])
+        on_listings_deactivated("trip", [item_id])
+        on_reservations_released("trip", released, reopened)
+        answer_callback_query(call.id, text_for(user_lang, MSG.listing_deactivated))
         # Mesajı güncelle
-        try:
-            bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
-            bot.send_message(call.message.chat.id, MESSAGES["listing_deactivated"].get(user_lang))
-        except:
-            pass
+        edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+        send_message(call.message.chat.id, text_for(user_lang, MSG.listing_deactivated))
+
+# ---- RESERVATIONS ----
+def cancel_reservation_markup(reservation_id, lang):
+    button = {"text": text_for(lang, MSG.btn_cancel_reservation, id=reservation_id), "callback_data": f"unreserve_{reservation_id}"}
+    return keyboard_json([json.dumps([button])])
+
+def book_trip(requester, chat_id, trip_id, order_id):
+    """Yer ayırır, isteyene onay ve yolculuk sahibine bildirim gönderir; başarısızsa isteyenin dilinde hata metni döner"""
+    lang = get_lang(requester.id)
+    result, reservation = reserve_trip(trip_id, order_id, requester.id)
+    if result != RESERVE_OK:
+        return text_for(lang, RESERVE_ERRORS[result])
+    values = dict(trip_id=trip_id, order_id=order_id, weight=reservation.weight, remaining=reservation.remaining)
+    send_message(chat_id, text_for(lang, MSG.reservation_confirmed, **values),
+                 reply_markup=cancel_reservation_markup(reservation.id, lang))
+    owner_lang = get_lang(reservation.trip_owner_id)
+    name = f"{requester.first_name or ''} {requester.last_name or ''}".strip()
+    text = text_for(owner_lang, MSG.reservation_owner_notice, product=reservation.product, name=name,
+                    username=requester.username or text_for(owner_lang, MSG.no_username), **values)
+    if reservation.trip_full:
+        text = f"{text}\n\n{text_for(owner_lang, MSG.reservation_trip_full, trip_id=trip_id)}"
+    send_message(reservation.trip_owner_id, text, lane=LANE_NOTIFY,
+                 reply_markup=cancel_reservation_markup(reservation.id, owner_lang))
+    return None
+
+@bot.message_handler(commands=['reserve'])
+def cmd_reserve(message):
+    register_user(message)
+    clear_user_state(message.from_user.id)
+    user_id = message.from_user.id
+    args = [arg.lstrip("#") for arg in (message.text or "").split()[1:]]
+    if not 1 <= len(args) <= 2 or not all(arg.isdigit() for arg in args):
+        send_message(message.chat.id, get_text(MSG.reserve_usage, user_id))
+        return
+    trip_id = int(args[0])
+    if len(args) == 2:
+        order_id = int(args[1])
+    else:
+        # Sipariş verilmemişse yolculuğun güzergahındaki en yeni, henüz yer ayırmamış aktif sipariş
+        rows = db_execute(
+            "SELECT o.id FROM orders o JOIN trips t ON t.id = ? "
+            "WHERE o.tg_id = ? AND o.is_active = 1 AND o.expires_ts > ? "
+            "AND o.from_city_id = t.from_city_id AND o.to_city_id = t.to_city_id "
+            "AND NOT EXISTS (SELECT 1 FROM reservations r WHERE r.order_id = o.id AND r.status = 'active') "
+            "ORDER BY o.created_ts DESC LIMIT 1",
+            (trip_id, user_id, now_ts()),
+            fetch=True
+        )
+        if not rows:
+            send_message(message.chat.id, get_text(MSG.reserve_no_order, user_id))
+            return
+        order_id = rows[0][0]
+    error = book_trip(message.from_user, message.chat.id, trip_id, order_id)
+    if error:
+        send_message(message.chat.id, error)
+
+@bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("reserve_"))
+def callback_reserve(call):
+    _, trip_id, order_id = call.data.split("_")
+    error = book_trip(call.from_user, call.message.chat.id, int(trip_id), int(order_id))
+    answer_callback_query(call.id, error)
+
+@bot.callback_query_handler(func=lambda call: call.data and call.data.startswith("unreserve_"))
+def callback_unreserve(call):
+    reservation_id = int(call.data.split("_")[1])
+    user_id = call.from_user.id
+    user_lang = get_lang(user_id)
+    reservation = cancel_reservation(reservation_id, user_id)
+    if reservation is None:
+        answer_callback_query(call.id, text_for(user_lang, MSG.reservation_not_found))
+        return
+    answer_callback_query(call.id, text_for(user_lang, MSG.reservation_cancelled, id=reservation_id))
+    edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+    # Karşı tarafa haber ver
+    other_id = reservation.trip_owner_id if user_id == reservation.requester_id else reservation.requester_id
+    send_message(other_id, text_for(get_lang(other_id), MSG.reservation_cancel_notice, id=reservation_id, order_id=reservation.order_id,
+                                    trip_id=reservation.trip_id, weight=reservation.weight), lane=LANE_NOTIFY)
+    if reservation.trip_reopened:
+        owner_id = reservation.trip_owner_id
+        send_message(owner_id, text_for(get_lang(owner_id), MSG.reservation_trip_reopened, trip_id=reservation.trip_id,
+                                        remaining=reservation.remaining), lane=LANE_NOTIFY)
 
 # ---- ADMIN COMMANDS ----
 @bot.message_handler(commands=['all_orders'])
 def cmd_all_orders(message):
-    if message.from_user.id not in ADMIN_IDS:
-        bot.reply_to(message, "Not admin.")
-        return
-    rows = db_execute("SELECT * FROM orders ORDER BY created_at DESC", fetch=True) or []
-    for row in rows:
-        bot.send_message(message.chat.id, format_order_row(row))
+    send_listing_export(message, "order")
 
 @bot.message_handler(commands=['all_trips'])
 def cmd_all_trips(message):
-    if message.from_user.id not in ADMIN_IDS:
-        bot.reply_to(message, "Not admin.")
-        return
-    rows = db_execute("SELECT * FROM trips ORDER BY created_at DESC", fetch=True) or []
-    for row in rows:
-        bot.send_message(message.chat.id, format_trip_row(row))
+    send_listing_export(message, "trip")
 
 # ---- COMMAND INTERCEPTION HANDLER ----
 @bot.message_handler(func=lambda message: True)
 def handle_all_messages(message):
     """Tüm mesajları kontrol eder ve state varsa komutları yakalar"""
     user_id = message.from_user.id
-    state, data = get_user_state(user_id)
+    state = get_user_state(user_id)
     
     if state and is_command(message):
-        bot.send_message(message.chat.id, get_text("command_intercepted", user_id))
+        send_message(message.chat.id, get_text(MSG.command_intercepted, user_id))
         return
     
     if not state and not is_command(message):
-        bot.reply_to(message, "❌ Unknown command. Use /start to see available commands.")
+        send_message(message.chat.id, get_text(MSG.unknown_command, user_id), reply_to_message_id=message.message_id)
+
+# ====== METRICS ======
+# enable_metrics() handler'ları ve apihelper._make_request'i zamanlayan sarmalayıcılarla değiştirir; DB bağlantıları
+# METRICS_ENABLED ise import sırasından itibaren TimedConnection ile açılır. Kapalıyken ölçüm maliyeti sıfırdır.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP = {
+    "bot_handler_seconds": ("histogram", "Handler latency by handler function"),
+    "bot_handler_errors_total": ("counter", "Handler calls that raised"),
+    "bot_updates_total": ("counter", "Handled updates by command or callback prefix"),
+    "bot_db_query_seconds": ("histogram", "SQL statement latency by statement"),
+    "bot_telegram_api_seconds": ("histogram", "Telegram Bot API call latency by method"),
+    "bot_telegram_api_errors_total": ("counter", "Telegram Bot API errors by method and error code"),
+}
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+class Metrics:
+    """Etiketli sayaç ve gecikme histogramları; metrik başına seri sayısı sınırlıdır (aşan etiketler 'other')"""
+    MAX_SERIES = 200
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(dict)  # isim -> {etiketler: Histogram}
+        self._counters = defaultdict(dict)    # isim -> {etiketler: sayı}
+        self._collectors = []
+
+    def _series(self, table, labels, factory):
+        value = table.get(labels, _MISSING)
+        if value is _MISSING:
+            if len(table) >= self.MAX_SERIES:
+                labels = tuple((name, "other") for name, _ in labels)
+                value = table.get(labels, _MISSING)
+            if value is _MISSING:
+                value = table[labels] = factory()
+        return labels, value
+
+    def observe(self, name, labels, seconds):
+        with self._lock:
+            self._series(self._histograms[name], labels, Histogram)[1].observe(seconds)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            counters = self._counters[name]
+            labels, value = self._series(counters, labels, int)
+            counters[labels] = value + amount
+
+    def add_collector(self, collect):
+        """collect() -> [(isim, tür, etiketler, değer)]; her dışa aktarımda çağrılır (kuyruk/önbellek durumları)"""
+        self._collectors.append(collect)
+
+    def _collected(self):
+        samples = []
+        for collect in self._collectors:
+            try:
+                samples.extend(collect())
+            except Exception as e:
+                print(f"❌ Metrics collector failed: {e}")
+        return samples
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self):
+        """Prometheus metin formatı (0.0.4)"""
+        lines = []
+        with self._lock:
+            histograms = {name: {labels: (list(h.counts), h.total, h.count) for labels, h in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+        for name, series in histograms.items():
+            kind, help_text = METRIC_HELP.get(name, ("histogram", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, (counts, total, count) in series.items():
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{self._labels(labels, (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        for name, series in counters.items():
+            kind, help_text = METRIC_HELP.get(name, ("counter", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in series.items():
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        # Aynı metriğin örnekleri tek blokta olmalı
+        collected = defaultdict(list)
+        for name, kind, labels, value in self._collected():
+            collected[(name, kind)].append(f"{name}{self._labels(labels)} {value}")
+        for (name, kind), samples in collected.items():
+            lines.append(f"# TYPE {name} {kind}")
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON loglar için özet: seri başına sayı, ortalama ve en yüksek gecikme (ms)"""
+        with self._lock:
+            result = {
+                name: [dict(labels, count=h.count, avg_ms=round(h.total / h.count * 1000, 3) if h.count else 0.0,
+                            max_ms=round(h.max * 1000, 3))
+                       for labels, h in series.items()]
+                for name, series in self._histograms.items()
+            }
+            for name, series in self._counters.items():
+                result[name] = [dict(labels, value=value) for labels, value in series.items()]
+        for name, _, labels, value in self._collected():
+            result.setdefault(name, []).append(dict(labels, value=value))
+        return result
+
+metrics = Metrics()
+_metrics_enabled = False
+
+def log_event(event, **fields):
+    """Tek satır JSON log"""
+    print(json.dumps({"ts": datetime.utcnow().isoformat(), "event": event, **fields}, ensure_ascii=False, default=str))
+
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(query):
+    """Sorgu metnini etiket olarak kullanılabilir hale getirir: boşluklar tekleşir, (?, ?, ...) listeleri (?) olur"""
+    return _SQL_IN_LIST.sub("(?)", " ".join(query.split()))[:160]
+
+def update_route(update):
+    """Güncellemenin sayaç etiketi: kayıtlı komut, callback öneki ya da 'text'"""
+    if isinstance(update, types.CallbackQuery):
+        return "callback", (update.data or "").split("_", 1)[0]
+    text = update.text or ""
+    if text.startswith("/"):
+        command = text.split()[0].split("@")[0][1:]
+        if command in _registered_commands:
+            return "command", command
+    return "message", "text"
+
+_registered_commands = set()
+
+def _timed_handler(handler):
+    name = handler.__name__
+    labels = (("handler", name),)
+
+    @functools.wraps(handler)
+    def wrapper(update, *args, **kwargs):
+        kind, route = update_route(update)
+        metrics.inc("bot_updates_total", (("type", kind), ("name", route)))
+        start = time.perf_counter()
+        try:
+            return handler(update, *args, **kwargs)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("bot_handler_seconds", labels, elapsed)
+            if elapsed * 1000 >= METRICS_SLOW_MS:
+                log_event("slow_handler", handler=name, route=route, ms=round(elapsed * 1000, 1))
+    return wrapper
+
+class TimedConnection(sqlite3.Connection):
+    """Bağlantı üzerinden çalışan her deyimi (db_execute, db_transaction içindekiler, migration'lar) ve
+    commit/rollback'i bot_db_query_seconds'a yazar; SELECT'lerde ilk satıra kadar geçen süre ölçülür"""
+
+    def _observe(self, label, start):
+        metrics.observe("bot_db_query_seconds", (("statement", label),), time.perf_counter() - start)
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._observe(statement_label(sql), start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._observe(statement_label(sql), start)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self._observe("COMMIT", start)
+
+    def rollback(self):
+        start = time.perf_counter()
+        try:
+            super().rollback()
+        finally:
+            self._observe("ROLLBACK", start)
+
+if METRICS_ENABLED:
+    # İlk DB erişiminden (init_db) önce: süreçteki tüm bağlantılar baştan zamanlayıcılı açılır
+    _db_factory = TimedConnection
+
+def _timed_make_request(make_request):
+    @functools.wraps(make_request)
+    def wrapper(token, method_name, method='get', params=None, files=None):
+        start = time.perf_counter()
+        try:
+            return make_request(token, method_name, method, params, files)
+        except ApiTelegramException as e:
+            metrics.inc("bot_telegram_api_errors_total", (("method", method_name), ("code", str(e.error_code))))
+            raise
+        except Exception:
+            metrics.inc("bot_telegram_api_errors_total", (("method", method_name), ("code", "network")))
+            raise
+        finally:
+            metrics.observe("bot_telegram_api_seconds", (("method", method_name),), time.perf_counter() - start)
+    return wrapper
+
+def _collect_runtime():
+    stats = outbox.stats()
+    samples = [("bot_send_queue_depth", "gauge", (("lane", lane),), depth) for lane, depth in stats["queue_depth"].items()]
+    samples += [("bot_send_jobs_total", "counter", (("result", key),), stats[key])
+                for key in ("sent", "failed", "retried", "rate_limited", "coalesced")]
+    for cache_name, cache in (("user", user_cache), ("card", card_cache)):
+        cache_stats = cache.stats()
+        samples += [("bot_cache_size", "gauge", (("cache", cache_name),), cache_stats["size"]),
+                    ("bot_cache_hits_total", "counter", (("cache", cache_name),), cache_stats["hits"]),
+                    ("bot_cache_misses_total", "counter", (("cache", cache_name),), cache_stats["misses"])]
+    samples.append(("bot_active_conversations", "gauge", (), len(_conversations)))
+    return samples
+
+def metrics_log_worker(interval):
+    """Ölçüm özetini interval saniyede bir JSON satırı olarak loglar"""
+    while not shutdown_event.wait(interval):
+        try:
+            log_event("metrics", **metrics.snapshot())
+        except Exception as e:
+            print(f"❌ Metrics log error: {e}")
+
+def serve_metrics(host, port):
+    """/metrics uç noktasını arka plan thread'inde sunar"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            data = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def enable_metrics(port=METRICS_PORT):
+    """Handler'ları, SQL deyimlerini ve Telegram API çağrılarını zamanlayıcılarla sarar, uç noktayı başlatır.
+    Yalnızca bundan sonra açılan DB bağlantıları zamanlanır (METRICS_ENABLED ile hepsi)"""
+    global _metrics_enabled, _db_factory
+    if _metrics_enabled:
+        return
+    _metrics_enabled = True
+    for handlers in (bot.message_handlers, bot.callback_query_handlers):
+        for handler in handlers:
+            _registered_commands.update(handler["filters"].get("commands") or ())
+            handler["function"] = _timed_handler(handler["function"])
+    _db_factory = TimedConnection
+    telebot.apihelper._make_request = _timed_make_request(telebot.apihelper._make_request)
+    metrics.add_collector(_collect_runtime)
+    serve_metrics(METRICS_HOST, port)
+    print(f"✅ Metrics endpoint on http://{METRICS_HOST}:{port}/metrics")
+    if METRICS_LOG_INTERVAL > 0:
+        threading.Thread(target=metrics_log_worker, args=(METRICS_LOG_INTERVAL,), daemon=True).start()
+
+# ====== SERVICES ======
+def start_services(shard=None):
+    """Handler'ların ihtiyaç duyduğu bellek durumunu yükler ve arka plan worker'larını başlatır (shard: (index, shards))"""
+    owns = None
+    if shard is not None:
+        index, shards = shard
+        owns = lambda user_id: shard_of(user_id, shards) == index
+    print(f"Restored {restore_conversations(owns)} in-progress conversations")
+
+    if METRICS_ENABLED:
+        enable_metrics(METRICS_PORT if shard is None else METRICS_PORT + 1 + shard[0])
+
+    print(f"Loaded {load_city_aliases()} city aliases")
+
+    route_index.sync()
+    print(f"Route index loaded ({len(route_index)} active listings)")
+
+    flush_thread = threading.Thread(target=write_behind_worker, daemon=True)
+    flush_thread.start()
+
+    if MATCHING_ENABLED:
+        match_thread = threading.Thread(target=match_worker, daemon=True)
+        match_thread.start()
+        print("Matching worker started...")
+
+    outbox.start()
+    print(f"Outbound send queue started ({outbox.workers} workers)...")
+
+    contact_digester.shard = shard
+    contact_digester.start()
+    print("Contact digester started...")
+
+def stop_services():
+    """Arka plan worker'larını durdurur, bekleyen yazma ve gönderimleri boşaltır"""
+    shutdown_event.set()
+    contact_digester.stop()
+    outbox.stop()
+    flush_pending_writes()
+    close_db_connections()
+
+# ====== ASYNC ENGINE ======
+# BOT_MODE=async: güncellemeler AsyncTeleBot ile tek event loop'ta alınır ve
+# yukarıdaki handler'lar coroutine sarmalayıcılarla çalışır. Handler gövdeleri senkron
+# (sqlite3 + outbox) kalır ve gövdenin tamamı (DB erişimi dahil) ASYNC_WORKERS
+# thread'lik executor'da koşturulur: aynı anda işlenen güncelleme sayısı bu havuzla
+# sınırlıdır. Sınırsız olan, bekleyen sohbetlerdir: konuşma durumu bellekte
+# olduğundan kullanıcının sonraki mesajını bekleyen sohbet thread tutmaz.
+_async_executor = None
+_async_user_locks = weakref.WeakValueDictionary()
+
+async def run_blocking(fn, *args, **kwargs):
+    """Senkron bir fonksiyonu async executor'da çalıştırır"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_async_executor, functools.partial(fn, *args, **kwargs))
+
+def _async_handler(handler):
+    """Senkron handler'ı coroutine'e sarar; aynı kullanıcının güncellemeleri sırayla işlenir"""
+    async def wrapper(update):
+        user_id = update.from_user.id
+        lock = _async_user_locks.get(user_id)
+        if lock is None:
+            lock = _async_user_locks[user_id] = asyncio.Lock()
+        async with lock:
+            await run_blocking(handler, update)
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+def build_async_bot():
+    """Senkron bot'a kayıtlı handler'ları aynı sıra ve filtrelerle AsyncTeleBot'a aktarır"""
+    from telebot.async_telebot import AsyncTeleBot
+    async_bot = AsyncTeleBot(TOKEN, parse_mode="HTML")
+    for source, target in ((bot.message_handlers, async_bot.message_handlers),
+                           (bot.callback_query_handlers, async_bot.callback_query_handlers)):
+        for handler in source:
+            target.append({**handler, "function": _async_handler(handler["function"])})
+    return async_bot
+
+def run_async_bot():
+    """AsyncTeleBot ile long polling başlatır (bloklar)"""
+    global _async_executor
+    _async_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="async-handler")
+    async_bot = build_async_bot()
+    try:
+        asyncio.run(async_bot.infinity_polling(timeout=60, request_timeout=90))
+    finally:
+        _async_executor.shutdown(wait=True)
+
+# ====== WEBHOOK INGRESS ======
+def update_user_id(payload):
+    """Ham update JSON'undan gönderen kullanıcının id'sini bulur (yoksa update_id)"""
+    for value in payload.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id", 0)
+    return payload.get("update_id", 0)
+
+class _WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # varsayılan listen backlog (5) ani yüklerde bağlantıları reddeder
+
+# Her güncelleme kullanıcı id'sine göre sabit bir worker kuyruğuna düşer; böylece
+# aynı kullanıcının mesajları sırayla işlenir. Kuyruk doluysa 503 dönülür ve
+# Telegram güncellemeyi daha sonra tekrar gönderir (backpressure).
+class WebhookIngress:
+    """Telegram webhook isteklerini alan küçük HTTP sunucusu"""
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, process, host="127.0.0.1", port=0, path="/webhook", secret="", workers=4, queue_size=256):
+        if not secret:
+            raise ValueError("webhook secret is required")
+        self.process = process
+        self.path = path
+        self.secret = secret.encode()
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+        self._threads = []
+        self.server = _WebhookServer((host, port), self._handler_class())
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def _handler_class(self):
+        ingress = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                ingress.handle_post(self)
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    ingress.reply(self, 200, json.dumps(ingress.stats()))
+                else:
+                    ingress.reply(self, 404)
+
+            def log_message(self, format, *args):
+                pass  # her istek için stderr'e yazma
+
+        return Handler
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def reply(self, request, status, body="", headers=()):
+        data = body.encode()
+        request.send_response(status)
+        for name, value in headers:
+            request.send_header(name, value)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def handle_post(self, request):
+        """Tek bir webhook isteğini doğrular ve kuyruğa alır"""
+        try:
+            length = int(request.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= WEBHOOK_MAX_BODY:
+            self._count("bad_request")
+            return self.reply(request, 413 if length > 0 else 400)
+        # Gövde her durumda okunur; okunmadan cevap dönülürse bağlantı RST ile kapanabilir
+        body = request.rfile.read(length)
+        if request.path != self.path:
+            return self.reply(request, 404)
+        given = request.headers.get(self.SECRET_HEADER, "").encode("utf-8", "replace")
+        if not hmac.compare_digest(given, self.secret):
+            self._count("unauthorized")
+            return self.reply(request, 403)
+        try:
+            payload = json.loads(body)
+            update = types.Update.de_json(payload)
+        except Exception as e:
+            self._count("bad_request")
+            print(f"❌ Webhook rejected malformed update: {e}")
+            return self.reply(request, 400)
+        if not self.enqueue(payload, update):
+            self._count("rejected")
+            return self.reply(request, 503, headers=[("Retry-After", "1")])
+        self._count("accepted")
+        self.reply(request, 200)
+
+    def enqueue(self, payload, update):
+        """Güncellemeyi kullanıcının worker kuyruğuna koyar; kuyruk doluysa False döner"""
+        worker_queue = self.queues[update_user_id(payload) % len(self.queues)]
+        try:
+            worker_queue.put_nowait(update)
+        except queue.Full:
+            return False
+        return True
+
+    def _worker(self, worker_queue):
+        while True:
+            update = worker_queue.get()
+            if update is None:
+                return
+            try:
+                self.process([update])
+                self._count("processed")
+            except Exception as e:
+                self._count("errors")
+                print(f"❌ Webhook update {update.update_id} failed: {e}")
+
+    def serve_forever(self):
+        """Worker'ları başlatır ve HTTP sunucusunu çalıştırır; durunca kuyrukları boşaltır (bloklar)"""
+        for worker_queue in self.queues:
+            thread = threading.Thread(target=self._worker, args=(worker_queue,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            for worker_queue in self.queues:
+                worker_queue.put(None)
+            for thread in self._threads:
+                thread.join()
+
+    def stop(self):
+        """Başka bir thread'den serve_forever'ı durdurur"""
+        self.server.shutdown()
+
+    def stats(self):
+        with self._lock:
+            result = dict(self.counters)
+        result["queue_depth"] = [q.qsize() for q in self.queues]
+        return result
+
+def run_webhook():
+    """BOT_MODE=webhook: güncellemeleri yerel HTTP sunucusundan alır (bloklar)"""
+    # Handler'lar TeleBot'un kendi havuzunda değil ingress worker'larında çalışır;
+    # eşzamanlılık WEBHOOK_WORKERS ile sınırlanır
+    bot.threaded = False
+    ingress = WebhookIngress(bot.process_new_updates, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                             WEBHOOK_SECRET, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+    serve_webhook(ingress)
+
+def serve_webhook(ingress):
+    """Webhook'u (WEBHOOK_URL verilmişse) Telegram'a kaydeder ve ingress'i çalıştırır (bloklar)"""
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                        max_connections=min(100, WEBHOOK_WORKERS * 4))
+        print(f"✅ Webhook registered: {WEBHOOK_URL}")
+    host, port = ingress.address[:2]
+    print(f"Webhook listening on {host}:{port}{ingress.path}")
+    ingress.serve_forever()
+
+# ====== SHARDED WORKERS ======
+# BOT_MODE=sharded: ön süreç (polling ya da webhook) güncellemeleri kullanıcı id'sine
+# göre sabit bir worker sürecine yollar. Sihirbaz durumu o süreçte kalır; süreçler
+# DB'yi WAL üzerinden paylaşır ve cevapları kendi outbox'larıyla gönderir.
+def shard_of(user_id, shards):
+    """Kullanıcının güncellemelerini işleyen shard'ın indeksi"""
+    return user_id % shards
+
+def shard_worker(index, shards, inbox, ready):
+    """Worker süreci: kendi kullanıcılarının güncellemelerini sırayla işler"""
+    global outbox
+    # Ctrl+C tüm süreç grubuna gider; kapanışı ön süreç bitiş işaretiyle yönetir
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    bot.threaded = False
+    # Telegram'ın toplam limiti bot başına; shard'lar arasında paylaştırılır
+    outbox = SendDispatcher(bot, global_rate=SEND_GLOBAL_RATE / shards)
+    start_services(shard=(index, shards))
+    ready.set()
+    try:
+        while True:
+            payload = inbox.get()
+            if payload is None:
+                break
+            try:
+                bot.process_new_updates([types.Update.de_json(payload)])
+            except Exception as e:
+                print(f"❌ Shard {index} update {payload.get('update_id')} failed: {e}")
+    finally:
+        stop_services()
+
+class ShardRouter:
+    """Güncellemeleri kullanıcıya göre worker süreçlerine dağıtır ve süreçleri ayakta tutar"""
+
+    def __init__(self, shards, queue_size=SHARD_QUEUE_SIZE):
+        self.shards = shards
+        # fork yerine spawn: ana süreçte çalışan thread'ler ve açık sqlite bağlantıları kopyalanmaz
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(queue_size) for _ in range(shards)]
+        self.processes = [None] * shards
+
+    def _spawn(self, index):
+        ready = self._ctx.Event()
+        process = self._ctx.Process(target=shard_worker, name=f"shard-{index}",
+                                    args=(index, self.shards, self.queues[index], ready))
+        process.start()
+        self.processes[index] = process
+        return ready
+
+    def start(self, timeout=60):
+        """Tüm worker'ları başlatır ve hazır olmalarını bekler"""
+        events = [self._spawn(i) for i in range(self.shards)]
+        deadline = time.monotonic() + timeout
+        for i, ready in enumerate(events):
+            while not ready.wait(0.5):
+                if not self.processes[i].is_alive() or time.monotonic() > deadline:
+                    self.stop(timeout=5)
+                    raise RuntimeError(f"Shard {i} failed to start")
+
+    def dispatch(self, payload, block=True):
+        """Ham update'i sahibinin kuyruğuna koyar; block=False iken kuyruk doluysa False döner"""
+        worker_queue = self.queues[shard_of(update_user_id(payload), self.shards)]
+        try:
+            worker_queue.put(payload, block)
+        except queue.Full:
+            return False
+        return True
+
+    def supervise(self):
+        """Beklenmedik şekilde kapanan worker'ları yeniden başlatır"""
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                print(f"❌ Shard {i} exited with code {process.exitcode}, restarting")
+                self._spawn(i)
+
+    def stop(self, timeout=30):
+        """Worker'lara bitiş işareti gönderir; kuyruklarını boşaltıp çıkmalarını bekler"""
+        for worker_queue in self.queues:
+            worker_queue.put(None)
+        for i, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                print(f"❌ Shard {i} did not stop in {timeout}s, terminating")
+                process.terminate()
+
+class ShardedWebhookIngress(WebhookIngress):
+    """Webhook güncellemelerini yerel thread'ler yerine shard süreçlerine yollar"""
+
+    def __init__(self, router, **kwargs):
+        super().__init__(None, workers=0, **kwargs)
+        self.router = router
+
+    def enqueue(self, payload, update):
+        return self.router.dispatch(payload, block=False)
+
+def poll_updates(dispatch):
+    """getUpdates ile güncellemeleri ham JSON olarak çeker ve dispatch'e verir (bloklar)"""
+    offset = None
+    while not shutdown_event.is_set():
+        try:
+            updates = telebot.apihelper.get_updates(TOKEN, offset, timeout=60, long_polling_timeout=60)
+        except Exception as e:
+            print(f"❌ getUpdates failed: {e}")
+            shutdown_event.wait(3)
+            continue
+        for payload in updates:
+            dispatch(payload)
+            offset = payload["update_id"] + 1
+
+def run_sharded():
+    """BOT_MODE=sharded: ön süreç + SHARD_WORKERS worker süreci (bloklar)"""
+    router = ShardRouter(SHARD_WORKERS)
+    router.start()
+    print(f"✅ {SHARD_WORKERS} shard workers ready")
+
+    def supervisor():
+        while not shutdown_event.wait(5):
+            router.supervise()
+
+    threading.Thread(target=supervisor, daemon=True).start()
+    try:
+        if SHARD_INGRESS == "webhook":
+            serve_webhook(ShardedWebhookIngress(router, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                                                secret=WEBHOOK_SECRET))
+        else:
+            poll_updates(router.dispatch)
+    finally:
+        shutdown_event.set()
+        router.stop()
 
 # ====== START ======
 if __name__ == "__main__":
     print("Initializing DB...")
     init_db()
-    
-    print("Cleaning up expired listings...")
-    cleanup_expired_listings()
-    
-    # Otomatik temizleme thread'ini başlat
-    cleanup_thread = threading.Thread(target=auto_cleanup_worker, daemon=True)
-    cleanup_thread.start()
-    print("Auto-cleanup thread started...")
-    
-    print("Bot started...")
-    try:
-        bot.infinity_polling(timeout=60, long_polling_timeout=60)
-    except KeyboardInterrupt:
-        print("Bot stopped by user.")
\ No newline at end of file
+
+    # Süresi geçmiş ilanlar hemen, kalanlar bitiş anlarında kapatılır
+    expiry_scheduler.start()
+    print(f"Expiry scheduler started ({len(expiry_scheduler)} active listings)...")
+
+    if BOT_MODE == "sharded":
+        # Ön süreç handler çalıştırmaz; bellek durumu ve worker'lar shard süreçlerinde
+        print(f"Bot started (sharded, {SHARD_INGRESS} ingress)...")
+        try:
+            run_sharded()
+        except KeyboardInterrupt:
+            print("Bot stopped by user.")
+        finally:
+            expiry_scheduler.stop()
+            close_db_connections()
+    else:
+        try:
+            # try içinde: servisler başlatılamazsa da (ör. metrics portu dolu) non-daemon zamanlayıcı durdurulur
+            start_services()
+            if BOT_MODE == "async":
+                print("Bot started (asyncio engine)...")
+                run_async_bot()
+            elif BOT_MODE == "webhook":
+                print("Bot started (webhook)...")
+                run_webhook()
+            else:
+                print("Bot started...")
+                bot.infinity_polling(timeout=60, long_polling_timeout=60)
+        except KeyboardInterrupt:
+            print("Bot stopped by user.")
+        finally:
+            expiry_scheduler.stop()
+            stop_services()